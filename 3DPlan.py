@@ -18,7 +18,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
 
-from lib.SemanticPass import SFMImage
+from lib.SemanticPass import SFMImage, SFMBatch
 from lib.utils import *
 from lib.MyTriangulation import Triang
 from lib.Metashape_SFM import MetaSFM
@@ -69,15 +69,30 @@ if __name__ == '__main__':
     # --- Construct the 4D images ---
     message('Enrich images with semantic information ...')
     if semantic_selection == 0:
-        message('Canny option was selected. Set the min and max values, using the trackbars, '
-                'and then press Q to edit the next image.')
-        for image in images:
-            SFMImage(path, image, simages=False, out=out[out_selection], blurmethod='GaussianBlur', edgemethod='Canny')
+        canny_selection = input_check('Tune each image (0), tune the first image and apply its thresholds to the rest '
+                                      '(1) or automatic thresholds (2)? (Write 0, 1 or 2): ', [0, 1, 2],
+                                      'Not a valid answer, please try again')
+        if canny_selection == 0:
+            message('Canny option was selected. Set the min and max values, using the trackbars, '
+                    'and then press Q to edit the next image.')
+            for image in images:
+                SFMImage(path, image, simages=False, out=out[out_selection], blurmethod='GaussianBlur',
+                         edgemethod='Canny')
+        elif canny_selection == 1 and len(images) > 0:
+            message('Canny option was selected. Set the min and max values, using the trackbars, '
+                    'and then press Q to apply them to all the images.')
+            tuned = SFMImage(path, images[0], simages=False, out=out[out_selection], blurmethod='GaussianBlur',
+                             edgemethod='Canny')
+            SFMBatch(path, images[1:], simages=False, out=out[out_selection], blurmethod='GaussianBlur',
+                     edgemethod='Canny', edge_thresholds=tuned.get_edge_thresholds())
+        elif canny_selection == 2:
+            message('Automatic Canny option was selected.')
+            SFMBatch(path, images, simages=False, out=out[out_selection], blurmethod='GaussianBlur',
+                     edgemethod='Canny', interactive=False)
     else:
         message('External semantic information option was selected.')
         simages = find_files(f'{path}/semantic_images', '.jpg')
-        for image in images:
-            SFMImage(path, image, simages=True, out=out[out_selection], edgemethod='Sematic_Info')
+        SFMBatch(path, images, simages=True, out=out[out_selection], edgemethod='Sematic_Info')
 
     sfm = ['Agisoft_Metashape', 'OpenSFM', 'MyTriangulation']
     sfm = sfm[SFM_selection]
@@ -117,10 +132,10 @@ if __name__ == '__main__':
         message('MyTriangulation implementation')
         Triang(capture='front')
         lines_env(parent_directory, method=2)
-        classify_points(f'{path}/Lines', 'merged.txt', 'edges', method=2)
+        classify_points(f'{path}/Lines', f'merged{cloud_suffix}', 'edges', method=2)
 
     # --- Line extraction ---
-    points = read_txt_coordinates_to_list('./Lines', 'edges.txt')
+    points = read_txt_coordinates_to_list('./Lines', f'edges{cloud_suffix}')
     dbscan(points, eps=0.01,  min_samples=10)
     
     '''
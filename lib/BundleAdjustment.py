@@ -0,0 +1,288 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program refines the cameras' poses, the shared intrinsics parameters and the 3D points (bundle adjustment).
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***The loss function, the standard deviations and the iterations follow the OpenSfM's configuration (lib.config).***
+
+"""
+
+import time
+
+import cv2 as cv
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.sparse import lil_matrix
+
+from lib.utils import message, error_message
+
+# The OpenSfM's (ceres) loss functions --> scipy's loss functions.
+loss_functions = {'TrivialLoss': 'linear', 'HuberLoss': 'huber', 'SoftLOneLoss': 'soft_l1', 'CauchyLoss': 'cauchy',
+                  'ArctanLoss': 'arctan'}
+
+# The standard deviation of the baseline's prior (relative to its length), which keeps the reconstruction's scale.
+baseline_sd = 1e-3
+
+
+def rotation_matrices(rotation_vectors):
+    """
+    This function converts the rotation vectors (axis * angle) to rotation matrices (Rodrigues' formula).
+    Args:
+        rotation_vectors (numpy array) = The rotation vectors (n x 3).
+
+    Returns:
+        rotations (numpy array) = The rotation matrices (n x 3 x 3).
+
+    """
+    angles = np.linalg.norm(rotation_vectors, axis=1)
+    axes = rotation_vectors / np.where(angles > 1e-12, angles, 1)[:, None]
+    skew = np.zeros((len(rotation_vectors), 3, 3))
+    skew[:, 0, 1], skew[:, 0, 2], skew[:, 1, 2] = -axes[:, 2], axes[:, 1], -axes[:, 0]
+    skew -= np.transpose(skew, (0, 2, 1))
+    return np.eye(3) + np.sin(angles)[:, None, None] * skew + \
+        (1 - np.cos(angles))[:, None, None] * np.matmul(skew, skew)
+
+
+def rotation_vectors(rotations):
+    """This function converts the rotation matrices (n x 3 x 3) to rotation vectors (n x 3)"""
+    return np.array([cv.Rodrigues(np.asarray(rotation, dtype=np.float64))[0].ravel() for rotation in rotations])
+
+
+class BundleAdjustment:
+    """
+        Name: BundleAdjustment
+
+        Description: BundleAdjustment class jointly refines the shots' poses, the cameras' intrinsics parameters (focal
+                     length and principal point, shared by the shots of each camera) and the 3D points, minimizing
+                     the reprojection errors by a robust loss (scipy's least_squares). Each observation depends only
+                     on its shot, camera and point, thus the Jacobian is sparse and its cost grows with the number of
+                     the observations. The fixed shots (i.e. the origin or the shots outside of a local window) and,
+                     optionally, the intrinsics are constants.
+                     The fixed shots set the rotation and the position of the reconstruction, while its scale is set by
+                     the fixed shots (at least two) or by a baseline's prior i.e. the distance of two shots' centers
+                     (baseline_sd), otherwise it is free and it drifts.
+
+        Parameters:
+            rotations:               The shots' rotations (shots x 3 x 3, world --> camera).
+            translations:            The shots' translations (shots x 3).
+            shot_cameras:            The camera of each shot (index of the intrinsics).
+            intrinsics:              The cameras' focal length and principal point (cameras x 3).
+            points:                  The 3D points (points x 3).
+            observation_shots:       The shot of each observation.
+            observation_points:      The point of each observation.
+            pixels:                  The observations (pixels x, y).
+            fixed_shots:             The shots, which are not refined (boolean).
+            optimize_intrinsics:     If the intrinsics parameters are refined.
+            config:                  The configuration (lib.config).
+            baseline:                The baseline's prior (first shot, second shot, distance of their centers), None for
+                                     no prior.
+
+        Functions:
+            --- Getters ---
+            get_rotations:           Get the refined rotations.
+            get_translations:        Get the refined translations.
+            get_intrinsics:          Get the refined intrinsics parameters.
+            get_points:              Get the refined points.
+            get_errors:              Get the reprojection error of each observation (radians).
+
+            --- Methods ---
+            pack:                    Returns the parameters' vector (the free shots, intrinsics and points).
+            unpack:                  Returns the shots, intrinsics and points of a parameters' vector.
+            project:                 Projects the observations' points into their shots (pixels).
+            residuals:               Returns the weighted reprojection errors, the intrinsics' and the baseline's priors.
+            baseline_prior:          Returns the baseline's prior residual.
+            sparsity:                Returns the Jacobian's sparsity structure.
+            optimize:                Runs the optimization.
+    """
+
+    def __init__(self, rotations, translations, shot_cameras, intrinsics, points, observation_shots,
+                 observation_points, pixels, fixed_shots=None, optimize_intrinsics: bool = True, config=None,
+                 baseline=None):
+        """Constructor"""
+        self.rotation_vectors = rotation_vectors(rotations)
+        self.translations = np.array(translations, dtype=np.float64).reshape(-1, 3)
+        self.shot_cameras = np.asarray(shot_cameras, dtype=np.int64)
+        self.intrinsics = np.array(intrinsics, dtype=np.float64).reshape(-1, 3)
+        self.prior_intrinsics = self.intrinsics.copy()
+        self.points = np.array(points, dtype=np.float64).reshape(-1, 3)
+        self.observation_shots = np.asarray(observation_shots, dtype=np.int64)
+        self.observation_points = np.asarray(observation_points, dtype=np.int64)
+        self.pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        self.fixed_shots = np.zeros(len(self.translations), dtype=bool) if fixed_shots is None else \
+            np.asarray(fixed_shots, dtype=bool)
+        self.optimize_intrinsics = optimize_intrinsics
+        self.baseline = baseline
+
+        if config['loss_function'] not in loss_functions:
+            error_message(f'The loss function must be one of {list(loss_functions)}', sysex=True)
+        self.loss = loss_functions[config['loss_function']]
+        self.loss_threshold = float(config['loss_function_threshold'])
+        self.reprojection_sd = float(config['reprojection_error_sd'])
+        self.focal_sd = float(config['exif_focal_sd'])
+        self.principal_point_sd = float(config['principal_point_sd'])
+        self.max_iterations = int(config['bundle_max_iterations'])
+
+        # The reprojection errors are angles i.e. pixels / focal length (the prior, thus the weights are constant).
+        self.observation_focals = self.prior_intrinsics[self.shot_cameras[self.observation_shots], 0]
+        self.free_shots = np.flatnonzero(~self.fixed_shots)
+
+        self.errors = np.empty(0)
+
+        # --- Pull the trigger ---
+        BundleAdjustment.optimize(self)
+
+    # --- Getters ---
+    def get_rotations(self):
+        return rotation_matrices(self.rotation_vectors)
+
+    def get_translations(self):
+        return self.translations
+
+    def get_intrinsics(self):
+        return self.intrinsics
+
+    def get_points(self):
+        return self.points
+
+    def get_errors(self):
+        return self.errors
+
+    # --- Methods ---
+    def pack(self):
+        """This function returns the parameters' vector i.e. the free shots (rotation vector, translation), the
+        intrinsics (if they are refined) and the points"""
+        shots = np.hstack((self.rotation_vectors[self.free_shots], self.translations[self.free_shots])).ravel()
+        intrinsics = self.intrinsics.ravel() if self.optimize_intrinsics else np.empty(0)
+        return np.concatenate((shots, intrinsics, self.points.ravel()))
+
+    def unpack(self, parameters):
+        """This function returns the shots (rotation vectors, translations), the intrinsics and the points of a
+        parameters' vector"""
+        shots_size = 6 * len(self.free_shots)
+        intrinsics_size = self.intrinsics.size if self.optimize_intrinsics else 0
+
+        rotations, translations = self.rotation_vectors.copy(), self.translations.copy()
+        shots = parameters[:shots_size].reshape(-1, 6)
+        rotations[self.free_shots], translations[self.free_shots] = shots[:, :3], shots[:, 3:]
+        intrinsics = parameters[shots_size:shots_size + intrinsics_size].reshape(-1, 3) \
+            if self.optimize_intrinsics else self.intrinsics
+        points = parameters[shots_size + intrinsics_size:].reshape(-1, 3)
+        return rotations, translations, intrinsics, points
+
+    def project(self, rotations, translations, intrinsics, points):
+        """This function projects the observations' points into their shots (pixels)"""
+        camera_points = np.einsum('oij,oj->oi', rotation_matrices(rotations)[self.observation_shots],
+                                  points[self.observation_points]) + translations[self.observation_shots]
+        depth = camera_points[:, 2]
+        depth = np.where(np.abs(depth) > 1e-12, depth, 1e-12)
+        observation_intrinsics = intrinsics[self.shot_cameras[self.observation_shots]]
+        return observation_intrinsics[:, :1] * camera_points[:, :2] / depth[:, None] + observation_intrinsics[:, 1:]
+
+    def residuals(self, parameters):
+        """This function returns the reprojection errors (in standard deviations), the intrinsics' and the baseline's
+        priors"""
+        rotations, translations, intrinsics, points = BundleAdjustment.unpack(self, parameters)
+        errors = (BundleAdjustment.project(self, rotations, translations, intrinsics, points) - self.pixels) / \
+            self.observation_focals[:, None] / self.reprojection_sd
+        residuals = [errors.ravel()]
+        if self.optimize_intrinsics:
+            # The focal length's prior is in log-scale and the principal point's prior is relative to the focal length.
+            residuals.append(np.log(intrinsics[:, 0] / self.prior_intrinsics[:, 0]) / self.focal_sd)
+            residuals.append(((intrinsics[:, 1:] - self.prior_intrinsics[:, 1:]) / self.prior_intrinsics[:, :1] /
+                              self.principal_point_sd).ravel())
+        if self.baseline is not None:
+            residuals.append(BundleAdjustment.baseline_prior(self, rotations, translations))
+        return np.concatenate(residuals)
+
+    def baseline_prior(self, rotations, translations):
+        """This function returns the baseline's prior residual i.e. the relative error of the distance of the two shots'
+        centers (in standard deviations)"""
+        first, second, distance = self.baseline
+        shots = [first, second]
+        centers = -np.einsum('sji,sj->si', rotation_matrices(rotations[shots]), translations[shots])
+        return np.array([(np.linalg.norm(centers[0] - centers[1]) - distance) / distance / baseline_sd])
+
+    def sparsity(self):
+        """
+            Returns the Jacobian's sparsity structure. The two residuals of each observation depend only on its shot
+            (6 parameters, if it is not fixed), its camera (3 parameters, if the intrinsics are refined) and its
+            point (3 parameters).
+
+            returns:
+                structure (scipy.sparse.lil_matrix): The non zero elements of the Jacobian.
+        """
+        observations = len(self.pixels)
+        shots_size = 6 * len(self.free_shots)
+        cameras = len(self.intrinsics)
+        intrinsics_size = 3 * cameras if self.optimize_intrinsics else 0
+        rows = 2 * observations + (3 * cameras if self.optimize_intrinsics else 0) + (self.baseline is not None)
+        structure = lil_matrix((rows, shots_size + intrinsics_size + self.points.size), dtype=np.int8)
+
+        observation_rows = 2 * np.arange(0, observations)
+        free_index = np.full(len(self.fixed_shots), -1)
+        free_index[self.free_shots] = np.arange(0, len(self.free_shots))
+        shots = free_index[self.observation_shots]
+        free = shots >= 0
+        for row in range(0, 2):
+            for column in range(0, 6):
+                structure[observation_rows[free] + row, 6 * shots[free] + column] = 1
+            for column in range(0, 3):
+                structure[observation_rows + row, shots_size + intrinsics_size + 3 * self.observation_points +
+                          column] = 1
+                if self.optimize_intrinsics:
+                    structure[observation_rows + row, shots_size + 3 * self.shot_cameras[self.observation_shots] +
+                              column] = 1
+
+        if self.optimize_intrinsics:
+            # The focal length's priors and then the principal point's priors (x, y) of each camera.
+            cameras_index = np.arange(0, cameras)
+            structure[2 * observations + cameras_index, shots_size + 3 * cameras_index] = 1
+            for column in range(1, 3):
+                structure[2 * observations + cameras + 2 * cameras_index + column - 1,
+                          shots_size + 3 * cameras_index + column] = 1
+
+        if self.baseline is not None:
+            # The baseline's prior depends on the two shots (if they are not fixed).
+            for shot in self.baseline[:2]:
+                if free_index[shot] >= 0:
+                    structure[rows - 1, 6 * free_index[shot] + np.arange(0, 6)] = 1
+        return structure
+
+    def optimize(self):
+        """This function runs the optimization and keeps the refined parameters and the reprojection errors"""
+        if len(self.pixels) == 0:
+            return
+        start = time.perf_counter()
+        before = np.linalg.norm(BundleAdjustment.project(self, self.rotation_vectors, self.translations,
+                                                         self.intrinsics, self.points) - self.pixels, axis=1)
+        parameters = BundleAdjustment.pack(self)
+        result = least_squares(lambda x: BundleAdjustment.residuals(self, x), parameters,
+                               jac_sparsity=BundleAdjustment.sparsity(self), loss=self.loss,
+                               f_scale=self.loss_threshold, x_scale='jac', method='trf', tr_solver='lsmr',
+                               ftol=1e-6, max_nfev=self.max_iterations)
+        self.rotation_vectors, self.translations, self.intrinsics, self.points = \
+            BundleAdjustment.unpack(self, result.x)
+        self.intrinsics = np.array(self.intrinsics)
+
+        projected = BundleAdjustment.project(self, self.rotation_vectors, self.translations, self.intrinsics,
+                                             self.points)
+        after = np.linalg.norm(projected - self.pixels, axis=1)
+        self.errors = after / self.observation_focals
+        message(f'Bundle adjustment of {len(self.free_shots)} shots, {len(self.points)} points and '
+                f'{len(self.pixels)} observations: mean reprojection error {before.mean():.3f} --> '
+                f'{after.mean():.3f} pixels ({result.nfev} evaluations, {time.perf_counter() - start:.2f} s)')
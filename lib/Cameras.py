@@ -0,0 +1,272 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program groups the images by camera and stores the images' metadata and the cameras' intrinsics parameters.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+
+import numpy as np
+import PIL.Image
+from PIL import ExifTags
+
+from lib.utils import error_message
+
+rgb_suffixes = ['.JPG', '.jpg', '.JPEG', '.jpeg', '.TIF', '.tif', '.TIFF', '.tiff', '.PNG', '.png']
+
+# Calibrated principal points (pixels) of known camera models, at their full resolution (width, height).
+principal_points = {('Canon EOS 6D', 5472, 3648): [2756, 1774]}
+
+
+class Camera:
+    """
+        Name: Camera
+
+        Description: Camera class stores the intrinsics parameters of a camera i.e. a camera body, lens and focal
+                     length combination. All the images of the camera share the same Camera object.
+
+        Parameters:
+            camera_id:               The camera's name (make, model, lens, focal length and size).
+            model:                   The camera's model (EXIF).
+            focal:                   The focal length (EXIF).
+            width:                   Images' width.
+            height:                  Images' height.
+            principal_point:         The principal point (calibrated or the central pixel).
+
+        Functions:
+            --- Getters ---
+            get_camera_id:           Get the camera's name.
+            get_camera_matrix:       Get the camera matrix.
+
+            --- Methods ---
+            to_dict:                 Returns the camera as a dictionary (json serializable).
+            from_dict:               Constructs a camera from a dictionary.
+    """
+
+    def __init__(self, camera_id: str = '', model: str = '', focal: float = 0, width: int = 0, height: int = 0,
+                 principal_point: list = None):
+        """Constructor"""
+        self.camera_id = camera_id
+        self.model = model
+        self.focal = focal
+        self.width = width
+        self.height = height
+        self.principal_point = principal_point if principal_point is not None else \
+            Camera.default_principal_point(model, width, height)
+
+        self.camera_matrix = np.array([[self.focal, 0, self.principal_point[0]],
+                                       [0, self.focal, self.principal_point[1]],
+                                       [0, 0, 1]])
+
+    def __repr__(self):
+        return f'Camera({self.camera_id})'
+
+    # --- Getters ---
+    def get_camera_id(self):
+        return self.camera_id
+
+    def get_camera_matrix(self):
+        return self.camera_matrix
+
+    # --- Methods ---
+    @staticmethod
+    def default_principal_point(model, width, height):
+        """This function returns the calibrated principal point of the model, otherwise the central pixel"""
+        if (model, width, height) in principal_points:
+            return list(principal_points[(model, width, height)])
+        if width < height:
+            return [height / 2, width / 2]
+        return [width / 2, height / 2]  # Sets principal point as the central pixel (Approximation)
+
+    def to_dict(self):
+        """This function returns the camera as a dictionary (json serializable)"""
+        return {'model': self.model, 'focal': self.focal, 'width': self.width, 'height': self.height,
+                'principal_point': list(self.principal_point)}
+
+    @staticmethod
+    def from_dict(camera_id, camera):
+        """This function constructs a camera from a dictionary"""
+        return Camera(camera_id, camera['model'], camera['focal'], camera['width'], camera['height'],
+                      camera['principal_point'])
+
+
+class CameraRegistry:
+    """
+        Name: CameraRegistry
+
+        Description: CameraRegistry class reads the EXIF metadata of each RGB image (./rgb) once and stores them into a
+                     json file, along with the cameras' intrinsics parameters. An image's metadata are read again only
+                     if its RGB image's size or modification time changed.
+
+        Parameters:
+            filename:                The json file, None to keep the registry only in memory.
+            directory:               The directory of the RGB images.
+
+        Functions:
+            --- Getters ---
+            get_filename:            Get the json file.
+            get_cameras:             Get the cameras (camera's name --> Camera).
+            get_images:              Get the images' metadata.
+
+            --- Methods ---
+            load:                    Loads the registry.
+            save:                    Saves the registry.
+            rgb_name:                Finds the RGB image of a 4D image (any suffix).
+            read_exif:               Reads the metadata of an RGB image.
+            image_info:              Returns the metadata of a 4D image.
+            camera:                  Returns the camera of a 4D image.
+
+            The 4D images (i.e. image.tiff) and the RGB images (i.e. image.JPG) share the same name.
+    """
+
+    def __init__(self, filename: str = 'cameras.json', directory: str = './rgb'):
+        """Constructor"""
+        self.filename = filename
+        self.directory = directory
+
+        self.cameras: dict = {}
+        self.images: dict = {}
+        self.changed: bool = False
+
+        # --- Pull the trigger ---
+        CameraRegistry.load(self)
+
+    # --- Getters ---
+    def get_filename(self):
+        return self.filename
+
+    def get_cameras(self):
+        return self.cameras
+
+    def get_images(self):
+        return self.images
+
+    # --- Methods ---
+    def load(self):
+        """This function loads the registry, if it exists"""
+        if self.filename is None or not os.path.isfile(self.filename):
+            return
+        with open(self.filename) as f:
+            registry = json.load(f)
+        self.images = registry.get('images', {})
+        self.cameras = {camera_id: Camera.from_dict(camera_id, camera)
+                        for camera_id, camera in registry.get('cameras', {}).items()}
+
+    def save(self):
+        """This function saves the registry, if it changed"""
+        if self.filename is None or not self.changed:
+            return
+        registry = {'cameras': {camera_id: camera.to_dict() for camera_id, camera in self.cameras.items()},
+                    'images': self.images}
+        temporary = f'{self.filename}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(registry, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.filename)
+        self.changed = False
+
+    def rgb_name(self, imagename):
+        """This function finds the RGB image of a 4D image i.e. image.tiff --> image.JPG"""
+        stem = os.path.splitext(imagename)[0]
+        for suffix in rgb_suffixes:
+            if os.path.isfile(f'{self.directory}/{stem}{suffix}'):
+                return f'{stem}{suffix}'
+        error_message(f'There is not an RGB image of {imagename} into {self.directory}', sysex=True)
+
+    @staticmethod
+    def read_exif(filename):
+        """
+            Reads the metadata of an RGB image.
+
+            args:
+                filename (str): The RGB image.
+
+            returns:
+                exif (dict):    The make, model, lens, focal length, size, timestamp and GPS position (latitude,
+                                longitude, altitude) of the image. The missing values are None.
+        """
+        with PIL.Image.open(filename) as image:
+            exif = image._getexif() if hasattr(image, '_getexif') else None
+            size = image.size
+        tags = {ExifTags.TAGS.get(k, k): v for k, v in (exif or {}).items()}
+        gps = tags.get('GPSInfo') if isinstance(tags.get('GPSInfo'), dict) else {}
+        gps = {ExifTags.GPSTAGS.get(k, k): v for k, v in gps.items()}
+
+        def text(value):
+            return str(value).strip().strip('\x00') if value is not None else None
+
+        def number(value):
+            return float(value) if value is not None else None
+
+        def degrees(value, reference):
+            if value is None:
+                return None
+            value = float(value[0]) + float(value[1]) / 60 + float(value[2]) / 3600
+            return -value if reference in ('S', 'W') else value
+
+        altitude = number(gps.get('GPSAltitude'))
+        if altitude is not None and gps.get('GPSAltitudeRef') in (1, b'\x01'):
+            altitude = -altitude
+
+        return {'make': text(tags.get('Make')),
+                'model': text(tags.get('Model')),
+                'lens': text(tags.get('LensModel')),
+                'focal': number(tags.get('FocalLength')),
+                'width': int(tags.get('ExifImageWidth', size[0])),
+                'height': int(tags.get('ExifImageHeight', size[1])),
+                'timestamp': text(tags.get('DateTimeOriginal', tags.get('DateTime'))),
+                'gps': [degrees(gps.get('GPSLatitude'), gps.get('GPSLatitudeRef')),
+                        degrees(gps.get('GPSLongitude'), gps.get('GPSLongitudeRef')),
+                        altitude] if 'GPSLatitude' in gps and 'GPSLongitude' in gps else None}
+
+    def image_info(self, imagename):
+        """
+            Returns the metadata of a 4D image, reading its RGB image's EXIF only if it is not registered or changed.
+
+            args:
+                imagename (str): The 4D image's name.
+
+            returns:
+                info (dict):     The RGB image's name, size and modification time, its metadata (see read_exif) and
+                                 its camera's name.
+        """
+        rgbname = CameraRegistry.rgb_name(self, imagename)
+        stat = os.stat(f'{self.directory}/{rgbname}')
+        info = self.images.get(imagename)
+        if info is not None and info['rgb'] == rgbname and info['size'] == stat.st_size \
+                and info['mtime'] == stat.st_mtime:
+            return info
+
+        exif = CameraRegistry.read_exif(f'{self.directory}/{rgbname}')
+        if exif['focal'] is None:
+            error_message(f'{rgbname} has not a focal length (EXIF)', sysex=True)
+        make = exif['make'] if exif['make'] and not str(exif['model']).startswith(exif['make']) else None
+        camera_id = ' '.join(str(value) for value in (make, exif['model'], exif['lens'],
+                                                       f'{exif["focal"]:g}mm', f'{exif["width"]}x{exif["height"]}')
+                             if value is not None)
+        if camera_id not in self.cameras:
+            self.cameras[camera_id] = Camera(camera_id, exif['model'], exif['focal'], exif['width'], exif['height'])
+
+        info = {'rgb': rgbname, 'size': stat.st_size, 'mtime': stat.st_mtime, 'exif': exif, 'camera': camera_id}
+        self.images[imagename] = info
+        self.changed = True
+        return info
+
+    def camera(self, imagename):
+        """This function returns the camera (Camera) of a 4D image"""
+        return self.cameras[CameraRegistry.image_info(self, imagename)['camera']]
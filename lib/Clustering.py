@@ -54,16 +54,11 @@ def dbscan(points, eps=0.001, min_samples=10):
     message(f'Estimated number of clusters: {n_clusters_}')
     message(f'Estimated number of noise points: {n_noise_}')
 
-    # Save points' coordinates with label linked to their cluster:
-    cleararchive(f'{Path(os.getcwd())}/Lines/LinesLabels.txt')
-    cleararchive(f'{Path(os.getcwd())}/Lines/noisepoints.txt')
-    for i in range(0, len(labels)):
-        if labels[i] != -1:
-            line = f'{points[i][0]} {points[i][1]} {points[i][2]} {labels[i]}\n'
-            write_a_file(f'{Path(os.getcwd())}/Lines', 'LinesLabels', '.txt', line)
-        else:
-            line = f'{points[i][0]} {points[i][1]} {points[i][2]} {labels[i]}\n'
-            write_a_file(f'{Path(os.getcwd())}/Lines', 'noisepoints', '.txt', line)
+    # Save points' coordinates with label linked to their cluster (config's point_cloud_format):
+    clusters = cloud_array(points, labels, [('cluster', '<i4')])
+    noise = labels == -1
+    write_cloud(f'{Path(os.getcwd())}/Lines/LinesLabels{cloud_suffix}', clusters[~noise])
+    write_cloud(f'{Path(os.getcwd())}/Lines/noisepoints{cloud_suffix}', clusters[noise])
 
     # Save each cluster as .ply archive, execute RANSAC algorithm and add the detected lines to 3DPlan.dxf:
     lines = []
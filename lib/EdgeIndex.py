@@ -0,0 +1,167 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program stores the edge pixels i.e. label = 255, of each 4 channel image into a compact sidecar archive.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+
+import numpy as np
+
+
+class EdgeIndex:
+    """
+        Name: EdgeIndex
+
+        Description: EdgeIndex class stores the edge pixels of an image as packed coordinates with a row index i.e.
+                     the columns of the edge pixels sorted by row (xs) and the position of each row's first edge pixel
+                     (indptr). Thus the edge pixels of row y are xs[indptr[y]:indptr[y + 1]].
+
+        Parameters:
+            shape:                   Image's shape (height, width).
+            indptr:                  The row index (height + 1 values).
+            xs:                      The columns of the edge pixels, sorted by row and column.
+            value:                   The label value of the edge pixels.
+
+        Functions:
+            --- Getters ---
+            get_shape:               Get image's shape.
+            get_count:               Get the number of the edge pixels.
+
+            --- Methods ---
+            from_labels:             Constructs the index of a label channel.
+            strip_entries:           Finds the edge pixels of a strip of the label channel.
+            from_entries:            Constructs the index from the strips' entries.
+            sidecar_name:            Returns the sidecar archive's name of an image.
+            save:                    Saves the index as a compressed .npz archive.
+            load:                    Loads an index archive.
+            contains:                Checks if the given points are edge pixels.
+            region:                  Lists the edge pixels of a region.
+            points:                  Lists all the edge pixels.
+    """
+
+    def __init__(self, shape: tuple = (0, 0), indptr=None, xs=None, value: int = 255):
+        """Constructor"""
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.indptr = indptr if indptr is not None else np.zeros(self.shape[0] + 1, dtype=np.int64)
+        self.xs = xs if xs is not None else np.zeros(0, dtype=np.uint16)
+        self.value = value
+
+        self.keys: list = []
+
+    # --- Getters ---
+    def get_shape(self):
+        return self.shape
+
+    def get_count(self):
+        return len(self.xs)
+
+    # --- Methods ---
+    @staticmethod
+    def from_labels(labels, value=255):
+        """This function constructs the index of a label channel"""
+        return EdgeIndex.from_entries(labels.shape[:2], [EdgeIndex.strip_entries(labels, value)], value)
+
+    @staticmethod
+    def strip_entries(labels, value=255):
+        """
+            Finds the edge pixels of a strip of the label channel.
+
+            args:
+                labels (numpy array): The label channel's strip (rows x width).
+                value (int):          The label value of the edge pixels.
+
+            returns:
+                entries (tuple):      The number of edge pixels of each row and their columns.
+        """
+        ys, xs = np.nonzero(labels == value)
+        dtype = np.uint16 if labels.shape[1] <= np.iinfo(np.uint16).max else np.uint32
+        return np.bincount(ys, minlength=labels.shape[0]), xs.astype(dtype)
+
+    @staticmethod
+    def from_entries(shape, entries, value=255):
+        """This function constructs the index from the strips' entries (in row order)"""
+        counts = np.concatenate([entry[0] for entry in entries]) if entries else np.zeros(0, dtype=np.int64)
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts)
+        xs = np.concatenate([entry[1] for entry in entries]) if entries else np.zeros(0, dtype=np.uint16)
+        return EdgeIndex(shape, indptr, xs, value)
+
+    @staticmethod
+    def sidecar_name(imagename):
+        """This function returns the sidecar archive's name of an image i.e. image.tiff --> image.edges.npz"""
+        return f'{os.path.splitext(imagename)[0]}.edges.npz'
+
+    def save(self, filename):
+        """This function saves the index as a compressed .npz archive"""
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, shape=np.array(self.shape), indptr=self.indptr, xs=self.xs,
+                                value=np.array(self.value))
+
+    @staticmethod
+    def load(filename):
+        """This function loads an index archive"""
+        with np.load(filename) as archive:
+            return EdgeIndex(tuple(archive['shape']), archive['indptr'], archive['xs'], int(archive['value']))
+
+    def contains(self, xs, ys):
+        """
+            Checks if the given points are edge pixels.
+
+            args:
+                xs (numpy array): The points' columns (rounded to the nearest pixel).
+                ys (numpy array): The points' rows (rounded to the nearest pixel).
+
+            returns:
+                inside (numpy array): True for the points which are edge pixels.
+        """
+        xs = np.rint(np.asarray(xs)).astype(np.int64)
+        ys = np.rint(np.asarray(ys)).astype(np.int64)
+        height, width = self.shape
+        if len(self.xs) == 0:
+            return np.zeros(xs.shape, dtype=bool)
+        if len(self.keys) != len(self.xs):
+            # The pixels' keys (y * width + x) are sorted, thus they are searched with a binary search.
+            rows = np.repeat(np.arange(height, dtype=np.int64), np.diff(self.indptr))
+            self.keys = rows * width + self.xs
+
+        valid = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        queries = ys * width + xs
+        positions = np.minimum(np.searchsorted(self.keys, queries), len(self.keys) - 1)
+        return valid & (self.keys[positions] == queries)
+
+    def region(self, x0, y0, x1, y1):
+        """
+            Lists the edge pixels of a region i.e. x0 <= x < x1 and y0 <= y < y1.
+
+            returns:
+                xs, ys (numpy arrays): The columns and the rows of the region's edge pixels.
+        """
+        y0 = max(int(y0), 0)
+        y1 = min(int(y1), self.shape[0])
+        if y1 <= y0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        xs = self.xs[self.indptr[y0]:self.indptr[y1]].astype(np.int64)
+        ys = np.repeat(np.arange(y0, y1, dtype=np.int64), np.diff(self.indptr[y0:y1 + 1]))
+        inside = (xs >= x0) & (xs < x1)
+        return xs[inside], ys[inside]
+
+    def points(self):
+        """This function lists all the edge pixels (xs, ys)"""
+        return EdgeIndex.region(self, 0, 0, self.shape[1], self.shape[0])
@@ -0,0 +1,128 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program encodes and saves the 3 and 4 channel images, which are used into SfM-MVS workflow.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import cv2
+import numpy as np
+
+from lib.utils import error_message
+
+# The TIFF tag and values of the compression (same as cv2.IMWRITE_TIFF_COMPRESSION, which older OpenCV lack).
+tiff_compression_tag = 259
+tiff_compressions = {'none': 1, 'lzw': 5, 'deflate': 8}
+suffixes = {'tiff': '.tiff', 'png': '.png', 'jpg': '.JPG'}
+
+
+class ImageEncoder:
+    """
+        Name: ImageEncoder
+
+        Description: ImageEncoder class encodes and saves the output images with a selectable format, compression
+                     and bit depth.
+
+        Parameters:
+            fmt:                     The format of the images ('tiff', 'png' or 'jpg').
+            compression:             TIFF compression ('none', 'lzw', 'deflate' or None for the OpenCV default, which
+                                     is lzw).
+            depth:                   Bits per sample (8 or 16). The 16 bit images are scaled i.e. 255 --> 65535.
+            level:                   PNG compression level (0-9) or JPEG quality (0-100). None for the OpenCV default.
+
+        Functions:
+            --- Getters ---
+            get_fmt:                 Get the format.
+            get_suffix:              Get the suffix of the saved images.
+
+            --- Methods ---
+            params:                  Returns the cv2.imwrite/cv2.imencode parameters.
+            convert:                 Converts the image to the selected bit depth.
+            encode:                  Encodes the image into memory.
+            write:                   Saves the image.
+            describe:                Returns the encoder's settings as a dictionary.
+
+            The 4D images must be saved as 8 bit TIFF archives to be used by MyTriangulation and the Agisoft-Metashape
+            and OpenSfM approaches. The other settings are useful for archiving or for external tools.
+    """
+
+    def __init__(self, fmt: str = 'tiff', compression: str = None, depth: int = 8, level: int = None):
+        """Constructor"""
+        if fmt not in suffixes:
+            error_message(f'Unknown format {fmt}, the valid formats are {list(suffixes)}', sysex=True)
+        if compression is not None and (fmt != 'tiff' or compression not in tiff_compressions):
+            error_message(f'The compression must be one of {list(tiff_compressions)} and only for tiff', sysex=True)
+        if depth not in [8, 16] or (depth == 16 and fmt == 'jpg'):
+            error_message('The depth must be 8 or 16 (16 is not available for jpg)', sysex=True)
+
+        self.fmt = fmt
+        self.compression = compression
+        self.depth = depth
+        self.level = level
+
+    def __repr__(self):
+        return f'ImageEncoder({ImageEncoder.describe(self)})'
+
+    # --- Getters ---
+    def get_fmt(self):
+        return self.fmt
+
+    def get_suffix(self):
+        return suffixes[self.fmt]
+
+    # --- Methods ---
+    def params(self):
+        """This function returns the cv2.imwrite/cv2.imencode parameters"""
+        params = []
+        if self.fmt == 'tiff' and self.compression is not None:
+            params += [tiff_compression_tag, tiff_compressions[self.compression]]
+        elif self.fmt == 'png' and self.level is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, self.level]
+        elif self.fmt == 'jpg' and self.level is not None:
+            params += [cv2.IMWRITE_JPEG_QUALITY, self.level]
+        return params
+
+    def convert(self, image):
+        """This function converts the image to the selected bit depth"""
+        if self.depth == 16 and image.dtype == np.uint8:
+            return image.astype(np.uint16) * 257
+        return image
+
+    def encode(self, image):
+        """
+            Encodes the image into memory.
+
+            args:
+                image (numpy array): The image (8 bit, BGR(A) order).
+
+            returns:
+                data (numpy array):  The encoded bytes.
+        """
+        done, data = cv2.imencode(ImageEncoder.get_suffix(self), ImageEncoder.convert(self, image),
+                                  ImageEncoder.params(self))
+        if not done:
+            error_message(f'The image could not be encoded with {self}', sysex=True)
+        return data
+
+    def write(self, filename, image):
+        """This function saves the image"""
+        if not cv2.imwrite(filename, ImageEncoder.convert(self, image), ImageEncoder.params(self)):
+            error_message(f'{filename} could not be saved with {self}', sysex=True)
+
+    def describe(self):
+        """This function returns the encoder's settings as a dictionary"""
+        return {'fmt': self.fmt, 'compression': self.compression, 'depth': self.depth, 'level': self.level}
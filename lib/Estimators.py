@@ -0,0 +1,110 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program estimates the two-view geometry (essential or fundamental matrix) by a selectable robust estimator.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***The RANSAC and USAC estimators stop as soon as the confidence is reached for the current inliers' ratio, while the
+LMEDS estimator does not use the threshold and it does not adapt to the inliers' ratio.***
+
+"""
+
+import cv2 as cv
+import numpy as np
+
+from lib.utils import error_message
+
+# The robust estimators of the OpenCV build i.e. the USAC variants are available from OpenCV 4.5.
+robust_estimators = {'LMEDS': cv.LMEDS, 'RANSAC': cv.RANSAC}
+for usac in ['USAC_DEFAULT', 'USAC_PARALLEL', 'USAC_FAST', 'USAC_ACCURATE', 'USAC_PROSAC', 'USAC_MAGSAC',
+             'USAC_FM_8PTS']:
+    if hasattr(cv, usac):
+        robust_estimators[usac] = getattr(cv, usac)
+
+# The estimators, which are available only for the fundamental matrix.
+fundamental_estimators = ['USAC_FM_8PTS']
+
+
+def available_estimators(fundamental: bool = False):
+    """This function returns the robust estimators of the OpenCV build, for the essential or the fundamental matrix"""
+    return [name for name in robust_estimators if fundamental or name not in fundamental_estimators]
+
+
+def check_estimator(estimator, fundamental: bool = False):
+    """This function exits if the estimator is not available for the essential (or the fundamental) matrix"""
+    if estimator not in available_estimators(fundamental):
+        error_message(f'The robust estimator {estimator} is not available, the available estimators are '
+                      f'{available_estimators(fundamental)}', sysex=True)
+
+
+def essential_matrix(points1, points2, camera_matrix, estimator: str = 'RANSAC', threshold: float = 1.0,
+                     confidence: float = 0.999):
+    """
+    This function estimates the essential matrix of corresponding (float) points, by a robust estimator.
+    Args:
+        points1 (numpy array)       = The points of the first image (x, y).
+        points2 (numpy array)       = The corresponding points of the second image (x, y).
+        camera_matrix (numpy array) = The camera matrix.
+        estimator (str)             = The robust estimator (see available_estimators).
+        threshold (float)           = The maximum distance (pixels) of an inlier from its epipolar line.
+        confidence (float)          = The confidence, which stops the RANSAC and USAC estimators.
+
+    Returns:
+        essential_matrix (numpy array) = The essential matrix (3 x 3), [] if it is not estimated.
+        mask (numpy array)             = The inliers (boolean).
+
+    """
+    check_estimator(estimator)
+    points1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+    points2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+    if len(points1) < 5:
+        return [], np.zeros(len(points1), dtype=bool)
+
+    matrix, mask = cv.findEssentialMat(points1, points2, np.asarray(camera_matrix, dtype=np.float64),
+                                       robust_estimators[estimator], confidence, threshold)
+    if matrix is None or mask is None:
+        return [], np.zeros(len(points1), dtype=bool)
+    # The 5-point algorithm may return more than one solution (stacked), the first is kept.
+    return matrix[:3], mask.ravel() != 0
+
+
+def fundamental_matrix(points1, points2, estimator: str = 'RANSAC', threshold: float = 1.0,
+                       confidence: float = 0.999):
+    """
+    This function estimates the fundamental matrix of corresponding (float) points, by a robust estimator.
+    Args:
+        points1 (numpy array) = The points of the first image (x, y).
+        points2 (numpy array) = The corresponding points of the second image (x, y).
+        estimator (str)       = The robust estimator (see available_estimators(fundamental=True)).
+        threshold (float)     = The maximum distance (pixels) of an inlier from its epipolar line.
+        confidence (float)    = The confidence, which stops the RANSAC and USAC estimators.
+
+    Returns:
+        fundamental_matrix (numpy array) = The fundamental matrix (3 x 3), [] if it is not estimated.
+        mask (numpy array)               = The inliers (boolean).
+
+    """
+    check_estimator(estimator, fundamental=True)
+    points1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+    points2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+    if len(points1) < 8:
+        return [], np.zeros(len(points1), dtype=bool)
+
+    matrix, mask = cv.findFundamentalMat(points1, points2, robust_estimators[estimator], threshold, confidence)
+    if matrix is None or mask is None:
+        return [], np.zeros(len(points1), dtype=bool)
+    return matrix[:3], mask.ravel() != 0
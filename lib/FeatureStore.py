@@ -0,0 +1,98 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program stores the extracted feature points of each image, thus they are not extracted again.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class FeatureStore:
+    """
+        Name: FeatureStore
+
+        Description: FeatureStore class stores, for each image, the feature points (x, y, size, angle), the
+                     descriptors and the sampled colours into a compressed .npz archive. Each archive is named after a
+                     key, which combines the image's content hash with the detector's name and parameters, thus a
+                     changed image or configuration is a different key.
+
+        Parameters:
+            directory:               The directory of the archives.
+
+        Functions:
+            --- Getters ---
+            get_directory:           Get the directory of the archives.
+
+            --- Methods ---
+            key:                     Returns the key of an image, detector and detector's parameters.
+            filename:                Returns the archive's name of a key.
+            load:                    Loads the arrays of a key, or None if they are not stored.
+            save:                    Saves the arrays of a key.
+    """
+
+    def __init__(self, directory: str = 'features'):
+        """Constructor"""
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    # --- Getters ---
+    def get_directory(self):
+        return self.directory
+
+    # --- Methods ---
+    @staticmethod
+    def key(image_hash, method, parameters):
+        """
+            Returns the key of an image, detector and detector's parameters.
+
+            args:
+                image_hash (str):  The image's content hash.
+                method (str):      The detector's name.
+                parameters (dict): The detector's parameters (json serializable).
+
+            returns:
+                key (str):         The key (sha1 hexadecimal digest).
+        """
+        description = json.dumps({'image': image_hash, 'method': method, 'parameters': parameters}, sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def filename(self, key):
+        """This function returns the archive's name of a key"""
+        return f'{self.directory}/{key}.npz'
+
+    def load(self, key):
+        """This function loads the arrays of a key, or None if they are not stored"""
+        filename = FeatureStore.filename(self, key)
+        if not os.path.isfile(filename):
+            return None
+        with np.load(filename) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    def save(self, key, **arrays):
+        """This function saves the arrays of a key"""
+        filename = FeatureStore.filename(self, key)
+        # The archive is written under a temporary name and then renamed, thus parallel workers never read a
+        # partially written archive.
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temporary, filename)
@@ -24,15 +24,18 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import numpy as np
-import PIL
-from lib.utils import message
+from lib.utils import message, file_hash
 import cv2 as cv
-from PIL import ExifTags, Image
 
+from lib.Cameras import CameraRegistry
 from lib.config import default_config
+from lib.FeatureStore import FeatureStore
+from lib.Tiff import memmap_tiff
 
 config = default_config()
 
+thumbnail_size = 16  # The side of the thumbnail, which is used as a global image descriptor.
+
 
 class Image:
     """
@@ -51,9 +54,11 @@ class Image:
             set_principal_point:           Set image's principal point.
             set_camera_matrix:             Set image's camera matrix.
             set_feature_extraction_method: Set different feature extraction method.
+            set_store:                     Set the feature store.
+            set_features:                  Set image's features (see features).
 
             --- Getters ---
-            get_array:                     Get image's channels.
+            get_array:                     Get image's channels (read again from the disk, if they are released).
             get_imagename:                 Get image's name.
             get_imgid:                     Get image's id.
             get_focal:                     Get focal length.
@@ -62,24 +67,55 @@ class Image:
             get_camera_model:              Get camera's model.
             get_principal_point:           Get image's principal point.
             get_camera_matrix:             Get the camera matrix.
+            get_camera:                    Get image's camera (shared by the images of the same camera).
             get_feature_extraction_method: Get the feature extraction method (Akaze, Sift, Surf, ORB).
+            get_feature_key:               Get the feature store's key of the image.
+            get_thumbnail:                 Get image's global descriptor (see thumbnail_descriptor).
 
             --- Methods ---
-            image_exif:                    Extracts image's metadata.
+            image_exif:                    Gets image's metadata from the camera registry.
             camera_matrix:                 Calculates image's camera matrix.
             akaze:                         Extracts image's features using Akaze algorithm.
             sift:                          Extracts image's features using Sift algorithm.
             surf:                          Extracts image's features using Surf algorithm.
             orb:                           Extracts image's features using ORB algorithm.
+            processing_array:              Resizes image's array according to the feature_process_size.
+            full_resolution_points:        Maps the points of the resized array to image's array.
+            suppress_points:               Keeps a limited number of well spread points (adaptive suppression).
+            thumbnail_descriptor:          Computes image's global descriptor (normalized gray thumbnail).
+            detector_parameters:           Returns the configuration parameters of the feature extraction method.
+            load_features:                 Loads image's features from the feature store.
+            save_features:                 Saves image's features into the feature store.
+            features:                      Returns image's features as numpy arrays.
+            load_array:                    Reads image's channels.
+            release_array:                 Releases image's channels.
+            sample:                        Returns the channels of the given pixels.
+            sample_points:                 Returns the channels of all the key points' pixels (sampled once).
             save_label_channel:            Saves image's 4th channel i.e. labels.
 
             The feature extraction methods impelementation, they are similar to OpenSfM sofware (https://github.com/mapillary/OpenSfM/blob/master/opensfm/features.py)
             The configuration file (lib.config) is the OpenSfM's one.
+            The points of each method are stored as an array of (x, y, size, angle).
+            The features are extracted on a copy of the array resized to the configuration's feature_process_size
+            (longest side), while the points, the colours and the camera matrix refer to the full resolution array.
+            If the configuration's feature_use_adaptive_suppression is set, at most feature_max_frames points are kept
+            per image, spread over a grid of cells (see suppress_points).
+            If a feature store (FeatureStore) is given, the features are loaded from it when the image and the
+            method's parameters have not changed.
+            If the features are given (i.e. extracted by an extract_features worker process), the feature extraction is
+            skipped.
+            The metadata are read from the camera registry (CameraRegistry), thus the EXIF of each RGB image is read
+            once and the images of the same camera share its intrinsics parameters (Camera).
+            Image's channels are read only for the feature extraction and they are released afterwards. Then, the
+            sampled pixels are read from the disk, through a memory map if the image is an uncompressed TIFF archive.
+            A compressed archive (i.e. the default OpenCV LZW 4D image) is decoded by each sample call, thus the pairs
+            sample the key points' pixels once per image (see sample_points).
     """
 
-    def __init__(self, imgname, method):
+    def __init__(self, imgname, method, store: FeatureStore = None, features: dict = None,
+                 cameras: CameraRegistry = None):
         """Constructor"""
-        self.array = cv.imread(f'./images/{imgname}', cv.IMREAD_UNCHANGED)
+        self.array: list = []
         self.imagename = imgname
         self.imgid: int = 0
 
@@ -95,25 +131,49 @@ class Image:
         self.points: list = []
         self.descriptors: list = []
         self.color: list = []
+        self.thumbnail: list = []
+        self.point_pixels: list = []
+
+        self.process_array: list = []
+        self.process_scale: float = 1.0
+
+        # --- Feature Store Variables ---
+        self.store = store
+        self.feature_key: str = ''
 
         # --- Camera Matrix Variables ---
+        self.cameras = cameras if cameras is not None else CameraRegistry(None)
+        self.camera = None
         self.principal_point: list = []
         self.camera_matrix: list = []
 
         # --- Pull the trigger ---
         Image.camera_matrix(self)
 
-        if method == 'Akaze':
-            Image.akaze(self)
+        if features is not None:
+            Image.set_features(self, features)
+            return
+
+        if not Image.load_features(self):
+            Image.load_array(self)
+            Image.processing_array(self)
 
-        if method == 'Sift':
-            Image.sift(self)
+            if method == 'Akaze':
+                Image.akaze(self)
 
-        if method == 'Surf':
-            Image.surf(self)
+            if method == 'Sift':
+                Image.sift(self)
 
-        if method == 'ORB':
-            Image.orb(self)
+            if method == 'Surf':
+                Image.surf(self)
+
+            if method == 'ORB':
+                Image.orb(self)
+
+            self.process_array = []
+            Image.thumbnail_descriptor(self)
+            Image.release_array(self)
+            Image.save_features(self)
 
     # --- Setters ---
     def set_imagename(self, name):
@@ -140,8 +200,20 @@ class Image:
     def set_feature_extraction_method(self, method):
         self.feature_extraction_method = method
 
+    def set_store(self, store):
+        self.store = store
+
+    def set_features(self, features):
+        self.points = features['points']
+        self.descriptors = features['descriptors']
+        self.color = features['color']
+        self.feature_key = str(features['feature_key'])
+        self.thumbnail = features['thumbnail']
+
     # --- Getters ---
     def get_array(self):
+        if len(self.array) == 0:
+            return cv.imread(f'./images/{self.imagename}', cv.IMREAD_UNCHANGED)
         return self.array
 
     def get_imagename(self):
@@ -168,60 +240,53 @@ class Image:
     def get_camera_matrix(self):
         return self.camera_matrix
 
+    def get_camera(self):
+        return self.camera
+
     def get_feature_extraction_method(self):
         return self.feature_extraction_method
 
-    # --- Methods ---
-    def image_exif(self, suffix):
-        """
-            This function extracts image's metadata.
-
-            args:
-                suffix (str): 3 channel image's suffix i.e. (.JPG, .jpg, .tif etc.)
-        """
-        image = PIL.Image.open(f'./rgb/{self.imagename[:-5]}{suffix}')
+    def get_feature_key(self):
+        return self.feature_key
 
-        exif = {ExifTags.TAGS[k]: v for k, v in image._getexif().items() if k in ExifTags.TAGS}
+    def get_thumbnail(self):
+        return self.thumbnail
 
-        # print (exif) # Uncomment for Debugging.
-        print(exif.get('FocalLength'))  # Uncomment for Debugging.
-        self.focal = exif.get('FocalLength')
-        self.width = exif.get('ExifImageWidth')
-        self.height = exif.get('ExifImageHeight')
-        self.camera_model = exif.get('Model ')
+    # --- Methods ---
+    def image_exif(self):
+        """This function gets image's metadata and camera from the camera registry (the RGB image, any suffix)"""
+        self.camera = self.cameras.camera(self.imagename)
 
-        if self.camera_model == 'Canon EOS 6D':
-            self.principal_point = [2756, 1774]
-        else:
-            if self.width > self.height:
-                self.principal_point = [self.width / 2,
-                                        self.height / 2]  # Sets principal point as the central pixel (Approximation)
-            elif self.width < self.height:
-                self.principal_point = [self.height / 2, self.width / 2]
+        self.focal = self.camera.focal
+        self.width = self.camera.width
+        self.height = self.camera.height
+        self.camera_model = self.camera.model
+        self.principal_point = self.camera.principal_point
 
     def camera_matrix(self):
-        """Calculates the camera matrix"""
-        Image.image_exif(self, '.JPG')
+        """Gets the camera matrix of image's camera"""
+        Image.image_exif(self)
 
-        camera_matrix = [[self.focal, 0, self.principal_point[0]],
-                         [0, self.focal, self.principal_point[1]],
-                         [0, 0, 1]]
-
-        self.camera_matrix = np.array(camera_matrix)
+        self.camera_matrix = self.camera.get_camera_matrix()
 
     def akaze(self):
         """Implements the AKAZE algorithm"""
         method = cv.AKAZE_create()
 
-        self.points, self.descriptors = method.detectAndCompute(self.array, None)
+        if config['feature_use_adaptive_suppression']:
+            # Only the kept points are described, as the other detectors.
+            points = method.detect(self.process_array)
+            points = Image.suppress_points(self, points)
+            self.points, self.descriptors = method.compute(self.process_array, points)
+        else:
+            self.points, self.descriptors = method.detectAndCompute(self.process_array, None)
 
         message(f'Found {len(self.points)} key points on image {self.imagename} using Akaze method')
+        self.points = np.array([(i.pt[0], i.pt[1], i.size, i.angle) for i in self.points])
+        Image.full_resolution_points(self)
 
-        pts = [self.points[idx].pt for idx in range(0, len(self.points))]
-        pts = np.array(pts)
-
-        xs = pts[:, 0].round().astype(int)
-        ys = pts[:, 1].round().astype(int)
+        xs = self.points[:, 0].round().astype(int)
+        ys = self.points[:, 1].round().astype(int)
         color = self.array[ys, xs]
         self.color = np.array(color)
 
@@ -240,10 +305,12 @@ class Image:
         descriptor = detector
         detector = cv.xfeatures2d.SIFT_create()
 
-        points = detector.detect(self.array)
-        self.points, self.descriptors = descriptor.compute(self.array, points)
+        points = detector.detect(self.process_array)
+        points = Image.suppress_points(self, points)
+        self.points, self.descriptors = descriptor.compute(self.process_array, points)
         message(f'Found {len(points)} key points on image {self.imagename} using sift method')
         self.points = np.array([(i.pt[0], i.pt[1], i.size, i.angle) for i in self.points])
+        Image.full_resolution_points(self)
 
         xs = self.points[:, 0].round().astype(int)
         ys = self.points[:, 1].round().astype(int)
@@ -267,11 +334,13 @@ class Image:
         detector.setUpright(config['surf_upright'])
         detector.setHessianThreshold(surf_hessian_threshold)
 
-        points = detector.detect(self.array)
+        points = detector.detect(self.process_array)
+        points = Image.suppress_points(self, points)
 
-        self.points, self.descriptors = descriptor.compute(self.array, points)
+        self.points, self.descriptors = descriptor.compute(self.process_array, points)
         message(f'Found {len(self.points)} key points on image {self.imagename} using surf method')
         self.points = np.array([(i.pt[0], i.pt[1], i.size, i.angle) for i in self.points])
+        Image.full_resolution_points(self)
 
         xs = self.points[:, 0].round().astype(int)
         ys = self.points[:, 1].round().astype(int)
@@ -282,16 +351,228 @@ class Image:
         detector = cv.ORB_create(nfeatures=int(config['feature_min_frames']))
         descriptor = detector
 
-        points = detector.detect(self.array)
+        points = detector.detect(self.process_array)
+        points = Image.suppress_points(self, points)
 
-        self.points, self.descriptors = descriptor.compute(self.array, points)
+        self.points, self.descriptors = descriptor.compute(self.process_array, points)
         message(f'Found {len(self.points)} key points on image {self.imagename} using orb method')
         self.points = np.array([(i.pt[0], i.pt[1], i.size, i.angle) for i in self.points])
+        Image.full_resolution_points(self)
 
         xs = self.points[:, 0].round().astype(int)
         ys = self.points[:, 1].round().astype(int)
         self.color = self.array[ys, xs]
 
+    def processing_array(self):
+        """Resizes image's array, if its longest side is larger than the configuration's feature_process_size"""
+        process_size = int(config['feature_process_size'])
+        height, width = self.array.shape[:2]
+        self.process_scale = 1.0
+        self.process_array = self.array
+        if 0 < process_size < max(height, width):
+            self.process_scale = process_size / max(height, width)
+            size = (int(round(width * self.process_scale)), int(round(height * self.process_scale)))
+            self.process_array = cv.resize(self.array, size, interpolation=cv.INTER_AREA)
+
+    def full_resolution_points(self):
+        """Maps the points (x, y, size, angle) of the resized array to image's array"""
+        self.points = np.asarray(self.points, dtype=np.float64).reshape(-1, 4)
+        if self.process_scale == 1.0:
+            return
+
+        # The pixels' centres are aligned i.e. the centre of the resized pixel x is (x + 0.5) / scale - 0.5.
+        height, width = self.array.shape[:2]
+        self.points[:, 0] = np.clip((self.points[:, 0] + 0.5) / self.process_scale - 0.5, 0, width - 1)
+        self.points[:, 1] = np.clip((self.points[:, 1] + 0.5) / self.process_scale - 0.5, 0, height - 1)
+        self.points[:, 2] /= self.process_scale
+
+    def suppress_points(self, points):
+        """
+            Keeps at most feature_max_frames well spread points (grid bucketing). The resized array is divided into
+            square cells and the points of each cell are ranked by their response, which is multiplied by the
+            feature_label_weight for the points on the label channel. Then, the best point of each cell is kept, then
+            the second best point of each cell etc., until feature_max_frames points are kept.
+
+            args:
+                points (list):            The detected cv.KeyPoint points.
+
+            returns:
+                points (list):            The kept points.
+        """
+        max_frames = int(config['feature_max_frames'])
+        if not config['feature_use_adaptive_suppression'] or len(points) <= max_frames:
+            return points
+
+        xy = np.array([point.pt for point in points])
+        response = np.array([point.response for point in points])
+
+        label_weight = float(config['feature_label_weight'])
+        if label_weight != 1.0 and self.array.ndim == 3 and self.array.shape[2] == 4:
+            height, width = self.array.shape[:2]
+            xs = np.clip(np.rint((xy[:, 0] + 0.5) / self.process_scale - 0.5), 0, width - 1).astype(np.int64)
+            ys = np.clip(np.rint((xy[:, 1] + 0.5) / self.process_scale - 0.5), 0, height - 1).astype(np.int64)
+            response = np.where(self.array[ys, xs, 3] == 255, response * label_weight, response)
+
+        height, width = self.process_array.shape[:2]
+        cell = max(height, width) / int(config['feature_suppression_cells'])
+        columns = int(np.ceil(width / cell))
+        cells = (xy[:, 1] // cell).astype(np.int64) * columns + (xy[:, 0] // cell).astype(np.int64)
+
+        # --- The rank of each point into its cell (0 is the strongest point) ---
+        order = np.lexsort((-response, cells))
+        starts = np.r_[0, np.flatnonzero(np.diff(cells[order])) + 1]
+        counts = np.diff(np.r_[starts, len(order)])
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order)) - np.repeat(starts, counts)
+
+        keep = np.sort(np.lexsort((-response, ranks))[:max_frames])
+        return [points[i] for i in keep]
+
+    def thumbnail_descriptor(self):
+        """
+            Computes image's global descriptor i.e. the gray thumbnail (thumbnail_size x thumbnail_size) with zero
+            mean and unit length. The dot product of two descriptors is their (cosine) similarity.
+        """
+        array = Image.get_array(self)
+        gray = cv.cvtColor(array[:, :, :3], cv.COLOR_BGR2GRAY) if array.ndim == 3 else array
+        thumbnail = cv.resize(gray, (thumbnail_size, thumbnail_size), interpolation=cv.INTER_AREA)
+        thumbnail = thumbnail.astype(np.float32).ravel()
+        thumbnail -= thumbnail.mean()
+        self.thumbnail = thumbnail / max(float(np.linalg.norm(thumbnail)), 1e-6)
+
+    def detector_parameters(self):
+        """Returns the configuration parameters of the feature extraction method"""
+        parameters = {'feature_process_size': int(config['feature_process_size'])}
+        if config['feature_use_adaptive_suppression']:
+            parameters.update({'feature_max_frames': int(config['feature_max_frames']),
+                               'feature_suppression_cells': int(config['feature_suppression_cells']),
+                               'feature_label_weight': float(config['feature_label_weight'])})
+        if self.feature_extraction_method == 'Sift':
+            parameters.update({'sift_edge_threshold': config['sift_edge_threshold'],
+                               'sift_peak_threshold': float(config['sift_peak_threshold'])})
+        if self.feature_extraction_method == 'Surf':
+            parameters.update({'surf_hessian_threshold': config['surf_hessian_threshold'],
+                               'surf_n_octaves': config['surf_n_octaves'],
+                               'surf_n_octavelayers': config['surf_n_octavelayers'],
+                               'surf_upright': config['surf_upright']})
+        if self.feature_extraction_method == 'ORB':
+            parameters.update({'feature_min_frames': int(config['feature_min_frames'])})
+        return parameters
+
+    def load_features(self):
+        """Loads image's features from the feature store, returns True if they were found"""
+        if self.store is None:
+            return False
+
+        self.feature_key = self.store.key(file_hash(f'./images/{self.imagename}'), self.feature_extraction_method,
+                                          Image.detector_parameters(self))
+        features = self.store.load(self.feature_key)
+        if features is None:
+            return False
+
+        self.points = features['points']
+        self.descriptors = features['descriptors']
+        self.color = features['color']
+        if 'thumbnail' in features:
+            self.thumbnail = features['thumbnail']
+        else:
+            Image.thumbnail_descriptor(self)
+        message(f'Loaded {len(self.points)} key points of image {self.imagename} from the feature store')
+        return True
+
+    def save_features(self):
+        """Saves image's features into the feature store"""
+        if self.store is None:
+            return
+
+        descriptors = self.descriptors if self.descriptors is not None else np.zeros((0, 0), dtype=np.float32)
+        self.store.save(self.feature_key, points=np.asarray(self.points, dtype=np.float64).reshape(-1, 4),
+                        descriptors=descriptors, color=np.asarray(self.color), thumbnail=self.thumbnail)
+
+    def features(self):
+        """
+            Returns image's features as numpy arrays, which (unlike the cv.KeyPoint objects) can be sent between
+            processes.
+
+            returns:
+                features (dict): The points (x, y, size, angle), the descriptors, the colours, the feature store's
+                                 key and the global descriptor.
+        """
+        return {'points': np.asarray(self.points, dtype=np.float64).reshape(-1, 4),
+                'descriptors': self.descriptors,
+                'color': np.asarray(self.color),
+                'feature_key': self.feature_key,
+                'thumbnail': self.thumbnail}
+
+    def load_array(self):
+        """Reads image's channels"""
+        self.array = cv.imread(f'./images/{self.imagename}', cv.IMREAD_UNCHANGED)
+
+    def release_array(self):
+        """Releases image's channels"""
+        self.array = []
+
+    def sample(self, xs, ys):
+        """
+            Returns the channels of the given pixels. If image's channels are released, they are memory mapped i.e.
+            only the sampled pixels are read, or they are read and released again if the image is compressed.
+
+            args:
+                xs (list): The pixels' columns (integers).
+                ys (list): The pixels' rows (integers).
+
+            returns:
+                pixels (numpy array): The pixels' channels (BGR(A) order i.e. same as cv.imread).
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        if len(self.array) != 0:
+            return self.array[ys, xs]
+
+        pixels = memmap_tiff(f'./images/{self.imagename}') if self.imagename.lower().endswith(('.tif', '.tiff')) \
+            else None
+        if pixels is None:
+            return Image.get_array(self)[ys, xs]
+
+        # The TIFF archives store the channels in RGB(A) order.
+        samples = np.asarray(pixels[ys, xs])
+        if samples.ndim == 2 and samples.shape[1] >= 3:
+            samples = samples[:, [2, 1, 0] + list(range(3, samples.shape[1]))]
+        elif samples.ndim == 2 and samples.shape[1] == 1:
+            samples = samples[:, 0]
+        return samples
+
+    def sample_points(self):
+        """
+            Returns the channels of all the key points' pixels (BGR(A) order, see sample). They are sampled (i.e. a
+            compressed image is decoded) once and kept, thus all the pairs of the image index them.
+
+            returns:
+                pixels (numpy array): The channels of each key point's pixel (truncated x, y).
+        """
+        # Concurrent (thread) pairs may sample the same image twice, which is only redundant.
+        if len(self.point_pixels) == 0 and len(self.points) != 0:
+            points = np.asarray(self.points, dtype=np.float64).reshape(-1, 4)
+            self.point_pixels = Image.sample(self, points[:, 0].astype(np.int64), points[:, 1].astype(np.int64))
+        return self.point_pixels
+
     def save_label_channel(self):
         """Saves image's 4th channel i.e. labels"""
         cv.imwrite(f'{self.imagename}label.jpg', self.lchannel)
+
+
+def extract_features(imgname, method, store_directory=None, cameras_filename=None):
+    """
+    This function extracts the features of one image and it is executed by the Triang worker processes.
+    Args:
+        imgname (str)          = The image's name (into ./images).
+        method (str)           = The feature extraction method (Akaze, Sift, Surf, ORB).
+        store_directory (str)  = The directory of the feature store, None to not use the store.
+        cameras_filename (str) = The camera registry's json file (read only), None to read the EXIF.
+
+    Returns:
+        features (dict) = The image's features (see Image.features).
+
+    """
+    store = FeatureStore(store_directory) if store_directory is not None else None
+    return Image(imgname, method, store, cameras=CameraRegistry(cameras_filename)).features()
@@ -0,0 +1,128 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program converts the annotated (semantic) images into the label channel of the 4 channel images.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import cv2
+import numpy as np
+
+from lib.utils import error_message
+
+channels = {'blue': 0, 'green': 1, 'red': 2}
+
+
+class LabelRules:
+    """
+        Name: LabelRules
+
+        Description: LabelRules class constructs the label channel from a 3 channel annotated image in one whole-array
+                     pass, instead of visiting each pixel.
+
+        Parameters:
+            thresholds:              Per-channel thresholds i.e. {'red': 253}. A pixel passes a channel's test if its
+                                     value is greater than the threshold.
+            combine:                 How the channels' tests are combined, 'all' (every test must pass) or 'any'.
+            value:                   The label value of the pixels which pass the thresholds' test.
+            colours:                 Colour to class table i.e. {(0, 0, 255): 255}. The colours are given in BGR order,
+                                     as they are read by OpenCV.
+            tolerance:               Maximum per-channel difference between a pixel and a table's colour.
+
+        Functions:
+            --- Getters ---
+            get_thresholds:          Get the per-channel thresholds.
+            get_colours:             Get the colour to class table.
+
+            --- Methods ---
+            apply:                   Constructs the label channel of the given annotated image.
+            threshold_mask:          Finds the pixels which pass the per-channel thresholds.
+            describe:                Returns the rules as a dictionary.
+
+            The default rules reproduce the original SFMImage.define_labels behaviour i.e. red > 253 --> 255.
+            For annotations in green or blue colour use i.e. LabelRules({'green': 253}) or LabelRules({'blue': 253}).
+    """
+
+    def __init__(self, thresholds: dict = None, combine: str = 'all', value: int = 255, colours: dict = None,
+                 tolerance: int = 0):
+        """Constructor"""
+        if thresholds is None:
+            thresholds = {'red': 253}
+        if colours is None:
+            colours = {}
+
+        for channel in thresholds:
+            if channel not in channels:
+                error_message(f'Unknown channel {channel}, the valid channels are {list(channels)}', sysex=True)
+        if combine not in ['all', 'any']:
+            error_message('The combine variable must be all or any', sysex=True)
+
+        self.thresholds = thresholds
+        self.combine = combine
+        self.value = value
+        self.colours = colours
+        self.tolerance = tolerance
+
+    def __repr__(self):
+        return f'LabelRules({LabelRules.describe(self)})'
+
+    # --- Getters ---
+    def get_thresholds(self):
+        return self.thresholds
+
+    def get_colours(self):
+        return self.colours
+
+    # --- Methods ---
+    def apply(self, simage):
+        """
+            Constructs the label channel of the given annotated image.
+
+            args:
+                simage (numpy array): The annotated image (1 or 3 channels, BGR order).
+
+            returns:
+                labels (numpy array): The label channel (uint8).
+        """
+        if simage.ndim == 2:
+            return simage
+
+        labels = np.zeros(simage.shape[:2], dtype=np.uint8)
+        if self.thresholds:
+            labels[LabelRules.threshold_mask(self, simage)] = self.value
+
+        # The table is applied after the thresholds, thus its classes take priority.
+        for colour, value in self.colours.items():
+            lower = tuple(max(int(c) - self.tolerance, 0) for c in colour)
+            upper = tuple(min(int(c) + self.tolerance, 255) for c in colour)
+            mask = cv2.inRange(simage, lower, upper)
+            labels[mask == 255] = value
+
+        return labels
+
+    def threshold_mask(self, simage):
+        """This function finds the pixels which pass the per-channel thresholds"""
+        tests = [simage[:, :, channels[channel]] > threshold for channel, threshold in self.thresholds.items()]
+        if self.combine == 'all':
+            return np.logical_and.reduce(tests)
+        return np.logical_or.reduce(tests)
+
+    def describe(self):
+        """This function returns the rules as a dictionary"""
+        return {'thresholds': self.thresholds, 'combine': self.combine, 'value': self.value,
+                'colours': {str(colour): value for colour, value in self.colours.items()},
+                'tolerance': self.tolerance}
@@ -0,0 +1,128 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program records how each 4 channel image was produced, thus the unchanged images are not produced again.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+
+from lib.utils import file_hash
+
+
+class Manifest:
+    """
+        Name: Manifest
+
+        Description: Manifest class records, for each output image, the content hashes of its input images and the
+                     settings which were used to produce it. An output is current if it exists unchanged and its
+                     inputs' hashes and settings are the same as the recorded ones.
+
+        Parameters:
+            filename:                The name of the manifest (.json) archive.
+
+        Functions:
+            --- Getters ---
+            get_entries:             Get the recorded entries.
+
+            --- Methods ---
+            load:                    Loads the manifest archive if it exists.
+            save:                    Saves the manifest archive.
+            entry:                   Constructs the entry of an output from its inputs and settings.
+            is_current:              Checks if an output is current.
+            update:                  Records an output's entry, after the output is produced.
+            remove:                  Removes an output's entry.
+
+            The inputs' hashes are calculated again only if their size or modification time have changed.
+    """
+
+    def __init__(self, filename: str = 'images.manifest.json'):
+        """Constructor"""
+        self.filename = filename
+        self.entries: dict = {}
+
+        Manifest.load(self)
+
+    # --- Getters ---
+    def get_entries(self):
+        return self.entries
+
+    # --- Methods ---
+    def load(self):
+        """This function loads the manifest archive if it exists"""
+        if os.path.isfile(self.filename):
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        """This function saves the manifest archive"""
+        temporary = f'{self.filename}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.filename)
+
+    def entry(self, output, inputs, settings):
+        """
+            Constructs the entry of an output from its inputs and settings.
+
+            args:
+                output (str):    The output's file name.
+                inputs (list):   The input files' names.
+                settings (dict): The settings which produce the output (json serializable).
+
+            returns:
+                entry (dict):    The entry i.e. {'inputs': {name: {hash, size, mtime}}, 'settings': settings}.
+        """
+        previous = self.entries.get(os.path.basename(output), {}).get('inputs', {})
+        described = {}
+        for filename in inputs:
+            name = os.path.basename(filename)
+            stat = os.stat(filename)
+            old = previous.get(name)
+            if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime_ns:
+                digest = old['hash']
+            else:
+                digest = file_hash(filename)
+            described[name] = {'hash': digest, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+        # The json round trip makes the settings comparable with the loaded ones i.e. tuples --> lists.
+        return {'inputs': described, 'settings': json.loads(json.dumps(settings, sort_keys=True))}
+
+    def is_current(self, output, entry):
+        """This function checks if an output is current"""
+        recorded = self.entries.get(os.path.basename(output))
+        if recorded is None or not os.path.isfile(output):
+            return False
+
+        stat = os.stat(output)
+        if recorded['output'] != {'size': stat.st_size, 'mtime': stat.st_mtime_ns}:
+            return False
+
+        hashes = {name: described['hash'] for name, described in entry['inputs'].items()}
+        recorded_hashes = {name: described['hash'] for name, described in recorded['inputs'].items()}
+        return hashes == recorded_hashes and entry['settings'] == recorded['settings']
+
+    def update(self, output, entry):
+        """This function records an output's entry, after the output is produced"""
+        stat = os.stat(output)
+        self.entries[os.path.basename(output)] = dict(entry, output={'size': stat.st_size,
+                                                                     'mtime': stat.st_mtime_ns})
+
+    def remove(self, output):
+        """This function removes an output's entry"""
+        self.entries.pop(os.path.basename(output), None)
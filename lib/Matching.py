@@ -0,0 +1,221 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program keeps the trained matchers (FLANN or Hamming indexes) of the images, thus each image's index is built once.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+from lib.utils import error_message
+
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+binary_matchers = ['LSH', 'BRUTEFORCE']
+
+
+class FlannIndexCache:
+    """
+        Name: FlannIndexCache
+
+        Description: FlannIndexCache class trains a matcher (index) on each image's descriptors once and keeps it for
+                     every pair of the image. The least recently used indexes are released when their total
+                     (estimated) size exceeds the memory bound.
+                     The float descriptors (i.e. Sift, Surf) are matched by a FLANN kd-tree index, while the binary
+                     descriptors (uint8 i.e. Akaze, ORB) are matched, packed, by the Hamming distance using a brute
+                     force matcher or a FLANN LSH index.
+
+        Parameters:
+            max_megabytes:           The memory bound of the kept indexes (MB).
+            trees:                   The number of the randomized kd-trees of each index.
+            checks:                  The number of the checked leafs of each query.
+            binary_matcher:          The matcher of the binary descriptors ('LSH' or 'BRUTEFORCE').
+
+        Functions:
+            --- Getters ---
+            get_build_time:          Get the total time of the index construction (seconds).
+            get_query_time:          Get the total time of the queries (seconds).
+            get_builds:              Get the number of the constructed indexes.
+            get_hits:                Get the number of the queries, which reused a kept index.
+
+            --- Methods ---
+            is_binary:               Checks if the descriptors are binary (uint8).
+            index_bytes:             Estimates the size of an index.
+            new_matcher:             Returns a new matcher according to the descriptors' type.
+            matcher:                 Returns the trained matcher of an image (constructs it if it is not kept).
+            knn_match:               Finds the k nearest train descriptors of each query descriptor.
+            release:                 Releases the least recently used indexes, until they fit into the memory bound.
+            statistics:              Returns the construction and query times and counts.
+            merge:                   Adds the statistics of another cache (i.e. of a worker).
+            parameters:              Returns the parameters of the matchers (i.e. for the PairStore's keys).
+            report:                  Returns a summary of the index construction and query times.
+    """
+
+    def __init__(self, max_megabytes: float = 1024, trees: int = 5, checks: int = 50,
+                 binary_matcher: str = 'LSH'):
+        """Constructor"""
+        if binary_matcher not in binary_matchers:
+            error_message(f'The binary matcher must be one of {binary_matchers}', sysex=True)
+        self.max_bytes = max_megabytes * 1024 * 1024
+        self.index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=trees)  # Set index_param (matching parameter).
+        self.lsh_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+        self.search_params = dict(checks=checks)  # Set search_param (matching parameter).
+        self.binary_matcher = binary_matcher
+
+        self.matchers = OrderedDict()
+        self.bytes: int = 0
+
+        self.build_time: float = 0
+        self.query_time: float = 0
+        self.builds: int = 0
+        self.hits: int = 0
+
+    # --- Getters ---
+    def get_build_time(self):
+        return self.build_time
+
+    def get_query_time(self):
+        return self.query_time
+
+    def get_builds(self):
+        return self.builds
+
+    def get_hits(self):
+        return self.hits
+
+    # --- Methods ---
+    @staticmethod
+    def is_binary(descriptors):
+        """This function checks if the descriptors are binary i.e. packed bits (uint8)"""
+        return descriptors.dtype == np.uint8
+
+    def index_bytes(self, descriptors):
+        """This function estimates the size of an index i.e. the descriptors and the nodes of the kd-trees/tables"""
+        if not FlannIndexCache.is_binary(descriptors):
+            return descriptors.nbytes + self.index_params['trees'] * len(descriptors) * 32
+        if self.binary_matcher == 'LSH':
+            return descriptors.nbytes + self.lsh_params['table_number'] * len(descriptors) * 16
+        return descriptors.nbytes
+
+    def new_matcher(self, descriptors):
+        """This function returns a new matcher according to the descriptors' type"""
+        if not FlannIndexCache.is_binary(descriptors):
+            return cv.FlannBasedMatcher(self.index_params, self.search_params)  # Set the matcher.
+        if self.binary_matcher == 'LSH':
+            return cv.FlannBasedMatcher(self.lsh_params, self.search_params)
+        return cv.BFMatcher(cv.NORM_HAMMING)
+
+    def matcher(self, key, descriptors):
+        """
+            Returns the trained matcher of an image. The matcher is constructed only if it is not kept.
+
+            args:
+                key (int):                 The image's id.
+                descriptors (numpy array): The image's descriptors (float32 or binary uint8).
+
+            returns:
+                matcher (cv.DescriptorMatcher): The trained matcher.
+        """
+        if key in self.matchers:
+            self.matchers.move_to_end(key)
+            self.hits += 1
+            return self.matchers[key][0]
+
+        start = time.perf_counter()
+        matcher = FlannIndexCache.new_matcher(self, descriptors)
+        matcher.add([descriptors])
+        matcher.train()
+        self.build_time += time.perf_counter() - start
+        self.builds += 1
+
+        size = FlannIndexCache.index_bytes(self, descriptors)
+        self.matchers[key] = (matcher, size)
+        self.bytes += size
+        FlannIndexCache.release(self, keep=key)
+        return matcher
+
+    def knn_match(self, key, train_descriptors, query_descriptors, k=2):
+        """
+            Finds the k nearest train descriptors (image's index) of each query descriptor.
+
+            args:
+                key (int):                       The train image's id.
+                train_descriptors (numpy array): The train image's descriptors (float32 or binary uint8).
+                query_descriptors (numpy array): The query image's descriptors (same type).
+                k (int):                         The number of the nearest descriptors.
+
+            returns:
+                matches (list): The k matches (cv.DMatch) of each query descriptor (LSH may find less than k).
+        """
+        matcher = FlannIndexCache.matcher(self, key, train_descriptors)
+
+        start = time.perf_counter()
+        matches = matcher.knnMatch(query_descriptors, k=k)
+        self.query_time += time.perf_counter() - start
+        return matches
+
+    def release(self, keep=None):
+        """This function releases the least recently used indexes, until they fit into the memory bound"""
+        while self.bytes > self.max_bytes and len(self.matchers) > 1:
+            key = next(iter(self.matchers))
+            if key == keep:
+                break
+            self.bytes -= self.matchers.pop(key)[1]
+
+    def statistics(self):
+        """This function returns the construction and query times and counts"""
+        return {'build_time': self.build_time, 'query_time': self.query_time, 'builds': self.builds,
+                'hits': self.hits}
+
+    def merge(self, statistics):
+        """This function adds the statistics of another cache (i.e. of a worker)"""
+        self.build_time += statistics['build_time']
+        self.query_time += statistics['query_time']
+        self.builds += statistics['builds']
+        self.hits += statistics['hits']
+
+    def parameters(self):
+        """This function returns the parameters of the matchers, which change the matches"""
+        return {'index_params': self.index_params, 'lsh_params': self.lsh_params,
+                'search_params': self.search_params, 'binary_matcher': self.binary_matcher}
+
+    def report(self):
+        """This function returns a summary of the index construction and query times"""
+        return (f'FLANN indexes: {self.builds} built in {self.build_time:.2f} s, {self.hits} reused, '
+                f'queries {self.query_time:.2f} s')
+
+
+def ratio_test(matches, ratio):
+    """
+    This function applies the Lowe's ratio test on the k nearest matches of each query descriptor, as array operations.
+    Args:
+        matches (list) = The k (>= 2) nearest matches (cv.DMatch) of each query descriptor, i.e. from knnMatch. The
+                         queries with less than 2 matches (i.e. LSH) are ignored.
+        ratio (float)  = The Lowe's ratio.
+
+    Returns:
+        good (numpy array) = The good matches (query index, train index, distance).
+
+    """
+    nearest = np.array([(match[0].queryIdx, match[0].trainIdx, match[0].distance, match[1].distance)
+                        for match in matches if len(match) >= 2], dtype=np.float64).reshape(-1, 4)
+    good = nearest[:, 2] < ratio * nearest[:, 3]
+    return nearest[good, :3]
@@ -79,8 +79,9 @@ class MetaSFM:
         message(f'Save the project to {self.path / self.projectname}')
         if Metashape.app.activated:
             path = f'{self.path}/{self.projectname}'
-            self.doc.chunk.exportPoints(path=f'{self.path}/Lines/merged.ply', binary=False, save_normals=False,
-                                        save_colors=True, colors_rgb_8bit=False)
+            # The binary PLY is read by its header (lib.PointCloud), thus it is not parsed as text.
+            self.doc.chunk.exportPoints(path=f'{self.path}/Lines/merged.ply', binary=cloud_suffix == '.ply',
+                                        save_normals=False, save_colors=True, colors_rgb_8bit=False)
             self.doc.save(path)
         else:
             error_message(
@@ -20,15 +20,27 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import cv2 as cv
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from lib.utils import *
 from lib import Geometry
 import numpy as np
 from pathlib import Path
 
 from lib.config import default_config
+from lib.Cameras import CameraRegistry
+from lib.Estimators import check_estimator, essential_matrix, fundamental_matrix
+from lib.FeatureStore import FeatureStore
+from lib.Matching import FlannIndexCache, ratio_test
+from lib.PairStore import PairStore
+from lib.PairSelection import select_pairs
+from lib.PointCloud import cloud_suffix, cloud_array, format_cloud, write_cloud
+from lib.Reconstruction import Reconstruction
 
 config = default_config()
 
+# The distance threshold (in the camera's units) of the points, which are kept by the pose recovery (cv.recoverPose).
+pose_distance_threshold = 0.4
+
 
 class Triang:
     """
@@ -39,6 +51,13 @@ class Triang:
         Parameters:
             capture: 'above' or 'front' , indicates if the image is aerial or not.
             suffix:  4D image format.
+            cache_features: If the extracted features are stored into (and loaded from) the ./features directory.
+            processes: The number of the feature extraction and pair matching workers (None for the number of the CPUs).
+            executor: The pair matching workers ('thread' or 'process').
+            reconstruction_method: 'multiview' links all the pairs' matches into tracks and registers the images
+                                   incrementally (Reconstruction), 'pair' exports only the last pair's point cloud.
+            cache_matches: If the pairs' matches and geometry are stored into (and loaded from) the ./matches
+                           directory, it requires the features' cache (cache_features).
 
         Functions:
             --- Setters ---
@@ -60,30 +79,48 @@ class Triang:
             get_t:                         Get the translation matrix.
             get_projection_matrices:       Get pair's projection matrices (left image, right image)
             get_point_cloud:               Get the generated point cloud.
+            get_results:                   Get the pairs' results (PairMatch).
+            get_reconstruction:            Get the multi-view reconstruction (Reconstruction).
 
             --- Methods ---
             allimages:                     Manipulates the given RGB images using the Geometry script.
-            allpairs:                      Finds all the available pairs i.e. for 3 images the pairs are (0, 1), (0, 2), (1, 2). (!This method needs a further improvmet (Computationally expensive)!).
-            pairsmatching:                 Matches each pair and produces its sparse point cloud.
-            flann:                         Flann matcher.
-            calculate_fundamental_matrix:  Finds the fondumental matrix.
-            calculate_essential_matrix:    Finds the essential matrix.
-            Rt:                            Finds the rotation and translation matrix.
-            projection_matrix_from_pose:   Finds the projection matrix using the image's pose and the camera_matrix.
-            starting_projection_matrix:    Adds a 4th column of zeros into camera matrix.
-            triangulate_points:            Calculates the homogeneous points applying the triangulation process.
-            export_info:                   Exports each pair's point cloud (.txt).
+            allpairs:                      Selects the pairs by the images' order, capture time, GPS position and thumbnail similarity (config's matching_*_neighbors), or all the available pairs i.e. for 3 images the pairs are (0, 1), (0, 2), (1, 2).
+            pairsmatching:                 Matches each pair and produces its sparse point cloud (PairMatch), using a pool of workers.
+            set_pair_result:               Sets a pair's results (PairMatch) as the exported point cloud.
+            set_reconstruction_result:     Sets the multi-view reconstruction's points as the exported point cloud.
+            export_info:                   Exports the point cloud (binary .ply or .txt, config's point_cloud_format).
+
+            The matching and the geometry of each pair are implemented by the PairMatch class.
 
     """
 
-    def __init__(self, capture='front', suffix='.tiff'):
+    def __init__(self, capture='front', suffix='.tiff', cache_features=True, processes=None, executor='thread',
+                 reconstruction_method='multiview', cache_matches=True):
         """ Constructor """
         self.capture = capture
         self.path = Path(os.getcwd())
         self.imagesnames = find_files(f'{self.path}/images', suffix)
         self.images: list = []
+        self.feature_store = FeatureStore(f'{self.path}/features') if cache_features else None
+        # The pairs are keyed by their images' feature keys, thus the pair store requires the feature store.
+        self.pair_store = PairStore(f'{self.path}/matches') if cache_features and cache_matches else None
+        self.cameras = CameraRegistry(f'{self.path}/cameras.json', f'{self.path}/rgb')
+        self.processes = processes if processes else os.cpu_count()
+        if executor not in ['thread', 'process']:
+            error_message('The executor must be thread or process', sysex=True)
+        self.executor = executor
+        if reconstruction_method not in ['multiview', 'pair']:
+            error_message('The reconstruction method must be multiview or pair', sysex=True)
+        self.reconstruction_method = reconstruction_method
 
         self.pairs: list = []
+        self.results: list = []
+        self.reconstruction = None
+        self.cloud_name = ''
+        self.labeled_cloud_name = ''
+        self.cloud_suffix = cloud_suffix
+        self.matchers = FlannIndexCache(float(config['flann_index_cache_size']),
+                                        binary_matcher=config['binary_matcher'])
 
         self.feature_extraction_method = 'Akaze'
 
@@ -92,40 +129,19 @@ class Triang:
         Triang.allimages(self)
         Triang.allpairs(self)
 
-        for pair in self.pairs:
-            self.pair = pair
-            Triang.pairsmatching(self)
-
-        # Fondumental Matrix:
-        # Uncomment to use fundamental matrix i.e. When the intrinsic parameters are unknown
-        '''
-        message('Masking points with fundamental matrix and RANSAC algorithm ...')
-        points_number_before_filtering = len(self.ptsL)
-        Triang.calculate_fundamental_matrix(self)
-        message(f'Remain {len(self.ptsL)} out of {points_number_before_filtering}')
-        '''
+        Triang.pairsmatching(self)
 
-        # Essential Matrix:
-        # Comment the essential matrix calculation, to use fundamental matrix i.e. When the intrinsic parameters are unknown     
-        message('Masking points with essential matrix ...')
-        points_number_before_filtering = len(self.ptsL)
-        Triang.calculate_essential_matrix(self)
-        message(f'Remain {len(self.ptsL)} out of {points_number_before_filtering}')
-
-        # Rotation and Translation matrix:
-        message('Calculating Rotation and Translation matrix ...')
-        points_number_before_filtering = len(self.ptsL)
-        Triang.Rt(self)
-        message(f'Remain {len(self.ptsL)} out of {points_number_before_filtering}')
-
-        # Projection matrix:
-        message('Calculating Projection matrices ...')
-        Triang.projection_matrix_from_pose(self)
-        Triang.starting_projection_matrix(self)
-
-        # Triangulation matrix:
-        message('Calculating 3D Points ...')
-        Triang.triangulate_points(self)
+        if self.reconstruction_method == 'multiview':
+            # All the pairs' matches are linked into tracks and each track is triangulated once.
+            message('Multi-view reconstruction ...')
+            self.reconstruction = Reconstruction(self.images, self.results, config)
+            Triang.set_reconstruction_result(self, self.reconstruction)
+        else:
+            # The point cloud of the last pair is exported.
+            if not self.results:
+                error_message(f'There is not a pair to reconstruct ({len(self.images)} images and {len(self.pairs)} '
+                              f'selected pairs)', sysex=True)
+            Triang.set_pair_result(self, self.results[-1])
 
         # Save the generated point cloud:
         message('Save Sparse Point Cloud ...')
@@ -186,55 +202,253 @@ class Triang:
     def get_point_cloud(self):
         return self.points3d
 
+    def get_results(self):
+        return self.results
+
+    def get_reconstruction(self):
+        return self.reconstruction
+
     # --- Methods ---
     def allimages(self):
         """
-            Manipulates the given RGB images using the Geometry script.
+            Manipulates the given RGB images using the Geometry script. The features are extracted by a pool of worker
+            processes, unless processes = 1. The images' metadata are registered (./cameras.json) before the extraction.
 
             args:
                 imagesnames (str): Images' names.
         """
         for imagename in self.imagesnames:
-            image = Geometry.Image(imagename, self.feature_extraction_method)
-            image.imgid = self.imagesnames.index(imagename)
-            self.images.append(image)
+            self.cameras.image_info(imagename)
+        self.cameras.save()
+        message(f'Found {len(self.cameras.get_cameras())} camera(s): {list(self.cameras.get_cameras())}')
+
+        if self.processes == 1 or len(self.imagesnames) < 2:
+            for imagename in self.imagesnames:
+                image = Geometry.Image(imagename, self.feature_extraction_method, self.feature_store,
+                                       cameras=self.cameras)
+                image.imgid = self.imagesnames.index(imagename)
+                self.images.append(image)
+            return
+
+        # The workers return the features as numpy arrays and the images are constructed in the images' order, thus
+        # the ids do not depend on which worker finishes first.
+        store_directory = self.feature_store.get_directory() if self.feature_store is not None else None
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=cv.setNumThreads, initargs=(1,)) as executor:
+            features = executor.map(Geometry.extract_features, self.imagesnames,
+                                    [self.feature_extraction_method] * len(self.imagesnames),
+                                    [store_directory] * len(self.imagesnames),
+                                    [self.cameras.get_filename()] * len(self.imagesnames))
+            for imgid, (imagename, image_features) in enumerate(zip(self.imagesnames, features)):
+                image = Geometry.Image(imagename, self.feature_extraction_method, self.feature_store,
+                                       image_features, self.cameras)
+                image.imgid = imgid
+                self.images.append(image)
 
     def allpairs(self):
-        """Finds all the available pairs i.e. for 3 images the pairs are (0, 1), (0, 2), (1, 2)."""
-        for i in range(0, len(self.images)):
-            for j in range(i + 1, len(self.images)):
-                # print (self.images[i].imgid, self.images[j].imgid)
-                pair = [self.images[i].imgid, self.images[j].imgid]
-                self.pairs.append(pair)
+        """
+            Selects the pairs by the images' order, capture time, GPS position and thumbnail similarity (config's
+            matching_*_neighbors). If none of them is used, finds all the available pairs i.e. for 3 images the pairs
+            are (0, 1), (0, 2), (1, 2).
+        """
+        exifs = [self.cameras.image_info(image.imagename)['exif'] for image in self.images]
+        thumbnails = [image.get_thumbnail() for image in self.images]
+        for i, j in select_pairs([image.imagename for image in self.images], exifs, thumbnails, config):
+            self.pairs.append([self.images[i].imgid, self.images[j].imgid])
 
     def pairsmatching(self):
-        """Matches pair's images and produces the sparse point cloud."""
+        """
+            Matches the pairs and computes each pair's geometry (PairMatch). The pairs are grouped by their right
+            (train) image, thus each image's index is trained once, and the groups are processed by a pool of workers
+            (threads or processes), which share the images read only. The pairs, which are stored into the pair store
+            (./matches), are loaded instead of matched.
+            The workers' tasks are balanced (see matching_tasks) i.e. with all the pairs, the last image has n - 1
+            pairs while the second has 1.
+        """
+        groups = {}
+        for pair in self.pairs:
+            groups.setdefault(pair[1], []).append(pair[0])
+        tasks = matching_tasks(groups, -(-len(self.pairs) // self.processes))
+
+        if self.processes == 1 or len(tasks) < 2:
+            share_images(self.images, self.pair_store)
+            outputs = [match_train_image(train_id, query_ids, self.matchers) for train_id, query_ids in groups.items()]
+        else:
+            if self.executor == 'process':
+                store_directory = self.pair_store.get_directory() if self.pair_store is not None else None
+                executor = ProcessPoolExecutor(max_workers=self.processes, initializer=matching_worker,
+                                               initargs=(self.images, store_directory))
+            else:
+                share_images(self.images, self.pair_store)
+                executor = ThreadPoolExecutor(max_workers=self.processes)
+            with executor:
+                outputs = list(executor.map(match_train_image, *zip(*tasks)))
+
+        results = {}
+        for output in outputs:
+            if output['statistics'] is not None:
+                self.matchers.merge(output['statistics'])
+            for result in output['results']:
+                results[tuple(result.pair)] = result
+        self.results = [results[tuple(pair)] for pair in self.pairs]
+        message(self.matchers.report())
+        if self.pair_store is not None:
+            message(f'Loaded {sum(result.loaded for result in self.results)} out of {len(self.results)} pairs from '
+                    f'the pair store')
+
+    def set_pair_result(self, result):
+        """This function sets a pair's results (PairMatch) as the current pair i.e. for the export_info"""
+        self.pair = result.pair
+        self.leftimage = self.images[result.pair[0]]
+        self.rightimage = self.images[result.pair[1]]
+        self.cloud_name = f'{self.leftimage.imgid}{self.rightimage.imgid}'
+        self.labeled_cloud_name = 'edges' if len(self.pairs) == 1 else f'{self.cloud_name}_labeled'
+        for name in ['camera_matrix', 'ptsL', 'ptsR', 'idsL', 'idsR', 'good_matches', 'colours', 'fundamental_matrix',
+                     'essential_matrix', 'R', 't', 'left_projection_matrix', 'right_projection_matrix',
+                     'triangulated_points', 'triangulated_pointsT']:
+            setattr(self, name, getattr(result, name))
+        self.labeled_points: list = []
+
+    def set_reconstruction_result(self, reconstruction):
+        """
+            This function sets the multi-view reconstruction's points (homogeneous) and colours as the exported point
+            cloud i.e. for the export_info. The first registered image is the origin.
+        """
+        points = reconstruction.get_points()
+        self.cloud_name = 'multiview'
+        self.labeled_cloud_name = 'edges'
+        self.triangulated_pointsT = np.column_stack((points, np.ones(len(points))))
+        self.triangulated_points = np.transpose(self.triangulated_pointsT)
+        self.colours = reconstruction.get_colours()
+        self.labeled_points: list = []
+
+    def export_info(self):
+        """
+            This function exports the generated point cloud into ./Lines folder. The points are dehomogenised and
+            their axes are swapped (capture) at once and each file is written in a single buffered pass, as a binary
+            PLY or an ASCII text (config's point_cloud_format).
+        """
+        if self.capture not in ['above', 'front']:
+            error_message('The capture variable must be above or front', sysex=True)
+        mkdir('Lines')
+        path = f'{os.getcwd()}/Lines'
+
+        points = np.array(self.triangulated_pointsT, dtype=np.float64).reshape(-1, 4)
+        points = points[:, :3] / points[:, 3:]
+        colours = np.asarray(self.colours).reshape(-1, 4)
+        if self.capture == 'above':
+            points3d = np.column_stack((points[:, 0], points[:, 1], points[:, 2] * 100))
+        else:
+            points3d = np.column_stack((-points[:, 0], points[:, 2] * 100, points[:, 1]))
+            kept = ~((points3d[:, 0] > 10) | (points3d[:, 1] > 10))
+            points3d, colours = points3d[kept], colours[kept]
+
+        cloud = cloud_array(points3d, colours)
+        labeled = colours[:, 3] == 255
+        names = [self.cloud_name, 'merged', self.labeled_cloud_name]
+        if self.cloud_suffix == '.txt':
+            # Each point is formatted once and its line is shared by all the files.
+            lines = format_cloud(cloud)
+            labeled_lines = [lines[i] for i in np.flatnonzero(labeled)]
+            for name, name_lines in zip(names, [lines, lines, labeled_lines]):
+                write_lines(path, name, '.txt', name_lines)
+        else:
+            for name, name_cloud in zip(names, [cloud, cloud, cloud[labeled]]):
+                write_cloud(f'{path}/{name}{self.cloud_suffix}', name_cloud, append=True)
+
+        self.labeled_points = points3d[labeled].tolist()
+        self.points3d = points3d
+
+
+class PairMatch:
+    """
+        Name: PairMatch
+
+        Description: PairMatch class matches the images of a pair and computes the pair's geometry i.e. the essential
+                     matrix, the pose, the projection matrices and the triangulated points. Each pair keeps its own
+                     results, thus the pairs are matched independently (i.e. by concurrent workers).
+
+        Parameters:
+            pair:     The ids of the pair's images [left, right].
+            images:   The images (Geometry.Image), which are only read.
+            matchers: The images' FLANN indexes (FlannIndexCache).
+            store:    The pairs' matches and geometry (PairStore), None for no store.
+
+        Functions:
+            --- Getters ---
+            get_pair:                      Get the pair.
+            get_matches:                   Get the good matches (query index, train index, distance).
+            get_inliers:                   Get the key points' indexes of the triangulated matches (left, right).
+            get_fundamental_matrix:        Get the fundamental matrix.
+            get_essential_matrix:          Get the essential matrix.
+            get_R:                         Get the rotation matrix.
+            get_t:                         Get the translation matrix.
+            get_projection_matrices:       Get pair's projection matrices (left image, right image)
+            get_triangulated_points:       Get the triangulated (homogeneous) points.
+
+            --- Methods ---
+            matching_descriptors:          Keeps the binary descriptors packed and converts the others to float32.
+            flann:                         Flann matcher (each image's index is trained once, see FlannIndexCache).
+            matched_points:                Gathers the key points' indexes, the points and the colours of the good matches.
+            keep_matches:                  Keeps the matched points of a mask (i.e. the inliers).
+            geometry_parameters:           Returns the matcher's and the estimator's parameters (PairStore's key).
+            load_geometry:                 Loads the good matches and the geometry from the pair store.
+            save_geometry:                 Saves the good matches and the geometry into the pair store.
+            geometry:                      Computes pair's geometry and triangulates the matched points.
+            calculate_fundamental_matrix:  Finds the fondumental matrix.
+            calculate_essential_matrix:    Finds the essential matrix.
+            Rt:                            Finds the rotation and translation matrix.
+            projection_matrix_from_pose:   Finds the projection matrix using the image's pose and the camera_matrix.
+            starting_projection_matrix:    Adds a 4th column of zeros into camera matrix.
+            triangulate_points:            Calculates the homogeneous points applying the triangulation process.
+            release:                       Releases the images and the matcher, thus the results can be sent between
+                                           processes.
+    """
+
+    def __init__(self, pair, images, matchers, store=None):
+        """Constructor"""
         # --- Get pair's info ---
-        self.labels = self.images[self.pair[0]].lchannel
-        self.leftimage = self.images[self.pair[0]]
-        self.rightimage = self.images[self.pair[1]]
+        self.pair = pair
+        self.labels = images[self.pair[0]].lchannel
+        self.leftimage = images[self.pair[0]]
+        self.rightimage = images[self.pair[1]]
         self.camera_matrix = self.leftimage.camera_matrix
+        self.matchers = matchers
+        self.store = store
+        self.pair_key = ''
+        self.loaded = False
 
         self.colours = []
 
         self.Lkp = self.leftimage.points
         self.Rkp = self.rightimage.points
 
-        self.LDesc = np.array(self.leftimage.descriptors, dtype=np.float32)
-        self.RDesc = np.array(self.rightimage.descriptors, dtype=np.float32)
+        # The binary descriptors (Akaze, ORB) are kept packed (uint8) and they are matched by the Hamming distance.
+        self.LDesc = PairMatch.matching_descriptors(self.leftimage.descriptors)
+        self.RDesc = PairMatch.matching_descriptors(self.rightimage.descriptors)
 
         # --- Matching Variables ---
         self.matching_method = 'FLANN'
 
+        # --- Geometry Variables ---
+        self.estimator = config['robust_estimator']
+        self.confidence = float(config['robust_confidence'])
+        check_estimator(self.estimator)
+
         self.ptsL: list = []
         self.ptsR: list = []
         self.idsL: list = []
+        self.idsR: list = []
 
         self.good_matches: list = []
 
         self.fundamental_matrix: list = []
         self.essential_matrix: list = []
 
+        # The inliers of each step, on the remaining matches (empty if the step is not applied).
+        self.fundamental_mask: list = []
+        self.essential_mask: list = []
+        self.pose_mask: list = []
+
         self.R: list = []
         self.t: list = []
 
@@ -244,106 +458,245 @@ class Triang:
         self.triangulated_points: list = []
         self.triangulated_pointsT: list = []
 
-        self.labeled_points: list = []
-
         # --- Pull the triger ---
-        if self.matching_method == 'FLANN':
-            Triang.flann(self)
-        else:
-            print(f'Method: {self.matching_method} is not available')
+        self.loaded = PairMatch.load_geometry(self)
+        if not self.loaded:
+            if self.matching_method == 'FLANN':
+                PairMatch.flann(self)
+            else:
+                print(f'Method: {self.matching_method} is not available')
+
+            PairMatch.geometry(self)
+            PairMatch.save_geometry(self)
+        PairMatch.release(self)
+
+    # --- Getters ---
+    def get_pair(self):
+        return self.pair
+
+    def get_matches(self):
+        return self.good_matches
+
+    def get_inliers(self):
+        return self.idsL, self.idsR
+
+    def get_fundamental_matrix(self):
+        return self.fundamental_matrix
+
+    def get_essential_matrix(self):
+        return self.essential_matrix
+
+    def get_R(self):
+        return self.R
+
+    def get_t(self):
+        return self.t
+
+    def get_projection_matrices(self):
+        return self.left_projection_matrix, self.right_projection_matrix
+
+    def get_triangulated_points(self):
+        return self.triangulated_points
+
+    # --- Methods ---
+    @staticmethod
+    def matching_descriptors(descriptors):
+        """This function keeps the binary descriptors (uint8) packed and converts the others to float32"""
+        descriptors = np.asarray(descriptors)
+        if descriptors.dtype == np.uint8:
+            return np.ascontiguousarray(descriptors)
+        return np.asarray(descriptors, dtype=np.float32)
 
     def flann(self):
         """ This function applies the Flann matcher."""
         message(f'Matching image with id = {self.pair[0]} with image with id = {self.pair[1]}')
 
-        FLANN_INDEX_KDTREE = 1
-        # FLANN_INDEX_LSH = 6
-        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)  # Set index_param (matching parameter).
-        # index_params = dict(algorithm = FLANN_INDEX_LSH, table_number = 10, key_size = 20, multi_probe_level = 0).
-        search_params = dict(checks=50)  # Set search_param (matching parameter).
-        flann = cv.FlannBasedMatcher(index_params, search_params)  # Set the matcher.
-
-        matches = flann.knnMatch(self.LDesc, self.RDesc, k=2)
-
-        if self.feature_extraction_method == 'Sift' or self.feature_extraction_method == 'ORB' or self.feature_extraction_method == 'Surf':
-            colouring_points = self.Lkp  # Store the key_points before convert them to cvkeypoints.
-            self.Lkp = convert_points_2_cvkeypoints(self.Lkp)  # Convert the feature points to cvkeypoints.
-            self.Rkp = convert_points_2_cvkeypoints(self.Rkp)  # Convert the feature points to cvkeypoints.
-        else:
-            colouring_points = [i.pt for i in self.Lkp]
+        # The right image's index is trained once and it is reused by all the pairs of the image.
+        matches = self.matchers.knn_match(self.pair[1], self.RDesc, self.LDesc, k=2)
 
         message('Apply Lowe\'s paper ratio test')
 
         lowes_ratio = float(config['lowes_ratio'])
 
-        # Lowe's ratio:
-        for i, (m, n) in enumerate(matches):
-            if m.distance < lowes_ratio * n.distance:
-                self.good_matches.append(m)
-                self.ptsR.append(self.Rkp[m.trainIdx].pt)  # Store the index of kp2.
-                self.ptsL.append(self.Lkp[m.queryIdx].pt)  # Store the index of kp1.
-                self.idsL.append(i)
+        # Lowe's ratio, the good matches are (query index, train index, distance), the best (nearest) first i.e. for
+        # the USAC_PROSAC estimator:
+        self.good_matches = ratio_test(matches, lowes_ratio)
+        self.good_matches = self.good_matches[np.argsort(self.good_matches[:, 2], kind='stable')]
+        PairMatch.matched_points(self)
 
         message(f'Found {len(self.good_matches)} good matches in pair {self.pair} out of {len(matches)}')
 
-        colours = []
-        img = self.images[self.pair[0]].array  # Set image for colouring.
-        for i in self.idsL:
-            y = int(colouring_points[i][0])  # Get y index for colouring.
-            x = int(colouring_points[i][1])  # Get x index for colouring.
+    def matched_points(self):
+        """This function gathers the key points' indexes, the points and the colours of the good matches"""
+        self.idsL = self.good_matches[:, 0].astype(np.int64)
+        self.idsR = self.good_matches[:, 1].astype(np.int64)
+        self.ptsL = np.asarray(self.Lkp)[self.idsL, :2]  # The (x, y) of the matched key points.
+        self.ptsR = np.asarray(self.Rkp)[self.idsR, :2]
+
+        # The key points' pixels are sampled once per image (a compressed image is decoded once), not per pair.
+        pixels = np.asarray(self.leftimage.sample_points()).reshape(-1, 4)[self.idsL]
+        self.colours = pixels[:, [2, 1, 0, 3]].astype(np.int64)  # The colours (red, green, blue) and the labels.
+
+    def keep_matches(self, mask):
+        """This function keeps the matched points, their colours and their key points' indexes of a mask"""
+        self.ptsL = self.ptsL[mask]
+        self.ptsR = self.ptsR[mask]
+        self.colours = self.colours[mask]
+        self.idsL = self.idsL[mask]
+        self.idsR = self.idsR[mask]
+
+    def geometry_parameters(self):
+        """This function returns the matcher's and the estimator's parameters, which change the pair's geometry"""
+        return {'matching_method': self.matching_method, 'lowes_ratio': float(config['lowes_ratio']),
+                'matchers': self.matchers.parameters(), 'estimator': self.estimator, 'confidence': self.confidence,
+                'calib_threshold': float(config['robust_matching_calib_threshold']),
+                'threshold': float(config['robust_matching_threshold']),
+                'pose_distance_threshold': pose_distance_threshold,
+                'camera_matrix': np.asarray(self.camera_matrix, dtype=np.float64).tolist()}
+
+    def load_geometry(self):
+        """
+            This function loads the good matches and the geometry (the matrices, the pose and the inliers' masks) of
+            the pair from the pair store. The masks are applied on the good matches and the points are triangulated
+            again. It returns False if the pair is not stored (or there is no store).
+        """
+        left_key = self.leftimage.get_feature_key()
+        right_key = self.rightimage.get_feature_key()
+        if self.store is None or not left_key or not right_key:
+            return False
+        self.pair_key = PairStore.key(left_key, right_key, PairMatch.geometry_parameters(self))
+        stored = self.store.load(self.pair_key)
+        if stored is None:
+            return False
+
+        message(f'Loading the matches and the geometry of pair {self.pair} from the pair store')
+        self.good_matches = stored['good_matches']
+        PairMatch.matched_points(self)
+        for name in ['fundamental', 'essential']:
+            matrix = stored[f'{name}_matrix']
+            setattr(self, f'{name}_matrix', matrix if matrix.size else [])
+            setattr(self, f'{name}_mask', stored[f'{name}_mask'])
+            if stored[f'{name}_mask'].size:
+                PairMatch.keep_matches(self, stored[f'{name}_mask'])
+        if len(self.essential_matrix) == 0:
+            error_message(f'The essential matrix of pair {self.pair} is not estimated')
+            return True
+
+        self.R, self.t, self.pose_mask = stored['R'], stored['t'], stored['pose_mask']
+        PairMatch.keep_matches(self, self.pose_mask)
+        message(f'Remain {len(self.ptsL)} out of {len(self.good_matches)} matches of pair {self.pair}')
+
+        PairMatch.projection_matrix_from_pose(self)
+        PairMatch.starting_projection_matrix(self)
+        PairMatch.triangulate_points(self)
+        return True
+
+    def save_geometry(self):
+        """This function saves the good matches and the geometry of the pair into the pair store"""
+        if not self.pair_key:
+            return
+        self.store.save(self.pair_key, good_matches=np.asarray(self.good_matches, dtype=np.float64).reshape(-1, 3),
+                        fundamental_matrix=np.asarray(self.fundamental_matrix, dtype=np.float64),
+                        essential_matrix=np.asarray(self.essential_matrix, dtype=np.float64),
+                        fundamental_mask=np.asarray(self.fundamental_mask, dtype=bool),
+                        essential_mask=np.asarray(self.essential_mask, dtype=bool),
+                        pose_mask=np.asarray(self.pose_mask, dtype=bool),
+                        R=np.asarray(self.R, dtype=np.float64), t=np.asarray(self.t, dtype=np.float64))
+
+    def geometry(self):
+        """This function computes pair's geometry and triangulates the matched points"""
+        # The RANSAC samples are drawn from the worker thread's random generator, which is reset (to a new thread's
+        # state), thus the pair's geometry does not depend on which pairs the worker matched before.
+        cv.setRNGSeed(0)
 
-            red = img[x, y, 2]  # Get red channel.
-            green = img[x, y, 1]
-            blue = img[x, y, 0]
-            label = img[x, y, 3]
+        # Fondumental Matrix:
+        # Uncomment to use fundamental matrix i.e. When the intrinsic parameters are unknown
+        '''
+        message('Masking points with fundamental matrix and RANSAC algorithm ...')
+        points_number_before_filtering = len(self.ptsL)
+        PairMatch.calculate_fundamental_matrix(self)
+        message(f'Remain {len(self.ptsL)} out of {points_number_before_filtering}')
+        '''
 
-            colours.append(
-                [red, green, blue, label])  # Append to the colours' list the colours as well as the associated labels.
+        # Essential Matrix:
+        # Comment the essential matrix calculation, to use fundamental matrix i.e. When the intrinsic parameters are unknown
+        message(f'Masking points of pair {self.pair} with essential matrix ({self.estimator}) ...')
+        points_number_before_filtering = len(self.ptsL)
+        PairMatch.calculate_essential_matrix(self)
+        message(f'Remain {len(self.ptsL)} out of {points_number_before_filtering}')
+        if len(self.essential_matrix) == 0:
+            error_message(f'The essential matrix of pair {self.pair} is not estimated')
+            return
 
-        self.colours = np.array(colours, dtype=np.int)  # Convert colours to np.array.
+        # Rotation and Translation matrix:
+        message(f'Calculating Rotation and Translation matrix of pair {self.pair} ...')
+        points_number_before_filtering = len(self.ptsL)
+        PairMatch.Rt(self)
+        message(f'Remain {len(self.ptsL)} out of {points_number_before_filtering}')
 
-    def calculate_fundamental_matrix(self):
-        """This function calculats the fundamental matrix"""
-        self.ptsL = np.int32(self.ptsL)  # Convert pts1 to int for the fundamental calculation.
-        self.ptsR = np.int32(self.ptsR)
+        # Projection matrix:
+        message(f'Calculating Projection matrices of pair {self.pair} ...')
+        PairMatch.projection_matrix_from_pose(self)
+        PairMatch.starting_projection_matrix(self)
 
-        self.fundamental_matrix, mask = cv.findFundamentalMat(self.ptsL, self.ptsR,
-                                                              cv.FM_LMEDS)  # Calculate fundametnal matrix (Unknown camera intrinsics parameters).
+        # Triangulation matrix:
+        message(f'Calculating 3D Points of pair {self.pair} ...')
+        PairMatch.triangulate_points(self)
 
-        self.ptsL = self.ptsL[
-            mask.ravel() == 1]  # Keep only the points which are used for the fundametnal matrix calculation.
-        self.ptsR = self.ptsR[mask.ravel() == 1]
-        self.colours = self.colours[
-            mask.ravel() == 1]  # Keep only the colours and the labels from points which are used for the fundametnal matrix calculation.
+    def release(self):
+        """
+            This function releases the images, the key points, the descriptors and the matcher, thus the results can
+            be sent between processes.
+        """
+        self.leftimage = None
+        self.rightimage = None
+        self.labels = None
+        self.matchers = None
+        self.store = None
+        self.Lkp = []
+        self.Rkp = []
+        self.LDesc = []
+        self.RDesc = []
 
-    def calculate_essential_matrix(self):
-        """This function calculats the essential matrix"""
-        self.ptsL = np.int32(self.ptsL)  # Convert ptsL to int for the fundamental calculation.
-        self.ptsR = np.int32(self.ptsR)
+    def calculate_fundamental_matrix(self):
+        """
+            This function calculats the fundamental matrix, on the float points, by the robust estimator (config's
+            robust_estimator). The threshold is the robust_matching_threshold as portion of the image's width.
+        """
+        threshold = float(config['robust_matching_threshold']) * self.leftimage.get_width()
+        self.fundamental_matrix, mask = fundamental_matrix(self.ptsL, self.ptsR, self.estimator, threshold,
+                                                           self.confidence)  # Calculate fundametnal matrix (Unknown camera intrinsics parameters).
+
+        # Keep only the points, the colours and the labels which are used for the fundametnal matrix calculation.
+        self.fundamental_mask = mask
+        PairMatch.keep_matches(self, mask)
 
-        self.essential_matrix, mask = cv.findEssentialMat(self.ptsL, self.ptsR, self.camera_matrix, cv.LMEDS)  # Calculate essential matrix (Known camera intrinsics parameters).
+    def calculate_essential_matrix(self):
+        """
+            This function calculats the essential matrix, on the float points, by the robust estimator (config's
+            robust_estimator). The threshold is the robust_matching_calib_threshold (radians) times the focal length.
+        """
+        threshold = float(config['robust_matching_calib_threshold']) * float(np.asarray(self.camera_matrix)[0, 0])
+        self.essential_matrix, mask = essential_matrix(self.ptsL, self.ptsR, self.camera_matrix, self.estimator,
+                                                       threshold, self.confidence)  # Calculate essential matrix (Known camera intrinsics parameters).
 
-        self.ptsL = self.ptsL[
-            mask.ravel() == 1]  # Keep only the points which are used for the essential matrix calculation.
-        self.ptsR = self.ptsR[mask.ravel() == 1]
-        self.colours = self.colours[
-            mask.ravel() == 1]  # Keep only the colours and the labels of points which are used for the essential matrix calculation.
+        # Keep only the points, the colours and the labels which are used for the essential matrix calculation.
+        self.essential_mask = mask
+        PairMatch.keep_matches(self, mask)
 
     def Rt(self):
         """This function finds the rotation matrix R and the translation matrix t using corresponding points and a given camera matrix."""
-        pts_1 = np.array(self.ptsL, dtype=np.float)  # Convert points to float
-        pts_2 = np.array(self.ptsR, dtype=np.float)
-        if self.essential_matrix != []:
+        pts_1 = np.array(self.ptsL, dtype=np.float64)  # Convert points to float
+        pts_2 = np.array(self.ptsR, dtype=np.float64)
+        if len(self.essential_matrix) != 0:
             poseval, self.R, self.t, mask = cv.recoverPose(self.essential_matrix, pts_1, pts_2, self.camera_matrix,
-                                                           0.4)  # Find image's pose using corresponding points, the essential matrix, the camera matrix and a ratio.
+                                                           pose_distance_threshold)  # Find image's pose using corresponding points, the essential matrix, the camera matrix and a ratio.
         else:
             poseval, self.R, self.t, mask = cv.recoverPose(self.fundamental_matrix, pts_1, pts_2, self.camera_matrix,
-                                                           0.4)
-        self.ptsL = self.ptsL[
-            mask.ravel() == 255]  # Keep only the points which are used for the pose recover procedure.
-        self.ptsR = self.ptsR[mask.ravel() == 255]
-        self.colours = self.colours[
-            mask.ravel() == 255]  # Keep only the colours of points which are used for the pose recover calculation.
+                                                           pose_distance_threshold)
+        # Keep only the points and their colours which are used for the pose recover procedure.
+        self.pose_mask = mask.ravel() == 255
+        PairMatch.keep_matches(self, self.pose_mask)
 
     def projection_matrix_from_pose(self):
         """
@@ -373,8 +726,8 @@ class Triang:
         ptsLT = np.transpose(self.ptsL)  # Find the transpose of list pts1
         ptsRT = np.transpose(self.ptsR)  # Find the transpose of list pts2
 
-        ptsLT = np.array(ptsLT, dtype=np.float)
-        ptsRT = np.array(ptsRT, dtype=np.float)
+        ptsLT = np.array(ptsLT, dtype=np.float64)
+        ptsRT = np.array(ptsRT, dtype=np.float64)
 
         self.triangulated_points = cv.triangulatePoints(np.array(self.right_projection_matrix),
                                                         np.array(self.left_projection_matrix), ptsRT,
@@ -382,43 +735,62 @@ class Triang:
         self.triangulated_pointsT = np.transpose(
             self.triangulated_points)  # Find the transpose of triangulated points list
 
-    def export_info(self):
-        """ This finction exports the generated point cloud into ./PointClouds folder"""
-        mkdir('Lines')
-        points3d = []
-        i = -1
-        path = f'{os.getcwd()}/Lines'
-        for point in np.array(self.triangulated_pointsT):
-            i += 1
-            if self.capture == 'above':
-                x = point[0] / point[3]
-                y = point[1] / point[3]
-                z = (point[2] / point[3]) * 100
-
-            elif self.capture == 'front':
-                x = -point[0] / point[3]
-                y = point[2] / point[3] * 100
-                z = (point[1] / point[3])
-
-                if x > 10 or y > 10:
-                    continue
-            else:
-                error_message('The capture variable must be above or front', sysex=True)
 
-            point3d = [x, y, z]
-            points3d.append(point3d)
+# The images (Geometry.Image) and the pair store of the pair matching workers, they are shared (read only) by the
+# worker's tasks.
+shared_images: list = []
+shared_pair_store = None
+
 
-            wline = f'{point3d[0]} {point3d[1]} {point3d[2]} {self.colours[i][0]} {self.colours[i][1]} {self.colours[i][2]} {self.colours[i][3]}\n'
-            write_a_file(path, f'{self.leftimage.imgid}{self.rightimage.imgid}', '.txt', wline)
-            write_a_file(path, 'merged', '.txt', wline)
+def share_images(images, pair_store=None):
+    """This function shares the images and the pair store (PairStore or None) with the pair matching tasks of this
+    process"""
+    global shared_images, shared_pair_store
+    shared_images = images
+    shared_pair_store = pair_store
 
-            if self.colours[i][3] == 255:
-                wline = f'{point3d[0]} {point3d[1]} {point3d[2]} {self.colours[i][0]} {self.colours[i][1]} {self.colours[i][2]} {self.colours[i][3]}\n'
-                if len(self.pairs) == 1:
-                    write_a_file(path, 'edges', '.txt', wline)
-                else:
-                    write_a_file(path, f'{self.leftimage.imgid}{self.rightimage.imgid}_labeled', '.txt', wline)
 
-                self.labeled_points.append(point3d)
+def matching_worker(images, pair_store_directory=None):
+    """This function initializes a pair matching worker process"""
+    cv.setNumThreads(1)
+    share_images(images, PairStore(pair_store_directory) if pair_store_directory is not None else None)
 
-        self.points3d = np.array(points3d)
+
+def matching_tasks(groups, chunk_size):
+    """
+    This function splits the pairs' groups (by right image) into the workers' tasks. The groups, which are larger than
+    a worker's share (chunk_size), are split into chunks and the tasks are sorted by size (largest first), thus the
+    pool does not wait for the last large groups. Each chunk trains its right image's index once.
+    Args:
+        groups (dict)    = The left images' ids (list) of each right (train) image's id.
+        chunk_size (int) = The maximum number of the pairs of a task.
+
+    Returns:
+        tasks (list) = The tasks i.e. (right image's id, left images' ids).
+
+    """
+    chunk_size = max(1, int(chunk_size))
+    tasks = [(train_id, query_ids[i:i + chunk_size]) for train_id, query_ids in groups.items()
+             for i in range(0, len(query_ids), chunk_size)]
+    return sorted(tasks, key=lambda task: len(task[1]), reverse=True)
+
+
+def match_train_image(train_id, query_ids, matchers=None):
+    """
+    This function matches the pairs of a right (train) image, thus the image's index is trained once.
+    Args:
+        train_id (int)             = The right image's id.
+        query_ids (list)           = The left images' ids.
+        matchers (FlannIndexCache) = The FLANN indexes, None for a new (task's) cache.
+
+    Returns:
+        output (dict) = The pairs' results (PairMatch) and the statistics of the task's cache (None if the matchers
+                        are given).
+
+    """
+    statistics = matchers is None
+    if matchers is None:
+        matchers = FlannIndexCache(float(config['flann_index_cache_size']),
+                                   binary_matcher=config['binary_matcher'])
+    results = [PairMatch([query_id, train_id], shared_images, matchers, shared_pair_store) for query_id in query_ids]
+    return {'results': results, 'statistics': matchers.statistics() if statistics else None}
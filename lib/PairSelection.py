@@ -0,0 +1,164 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program selects the pairs of images, which are matched, according to the images' metadata and appearance.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***The selection follows the OpenSfM's matching_*_neighbors configuration (lib.config).***
+
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from lib.utils import message, error_message
+
+earth_radius = 6378137.0
+
+
+def exhaustive_pairs(count):
+    """
+    This function returns all the pairs of the images i.e. for 3 images the pairs are (0, 1), (0, 2), (1, 2).
+    Args:
+        count (int) = The number of the images.
+
+    Returns:
+        pairs (set) = The pairs (i, j), i < j.
+
+    """
+    return {(i, j) for i in range(0, count) for j in range(i + 1, count)}
+
+
+def nearest_pairs(distances, neighbors, max_distance=0):
+    """
+    This function pairs each image with its nearest images.
+    Args:
+        distances (numpy array) = The distances between the images (count x count).
+        neighbors (int)         = The number of the nearest images of each image, 0 for no limit.
+        max_distance (float)    = The maximum distance of a pair, 0 for no limit.
+
+    Returns:
+        pairs (set) = The pairs (i, j), i < j.
+
+    """
+    count = len(distances)
+    distances = np.array(distances, dtype=np.float64)
+    np.fill_diagonal(distances, np.inf)
+    if max_distance > 0:
+        distances[distances > max_distance] = np.inf
+
+    limit = count - 1 if neighbors <= 0 else min(neighbors, count - 1)
+    nearest = np.argsort(distances, axis=1, kind='stable')[:, :limit]
+    pairs = set()
+    for i in range(0, count):
+        for j in nearest[i]:
+            if np.isfinite(distances[i, j]):
+                pairs.add((min(i, int(j)), max(i, int(j))))
+    return pairs
+
+
+def order_pairs(imagesnames, neighbors):
+    """This function pairs each image with the next images by name"""
+    order = sorted(range(0, len(imagesnames)), key=lambda i: imagesnames[i])
+    return {(min(order[i], order[j]), max(order[i], order[j]))
+            for i in range(0, len(order)) for j in range(i + 1, min(i + neighbors + 1, len(order)))}
+
+
+def parse_timestamp(timestamp):
+    """This function converts an EXIF timestamp (i.e. 2021:01:31 10:00:00) to seconds, or None"""
+    try:
+        return datetime.strptime(timestamp, '%Y:%m:%d %H:%M:%S').timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def gps_to_local(positions):
+    """
+    This function converts the GPS positions to local metric coordinates (equirectangular approximation).
+    Args:
+        positions (list) = The GPS positions (latitude, longitude, altitude).
+
+    Returns:
+        coordinates (numpy array) = The coordinates (x, y, z) in metres, relative to the mean position.
+
+    """
+    positions = np.array([[p[0], p[1], p[2] if p[2] is not None else 0] for p in positions], dtype=np.float64)
+    latitude, longitude = np.radians(positions[:, 0]), np.radians(positions[:, 1])
+    x = (longitude - longitude.mean()) * np.cos(latitude.mean()) * earth_radius
+    y = (latitude - latitude.mean()) * earth_radius
+    return np.column_stack((x, y, positions[:, 2] - positions[:, 2].mean()))
+
+
+def select_pairs(imagesnames, exifs, thumbnails, config):
+    """
+    This function selects the pairs of images, which are matched. Each enabled criterion (image name order, capture
+    time, GPS distance and thumbnail similarity) adds its pairs. If none of them is enabled (or their metadata are
+    missing), all the pairs are selected.
+    Args:
+        imagesnames (list) = The images' names.
+        exifs (list)       = The images' metadata (CameraRegistry.read_exif).
+        thumbnails (list)  = The images' global descriptors (Geometry.Image.thumbnail_descriptor).
+        config (dict)      = The configuration (lib.config).
+
+    Returns:
+        pairs (list) = The pairs [i, j], i < j, sorted.
+
+    """
+    count = len(imagesnames)
+    pairs = set()
+    selected = False
+
+    order_neighbors = int(config['matching_order_neighbors'])
+    if order_neighbors > 0:
+        pairs |= order_pairs(imagesnames, order_neighbors)
+        selected = True
+
+    time_neighbors = int(config['matching_time_neighbors'])
+    if time_neighbors > 0:
+        times = [parse_timestamp(exif.get('timestamp')) for exif in exifs]
+        if None in times:
+            error_message('Some images have not a capture time, the time neighbors are not used')
+        else:
+            times = np.array(times)
+            pairs |= nearest_pairs(np.abs(times[:, None] - times[None, :]), time_neighbors)
+            selected = True
+
+    gps_neighbors = int(config['matching_gps_neighbors'])
+    gps_distance = float(config['matching_gps_distance'])
+    if gps_neighbors > 0 or gps_distance > 0:
+        positions = [exif.get('gps') for exif in exifs]
+        if any(position is None for position in positions):
+            if any(position is not None for position in positions):
+                error_message('Some images have not a GPS position, the GPS neighbors are not used')
+        else:
+            coordinates = gps_to_local(positions)
+            distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=2)
+            pairs |= nearest_pairs(distances, gps_neighbors, gps_distance)
+            selected = True
+
+    thumbnail_neighbors = int(config.get('matching_thumbnail_neighbors', 0))
+    if thumbnail_neighbors > 0:
+        descriptors = np.array(thumbnails, dtype=np.float32)
+        pairs |= nearest_pairs(1 - descriptors @ descriptors.T, thumbnail_neighbors)
+        selected = True
+
+    if not selected:
+        pairs = exhaustive_pairs(count)
+
+    message(f'Selected {len(pairs)} out of {count * (count - 1) // 2} pairs')
+    return [list(pair) for pair in sorted(pairs)]
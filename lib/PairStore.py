@@ -0,0 +1,69 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program stores the matches and the two-view geometry of each pair, thus they are not computed again.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***A pair's key combines the feature keys of its images (see FeatureStore) with the matcher's and the estimator's
+parameters, thus re-extracted features or a changed configuration are a different key.***
+
+"""
+
+import hashlib
+import json
+
+from lib.FeatureStore import FeatureStore
+
+
+class PairStore(FeatureStore):
+    """
+        Name: PairStore
+
+        Description: PairStore class stores, for each pair, the good matches (query index, train index, distance), the
+                     fundamental and the essential matrix, the pose (R, t) and the inliers' masks into a compressed
+                     .npz archive (see FeatureStore). Each archive is named after a key, which combines the feature
+                     keys of the pair's images with the matcher's and the estimator's parameters.
+
+        Parameters:
+            directory:               The directory of the archives.
+
+        Functions:
+            --- Methods ---
+            key:                     Returns the key of a pair's feature keys and parameters.
+    """
+
+    def __init__(self, directory: str = 'matches'):
+        """Constructor"""
+        FeatureStore.__init__(self, directory)
+
+    # --- Methods ---
+    @staticmethod
+    def key(left_key, right_key, parameters):
+        """
+            Returns the key of a pair's feature keys and parameters. The pair is ordered i.e. (left, right) and
+            (right, left) are different keys.
+
+            args:
+                left_key (str):    The feature key of the left (query) image.
+                right_key (str):   The feature key of the right (train) image.
+                parameters (dict): The matcher's and the estimator's parameters (json serializable).
+
+            returns:
+                key (str):         The key (sha1 hexadecimal digest).
+        """
+        description = json.dumps({'left': left_key, 'right': right_key, 'parameters': parameters}, sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
@@ -0,0 +1,223 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program reads and writes the point clouds (binary PLY, numpy record files or ASCII text) of the 3DPlan software.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***A point cloud is a numpy structured array i.e. one record (x, y, z, red, green, blue, label) per point.***
+
+"""
+
+import os
+
+import numpy as np
+
+from lib.config import default_config
+
+config = default_config()
+
+# The suffix of the intermediate point clouds (merged, edges, LinesLabels), config's point_cloud_format.
+cloud_suffix = '.txt' if str(config['point_cloud_format']).upper() == 'TXT' else '.ply'
+
+# The PLY's property types --> numpy's types (and back).
+ply_types = {'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1', 'short': 'i2', 'int16': 'i2', 'ushort': 'u2',
+             'uint16': 'u2', 'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4', 'float': 'f4',
+             'float32': 'f4', 'double': 'f8', 'float64': 'f8'}
+numpy_types = {'i1': 'char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort', 'i4': 'int', 'u4': 'uint', 'f4': 'float',
+               'f8': 'double'}
+ply_formats = {'ascii': None, 'binary_little_endian': '<', 'binary_big_endian': '>'}
+
+# The fields of the 3DPlan's point clouds i.e. the points, their colours and their labels (4th channel).
+cloud_fields = [('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'),
+                ('label', 'u1')]
+
+
+def cloud_array(points, colours=None, fields=None):
+    """
+    This function combines the points and their properties (i.e. colours and labels) into a point cloud.
+    Args:
+        points (numpy array)  = The points (x, y, z).
+        colours (numpy array) = The properties of the points i.e. red, green, blue and label, None for no properties.
+        fields (list)         = The properties' names and types, None for the red, green, blue and label (uchar).
+
+    Returns:
+        cloud (numpy array) = The point cloud (structured array).
+
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    colours = np.empty((len(points), 0)) if colours is None else np.asarray(colours)
+    # An empty cloud keeps the number of the properties, which can not be inferred by reshape.
+    colours = colours.reshape(len(points), -1 if len(points) else colours.shape[-1])
+    fields = cloud_fields[3:3 + colours.shape[1]] if fields is None else list(fields)
+    cloud = np.empty(len(points), dtype=cloud_fields[:3] + fields)
+    cloud['x'], cloud['y'], cloud['z'] = points[:, 0], points[:, 1], points[:, 2]
+    for i, (name, _) in enumerate(fields):
+        cloud[name] = colours[:, i]
+    return cloud
+
+
+def cloud_points(cloud):
+    """This function returns the points (x, y, z) of a point cloud as an array (n x 3)"""
+    return np.column_stack((cloud['x'], cloud['y'], cloud['z'])).astype(np.float64)
+
+
+def format_cloud(cloud):
+    """
+    This function formats a point cloud into ASCII lines i.e. "x y z red green blue label".
+    Args:
+        cloud (numpy array) = The point cloud.
+
+    Returns:
+        lines (list) = The lines of the points.
+
+    """
+    return [' '.join(str(value) for value in record) + '\n' for record in cloud.tolist()]
+
+
+def write_ply(filename, cloud, binary=True):
+    """
+    This function writes a point cloud into a PLY file (binary little-endian or ASCII).
+    Args:
+        filename (str)      = The PLY file.
+        cloud (numpy array) = The point cloud.
+        binary (bool)       = If the file is binary (little-endian) or ASCII.
+
+    Returns:
+
+    """
+    dtype = np.dtype([(name, np.dtype(cloud.dtype[name]).newbyteorder('<')) for name in cloud.dtype.names])
+    header = ['ply', f'format {"binary_little_endian" if binary else "ascii"} 1.0', f'element vertex {len(cloud)}']
+    header += [f'property {numpy_types[dtype[name].str[1:]]} {name}' for name in dtype.names]
+    header += ['end_header']
+    with open(filename, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+        if binary:
+            f.write(cloud.astype(dtype).tobytes())
+        else:
+            f.write(''.join(format_cloud(cloud)).encode('ascii'))
+
+
+def read_ply(filename):
+    """
+    This function reads the vertices of a PLY file (binary little/big-endian or ASCII) as a point cloud.
+    Args:
+        filename (str) = The PLY file.
+
+    Returns:
+        cloud (numpy array) = The point cloud (the vertices' properties, by their names).
+
+    """
+    with open(filename, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise ValueError(f'{filename} is not a PLY file')
+        byte_order, element, count, fields, skipped = None, None, 0, [], []
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f'{filename} has not an end_header')
+            words = line.decode('ascii', errors='replace').split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+            if words[0] == 'end_header':
+                break
+            if words[0] == 'format':
+                if words[1] not in ply_formats:
+                    raise ValueError(f'{filename} has an unknown format {words[1]}')
+                byte_order = ply_formats[words[1]]
+            elif words[0] == 'element':
+                element = words[1]
+                if element == 'vertex':
+                    count = int(words[2])
+                elif not fields:
+                    # The elements before the vertices (i.e. a camera) are not supported.
+                    skipped.append(element)
+            elif words[0] == 'property' and element == 'vertex':
+                if words[1] == 'list':
+                    raise ValueError(f'{filename} has a list property of the vertices')
+                fields.append((words[2], (byte_order or '<') + ply_types[words[1]]))
+        if skipped:
+            raise ValueError(f'{filename} has the elements {skipped} before the vertices')
+
+        if byte_order is None:
+            lines = [f.readline().decode('ascii') for _ in range(0, count)]
+            values = np.loadtxt(lines, ndmin=2, usecols=range(0, len(fields))) if count else \
+                np.empty((0, len(fields)))
+            cloud = np.empty(count, dtype=fields)
+            for i, (name, _) in enumerate(fields):
+                cloud[name] = values[:, i]
+            return cloud
+        return np.frombuffer(f.read(np.dtype(fields).itemsize * count), dtype=fields, count=count).copy()
+
+
+def read_cloud(filename, skip_rows: int = 0):
+    """
+    This function reads a point cloud according to its suffix i.e. PLY (binary or ASCII), numpy record file (.npy)
+    or ASCII text (x y z red green blue label, or only x y z and other columns).
+    Args:
+        filename (str)  = The point cloud's file.
+        skip_rows (int) = The skipped lines of an ASCII text (i.e. a header).
+
+    Returns:
+        cloud (numpy array) = The point cloud.
+
+    """
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix == '.ply':
+        return read_ply(filename)
+    if suffix == '.npy':
+        return np.load(filename)
+
+    values = np.loadtxt(filename, ndmin=2, skiprows=skip_rows)
+    if values.shape[1] == len(cloud_fields):
+        return cloud_array(values[:, :3], values[:, 3:])
+    return cloud_array(values[:, :3], values[:, 3:],
+                       [(f'property{i}', '<f8') for i in range(3, values.shape[1])])
+
+
+def write_cloud(filename, cloud, append: bool = False):
+    """
+    This function writes a point cloud according to its suffix i.e. binary PLY, numpy record file (.npy) or ASCII
+    text (.txt). Nothing is written (or created) if an appended point cloud is empty.
+    Args:
+        filename (str)      = The point cloud's file.
+        cloud (numpy array) = The point cloud.
+        append (bool)       = If the points are added into an existing file.
+
+    Returns:
+
+    """
+    if append and len(cloud) == 0:
+        return
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix == '.txt':
+        with open(filename, 'a' if append else 'w', buffering=1 << 20) as f:
+            f.write(''.join(format_cloud(cloud)))
+        return
+
+    # The binary files are rewritten with the existing points, since their headers contain the number of the points.
+    if append and os.path.isfile(filename):
+        existing = read_cloud(filename)
+        if existing.dtype.names != cloud.dtype.names:
+            raise ValueError(f'{filename} has the fields {existing.dtype.names}, not {cloud.dtype.names}')
+        cloud = np.concatenate((existing, cloud.astype(existing.dtype)))
+    if suffix == '.npy':
+        temporary = f'{filename}.tmp.npy'
+        np.save(temporary, cloud)
+    else:
+        temporary = f'{filename}.tmp'
+        write_ply(temporary, cloud)
+    os.replace(temporary, filename)
@@ -0,0 +1,590 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program links the pairs' matches into tracks and reconstructs all the images incrementally (MyTriangulation).
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***The thresholds follow the OpenSfM's configuration (lib.config) i.e. the reprojection errors are in radians.***
+
+"""
+
+import cv2 as cv
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from lib.BundleAdjustment import BundleAdjustment
+from lib.Estimators import essential_matrix
+from lib.utils import message, error_message
+
+
+class Tracks:
+    """
+        Name: Tracks
+
+        Description: Tracks class links the pairs' matches into tracks i.e. the key points of different images, which
+                     show the same 3D point. The key points are the nodes of a graph and the matches are its edges, thus
+                     each connected component (union-find) is a track. The tracks which contain more than one key
+                     point of the same image are inconsistent and they are discarded.
+
+        Parameters:
+            features_counts:         The number of the key points of each image.
+            matches:                 The matches of each pair, {(left id, right id): (left indexes, right indexes)}.
+            min_length:              The minimum number of the images of a track.
+
+        Functions:
+            --- Getters ---
+            get_count:               Get the number of the tracks.
+            get_track_ids:           Get the track of each observation.
+            get_image_ids:           Get the image of each observation.
+            get_feature_ids:         Get the key point (index) of each observation.
+
+            --- Methods ---
+            link:                    Links the matches into tracks.
+            lengths:                 Returns the number of the observations of each track.
+
+            The observations (track, image, key point) are sorted by track and then by image.
+    """
+
+    def __init__(self, features_counts, matches, min_length: int = 2):
+        """Constructor"""
+        self.features_counts = np.asarray(features_counts, dtype=np.int64)
+        self.matches = matches
+        self.min_length = max(int(min_length), 2)
+
+        self.count: int = 0
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.image_ids = np.empty(0, dtype=np.int64)
+        self.feature_ids = np.empty(0, dtype=np.int64)
+
+        # --- Pull the trigger ---
+        Tracks.link(self)
+
+    # --- Getters ---
+    def get_count(self):
+        return self.count
+
+    def get_track_ids(self):
+        return self.track_ids
+
+    def get_image_ids(self):
+        return self.image_ids
+
+    def get_feature_ids(self):
+        return self.feature_ids
+
+    # --- Methods ---
+    def link(self):
+        """This function links the matches into tracks (connected components of the key points' graph)"""
+        offsets = np.concatenate(([0], np.cumsum(self.features_counts)))
+        left, right = [], []
+        for (left_id, right_id), (left_features, right_features) in self.matches.items():
+            left.append(offsets[left_id] + np.asarray(left_features, dtype=np.int64))
+            right.append(offsets[right_id] + np.asarray(right_features, dtype=np.int64))
+        if not left:
+            return
+        left, right = np.concatenate(left), np.concatenate(right)
+
+        nodes = int(offsets[-1])
+        graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(nodes, nodes))
+        _, components = connected_components(graph, directed=False)
+
+        # Only the matched key points are observations.
+        observed = np.unique(np.concatenate((left, right)))
+        components = components[observed]
+        image_ids = np.searchsorted(offsets, observed, side='right') - 1
+        feature_ids = observed - offsets[image_ids]
+
+        order = np.lexsort((image_ids, components))
+        components, image_ids, feature_ids = components[order], image_ids[order], feature_ids[order]
+
+        # A track which contains two key points of the same image is inconsistent.
+        duplicated = (components[1:] == components[:-1]) & (image_ids[1:] == image_ids[:-1])
+        inconsistent = np.unique(components[1:][duplicated])
+        unique_components, lengths = np.unique(components, return_counts=True)
+        valid = unique_components[(lengths >= self.min_length) & ~np.isin(unique_components, inconsistent)]
+
+        keep = np.isin(components, valid)
+        self.track_ids = np.searchsorted(valid, components[keep])
+        self.image_ids = image_ids[keep]
+        self.feature_ids = feature_ids[keep]
+        self.count = len(valid)
+        message(f'Linked {len(self.track_ids)} key points into {self.count} tracks '
+                f'({len(inconsistent)} inconsistent tracks discarded)')
+
+    def lengths(self):
+        """This function returns the number of the observations of each track"""
+        return np.bincount(self.track_ids, minlength=self.count)
+
+
+class Reconstruction:
+    """
+        Name: Reconstruction
+
+        Description: Reconstruction class registers the images incrementally into the frame of an initial pair. The
+                     initial pair is the pair with the most triangulated matches (PairMatch) and its right image is
+                     the origin. Each next image is the image which observes the most reconstructed tracks and it is
+                     registered by its 2D-3D correspondences (cv.solvePnPRansac). Each track is triangulated once
+                     (all its registered observations), when at least two of its images are registered.
+                     The poses, the cameras' intrinsics parameters and the points are refined by bundle adjustment:
+                     a local one (the new image's neighbors, local_bundle_*) after each registration and a global one
+                     after the initial pair, when the points grow by bundle_new_points_ratio or bundle_interval images
+                     are added and at the end. The observations with large reprojection errors are then discarded.
+
+        Parameters:
+            images:                  The images (Geometry.Image).
+            results:                 The pairs' results (PairMatch).
+            config:                  The configuration (lib.config).
+            bundle_adjustment:       If the reconstruction is refined by bundle adjustment.
+
+        Functions:
+            --- Getters ---
+            get_tracks:              Get the tracks (Tracks).
+            get_registered:          Get the registered images' ids, in the registration order.
+            get_poses:               Get the rotations and translations of the images (world --> camera).
+            get_points:              Get the reconstructed points (x, y, z).
+            get_colours:             Get the colours (red, green, blue) and the labels of the reconstructed points.
+            get_point_tracks:        Get the track of each reconstructed point.
+            get_camera_matrices:     Get the (refined) camera matrix of each image.
+
+            --- Methods ---
+            cameras_intrinsics:      Groups the images by camera and returns the cameras' intrinsics parameters.
+            normalized_observations: Converts the observations to normalized image coordinates.
+            normalized_points:       Converts an image's key points to normalized image coordinates.
+            initial_pair:            Registers the initial pair.
+            triangulate:             Triangulates the tracks, which are observed by at least two registered images.
+            next_image:              Returns the next image, which observes the most reconstructed tracks.
+            resect:                  Registers an image by its 2D-3D correspondences.
+            covisibility:            Returns the number of the common points of each pair of registered images.
+            local_window:            Returns the images of a local bundle adjustment.
+            bundle:                  Refines the reconstruction (or a local window) by bundle adjustment.
+            remove_outliers:         Discards the observations with large reprojection errors.
+            reconstruct:             Registers all the images which can be registered.
+            colour_points:           Samples the colours and the labels of the reconstructed points.
+    """
+
+    def __init__(self, images, results, config, bundle_adjustment: bool = True):
+        """Constructor"""
+        self.images = images
+        self.results = [result for result in results if len(result.R) != 0 and len(result.idsL) != 0]
+
+        self.triangulation_threshold = float(config['triangulation_threshold'])
+        self.min_ray_angle = np.radians(float(config['triangulation_min_ray_angle']))
+        self.resection_threshold = float(config['resection_threshold'])
+        self.resection_min_inliers = int(config['resection_min_inliers'])
+        self.initial_min_inliers = int(config['five_point_algo_min_inliers'])
+        self.initial_threshold = float(config['five_point_algo_threshold'])
+        self.estimator = config['robust_estimator']
+        self.confidence = float(config['robust_confidence'])
+
+        self.config = config
+        self.bundle_adjustment = bundle_adjustment
+        self.optimize_intrinsics = bool(config['optimize_camera_parameters'])
+        self.local_bundle_radius = int(config['local_bundle_radius'])
+        self.local_bundle_min_common_points = int(config['local_bundle_min_common_points'])
+        self.local_bundle_max_shots = int(config['local_bundle_max_shots'])
+        self.bundle_interval = int(config['bundle_interval'])
+        self.bundle_new_points_ratio = float(config['bundle_new_points_ratio'])
+        self.outlier_filtering = config['bundle_outlier_filtering_type']
+        self.outlier_ratio = float(config['bundle_outlier_auto_ratio'])
+        self.outlier_threshold = float(config['bundle_outlier_fixed_threshold'])
+
+        self.tracks = Tracks([len(image.points) for image in self.images],
+                             {tuple(result.pair): result.get_inliers() for result in self.results},
+                             config['min_track_length'])
+
+        count = len(self.images)
+        self.rotations = np.tile(np.eye(3), (count, 1, 1))
+        self.translations = np.zeros((count, 3))
+        self.registered = np.zeros(count, dtype=bool)
+        self.failed = np.zeros(count, dtype=bool)
+        self.order: list = []
+        self.baseline: float = 0
+
+        self.track_points = np.full((self.tracks.get_count(), 3), np.nan)
+        self.triangulated = np.zeros(self.tracks.get_count(), dtype=bool)
+        self.attempts = np.zeros(self.tracks.get_count(), dtype=np.int64)
+
+        # The images of the same camera (CameraRegistry) share their intrinsics parameters (focal, cx, cy).
+        self.image_cameras, self.intrinsics = Reconstruction.cameras_intrinsics(self)
+        self.pixels = np.zeros((len(self.tracks.get_image_ids()), 2))
+        for image_id in np.unique(self.tracks.get_image_ids()):
+            selected = self.tracks.get_image_ids() == image_id
+            self.pixels[selected] = np.asarray(self.images[image_id].points,
+                                               dtype=np.float64)[self.tracks.get_feature_ids()[selected], :2]
+        self.observations = Reconstruction.normalized_observations(self)
+        self.outliers = np.zeros(len(self.pixels), dtype=bool)
+
+        self.colours = np.empty((0, 4), dtype=np.int64)
+
+        # --- Pull the trigger ---
+        Reconstruction.reconstruct(self)
+        Reconstruction.colour_points(self)
+
+    # --- Getters ---
+    def get_tracks(self):
+        return self.tracks
+
+    def get_registered(self):
+        return self.order
+
+    def get_poses(self):
+        return self.rotations, self.translations
+
+    def get_points(self):
+        return self.track_points[self.triangulated]
+
+    def get_colours(self):
+        return self.colours
+
+    def get_point_tracks(self):
+        return np.flatnonzero(self.triangulated)
+
+    def get_camera_matrices(self):
+        intrinsics = self.intrinsics[self.image_cameras]
+        matrices = np.tile(np.eye(3), (len(self.images), 1, 1))
+        matrices[:, 0, 0], matrices[:, 1, 1] = intrinsics[:, 0], intrinsics[:, 0]
+        matrices[:, 0, 2], matrices[:, 1, 2] = intrinsics[:, 1], intrinsics[:, 2]
+        return matrices
+
+    # --- Methods ---
+    def cameras_intrinsics(self):
+        """
+            Groups the images by camera (an image without a registered camera is its own camera) and returns the
+            cameras' intrinsics parameters, from the images' camera matrices.
+
+            returns:
+                image_cameras (numpy array): The camera of each image.
+                intrinsics (numpy array):    The focal length and the principal point (cx, cy) of each camera.
+        """
+        names, intrinsics = [], []
+        image_cameras = np.zeros(len(self.images), dtype=np.int64)
+        for image_id, image in enumerate(self.images):
+            camera = image.get_camera()
+            name = camera.get_camera_id() if camera is not None else f'image {image_id}'
+            if name not in names:
+                matrix = np.asarray(image.camera_matrix, dtype=np.float64)
+                names.append(name)
+                intrinsics.append([matrix[0, 0], matrix[0, 2], matrix[1, 2]])
+            image_cameras[image_id] = names.index(name)
+        return image_cameras, np.array(intrinsics)
+
+    def normalized_observations(self):
+        """This function converts the observations (pixels) to normalized image coordinates i.e. K^-1 * (x, y, 1)"""
+        intrinsics = self.intrinsics[self.image_cameras[self.tracks.get_image_ids()]]
+        return (self.pixels - intrinsics[:, 1:]) / intrinsics[:, :1]
+
+    def initial_pair(self):
+        """
+            Registers the initial pair i.e. the pair with the most triangulated matches, whose pose (essential matrix
+            on the normalized coordinates, five_point_algo_threshold) has at least five_point_algo_min_inliers
+            inliers. The right image is the origin.
+
+            returns:
+                registered (bool): If an initial pair is registered.
+        """
+        candidates = sorted([result for result in self.results if len(result.idsL) >= self.initial_min_inliers],
+                            key=lambda candidate: len(candidate.idsL), reverse=True)
+        for result in candidates:
+            left_id, right_id = result.pair
+            left = Reconstruction.normalized_points(self, left_id, result.idsL)
+            right = Reconstruction.normalized_points(self, right_id, result.idsR)
+            E, mask = essential_matrix(left, right, np.eye(3), self.estimator, self.initial_threshold,
+                                       self.confidence)
+            if len(E) == 0 or mask.sum() < self.initial_min_inliers:
+                continue
+            # The pose transforms the left camera's points to the right camera's frame (x_R = R * x_L + t).
+            inliers, R, t, _ = cv.recoverPose(E, left[mask], right[mask], np.eye(3))
+            if inliers < self.initial_min_inliers:
+                continue
+
+            t = t.ravel()
+            self.rotations[left_id] = R.T
+            self.translations[left_id] = -R.T @ t
+            self.registered[[left_id, right_id]] = True
+            self.order += [right_id, left_id]
+            self.baseline = float(np.linalg.norm(t))
+            message(f'Initial pair {result.pair} with {inliers} inliers out of {len(result.idsL)} matches')
+            return True
+
+        error_message(f'There is not a pair with at least {self.initial_min_inliers} inliers')
+        return False
+
+    def normalized_points(self, image_id, feature_ids):
+        """This function returns the normalized image coordinates of an image's key points"""
+        intrinsics = self.intrinsics[self.image_cameras[image_id]]
+        points = np.asarray(self.images[image_id].points, dtype=np.float64)[feature_ids, :2]
+        return (points - intrinsics[1:]) / intrinsics[0]
+
+    def triangulate(self):
+        """
+            Triangulates (DLT) the tracks, which are observed by at least two registered images and they are not
+            reconstructed. A rejected track is triangulated again, only if more of its images are registered. The
+            points must be in front of all the cameras, their reprojection errors must be lower than the
+            triangulation_threshold and their rays must form an angle of at least triangulation_min_ray_angle.
+
+            returns:
+                count (int): The number of the new points.
+        """
+        track_ids = self.tracks.get_track_ids()
+        image_ids = self.tracks.get_image_ids()
+        registered = self.registered[image_ids] & ~self.outliers
+        counts = np.bincount(track_ids[registered], minlength=self.tracks.get_count())
+        candidates = ~self.triangulated & (counts >= 2) & (counts > self.attempts)
+        self.attempts[candidates] = counts[candidates]
+
+        new_points = 0
+        # The tracks are grouped by their number of registered observations, thus each group is one array.
+        for views in np.unique(counts[candidates]):
+            selected = registered & candidates[track_ids] & (counts[track_ids] == views)
+            tracks = track_ids[selected].reshape(-1, views)[:, 0]
+            cameras = image_ids[selected].reshape(-1, views)
+            observations = self.observations[selected].reshape(-1, views, 2)
+
+            rotations = self.rotations[cameras]  # (tracks, views, 3, 3)
+            translations = self.translations[cameras]  # (tracks, views, 3)
+            projections = np.concatenate((rotations, translations[..., None]), axis=3)
+
+            # Each observation adds the rows x * P3 - P1 and y * P3 - P2 to the DLT system.
+            rows = np.concatenate((observations[..., 0, None] * projections[:, :, 2] - projections[:, :, 0],
+                                   observations[..., 1, None] * projections[:, :, 2] - projections[:, :, 1]), axis=1)
+            homogeneous = np.linalg.svd(rows)[2][:, -1]
+            valid = np.abs(homogeneous[:, 3]) > 1e-12
+            points = homogeneous[:, :3] / np.where(valid, homogeneous[:, 3], 1)[:, None]
+
+            camera_points = np.einsum('tvij,tj->tvi', rotations, points) + translations
+            depth = camera_points[..., 2]
+            valid &= np.all(depth > 0, axis=1)
+            errors = np.linalg.norm(camera_points[..., :2] / np.where(depth > 0, depth, 1)[..., None] - observations,
+                                    axis=2)
+            valid &= np.all(errors < self.triangulation_threshold, axis=1)
+
+            centers = -np.einsum('tvji,tvj->tvi', rotations, translations)
+            rays = points[:, None, :] - centers
+            rays /= np.maximum(np.linalg.norm(rays, axis=2, keepdims=True), 1e-12)
+            cosines = np.einsum('tvi,tui->tvu', rays, rays)
+            valid &= np.arccos(np.clip(cosines.min(axis=(1, 2)), -1, 1)) >= self.min_ray_angle
+
+            self.track_points[tracks[valid]] = points[valid]
+            self.triangulated[tracks[valid]] = True
+            new_points += int(valid.sum())
+        return new_points
+
+    def next_image(self):
+        """This function returns the next image, which observes the most reconstructed tracks, and their number"""
+        image_ids = self.tracks.get_image_ids()
+        observed = self.triangulated[self.tracks.get_track_ids()] & ~self.outliers
+        counts = np.bincount(image_ids[observed], minlength=len(self.images))
+        counts[self.registered | self.failed] = -1
+        image_id = int(np.argmax(counts))
+        return image_id, int(counts[image_id])
+
+    def resect(self, image_id):
+        """
+            Registers an image by its 2D-3D correspondences (cv.solvePnPRansac on the normalized coordinates).
+
+            args:
+                image_id (int):    The image's id.
+
+            returns:
+                registered (bool): If the image is registered.
+        """
+        selected = (self.tracks.get_image_ids() == image_id) & self.triangulated[self.tracks.get_track_ids()] & \
+            ~self.outliers
+        object_points = self.track_points[self.tracks.get_track_ids()[selected]]
+        image_points = self.observations[selected]
+        if len(object_points) < max(self.resection_min_inliers, 6):
+            return False
+
+        found, rvec, tvec, inliers = cv.solvePnPRansac(object_points, image_points, np.eye(3), None,
+                                                       iterationsCount=1000,
+                                                       reprojectionError=self.resection_threshold,
+                                                       confidence=0.999)
+        inliers_count = len(inliers) if inliers is not None else 0
+        if not found or inliers_count < self.resection_min_inliers:
+            message(f'Image with id = {image_id} is not registered ({inliers_count} inliers out of '
+                    f'{len(object_points)} points)')
+            return False
+
+        self.rotations[image_id] = cv.Rodrigues(rvec)[0]
+        self.translations[image_id] = tvec.ravel()
+        self.registered[image_id] = True
+        self.order.append(image_id)
+        message(f'Registered image with id = {image_id} ({inliers_count} inliers out of {len(object_points)} points)')
+        return True
+
+    def covisibility(self):
+        """This function returns the number of the common (reconstructed) points of each pair of registered images"""
+        track_ids = self.tracks.get_track_ids()
+        image_ids = self.tracks.get_image_ids()
+        selected = self.registered[image_ids] & self.triangulated[track_ids] & ~self.outliers
+        visibility = coo_matrix((np.ones(int(selected.sum())), (image_ids[selected], track_ids[selected])),
+                                shape=(len(self.images), self.tracks.get_count())).tocsr()
+        common = (visibility @ visibility.T).toarray()
+        np.fill_diagonal(common, 0)
+        return common
+
+    def local_window(self, image_id):
+        """
+            Returns the images of a local bundle adjustment i.e. the images, which are at most local_bundle_radius
+            steps away from the image, in the graph of the images with at least local_bundle_min_common_points common
+            points. The nearest local_bundle_max_shots images are kept.
+
+            args:
+                image_id (int):   The (new) image's id.
+
+            returns:
+                window (list):    The images' ids, nearest first.
+        """
+        common = Reconstruction.covisibility(self)
+        window, frontier = [image_id], [image_id]
+        for _ in range(0, self.local_bundle_radius):
+            neighbors = []
+            for current in frontier:
+                # The neighbors with the most common points are added first.
+                for neighbor in np.argsort(-common[current], kind='stable'):
+                    if common[current, neighbor] < self.local_bundle_min_common_points:
+                        break
+                    if int(neighbor) not in window and int(neighbor) not in neighbors:
+                        neighbors.append(int(neighbor))
+            window += neighbors
+            frontier = neighbors
+            if not frontier or len(window) >= self.local_bundle_max_shots:
+                break
+        return window[:self.local_bundle_max_shots]
+
+    def bundle(self, window=None):
+        """
+            Refines the reconstruction by bundle adjustment. A global adjustment refines all the registered images,
+            the cameras' intrinsics parameters (optimize_camera_parameters) and the points. A local adjustment refines
+            only the window's images and their points, while the other images, which observe these points, and the
+            intrinsics are constants. The first registered image (origin) is always constant and the distance of the
+            initial pair's centers (unit baseline) is kept by a prior, thus the reconstruction's scale does not drift.
+
+            args:
+                window (list): The images of a local adjustment, None for a global one.
+        """
+        track_ids = self.tracks.get_track_ids()
+        image_ids = self.tracks.get_image_ids()
+        selected = self.registered[image_ids] & self.triangulated[track_ids] & ~self.outliers
+        in_window = np.zeros(len(self.images), dtype=bool)
+        in_window[window if window is not None else np.flatnonzero(self.registered)] = True
+        selected &= np.isin(track_ids, track_ids[selected & in_window[image_ids]])
+        selected = np.flatnonzero(selected)
+        if len(selected) == 0:
+            return
+
+        shots = np.unique(image_ids[selected])
+        tracks = np.unique(track_ids[selected])
+        cameras = np.unique(self.image_cameras[shots])
+        optimize_intrinsics = window is None and self.optimize_intrinsics
+        baseline = None
+        if np.all(np.isin(self.order[:2], shots)) and in_window[self.order[1]]:
+            baseline = (int(np.searchsorted(shots, self.order[0])), int(np.searchsorted(shots, self.order[1])),
+                        self.baseline)
+        adjustment = BundleAdjustment(self.rotations[shots], self.translations[shots],
+                                      np.searchsorted(cameras, self.image_cameras[shots]), self.intrinsics[cameras],
+                                      self.track_points[tracks], np.searchsorted(shots, image_ids[selected]),
+                                      np.searchsorted(tracks, track_ids[selected]), self.pixels[selected],
+                                      ~in_window[shots] | (shots == self.order[0]), optimize_intrinsics, self.config,
+                                      baseline)
+
+        self.rotations[shots] = adjustment.get_rotations()
+        self.translations[shots] = adjustment.get_translations()
+        self.track_points[tracks] = adjustment.get_points()
+        if optimize_intrinsics:
+            self.intrinsics[cameras] = adjustment.get_intrinsics()
+            self.observations = Reconstruction.normalized_observations(self)
+        Reconstruction.remove_outliers(self, selected, adjustment.get_errors())
+
+    def remove_outliers(self, selected, errors):
+        """
+            Discards the observations, whose reprojection errors (radians) are larger than the
+            bundle_outlier_fixed_threshold (FIXED) or the bundle_outlier_auto_ratio times the mean error (AUTO). The
+            points with less than two remaining observations are discarded too.
+
+            args:
+                selected (numpy array): The adjusted observations (indexes).
+                errors (numpy array):   The observations' reprojection errors (radians).
+        """
+        if self.outlier_filtering == 'AUTO':
+            threshold = self.outlier_ratio * errors.mean()
+        else:
+            threshold = self.outlier_threshold
+        self.outliers[selected[errors > threshold]] = True
+
+        track_ids = self.tracks.get_track_ids()
+        inliers = self.registered[self.tracks.get_image_ids()] & ~self.outliers
+        counts = np.bincount(track_ids[inliers], minlength=self.tracks.get_count())
+        removed = self.triangulated & (counts < 2)
+        self.triangulated[removed] = False
+        self.track_points[removed] = np.nan
+        if np.any(errors > threshold):
+            message(f'Removed {int((errors > threshold).sum())} outlier observations and {int(removed.sum())} points')
+
+    def reconstruct(self):
+        """This function registers the initial pair and then each next image, until no image can be registered"""
+        if not Reconstruction.initial_pair(self):
+            return
+        message(f'Triangulated {Reconstruction.triangulate(self)} points')
+        if self.bundle_adjustment:
+            Reconstruction.bundle(self)
+        bundled_points, bundled_images = int(self.triangulated.sum()), len(self.order)
+
+        while not np.all(self.registered | self.failed):
+            image_id, count = Reconstruction.next_image(self)
+            if count < self.resection_min_inliers:
+                break
+            if not Reconstruction.resect(self, image_id):
+                self.failed[image_id] = True
+                continue
+            message(f'Triangulated {Reconstruction.triangulate(self)} new points')
+            if not self.bundle_adjustment:
+                continue
+
+            if int(self.triangulated.sum()) >= self.bundle_new_points_ratio * bundled_points or \
+                    len(self.order) - bundled_images >= self.bundle_interval:
+                Reconstruction.bundle(self)
+                bundled_points, bundled_images = int(self.triangulated.sum()), len(self.order)
+            elif self.local_bundle_radius > 0:
+                Reconstruction.bundle(self, Reconstruction.local_window(self, image_id))
+
+        if self.bundle_adjustment and len(self.order) > bundled_images:
+            Reconstruction.bundle(self)
+
+        message(f'Registered {len(self.order)} out of {len(self.images)} images, '
+                f'{int(self.triangulated.sum())} points out of {self.tracks.get_count()} tracks')
+
+    def colour_points(self):
+        """
+            Samples the colours and the labels of the reconstructed points, from the first (by id) registered image of
+            each track.
+        """
+        track_ids = self.tracks.get_track_ids()
+        image_ids = self.tracks.get_image_ids()
+        feature_ids = self.tracks.get_feature_ids()
+        selected = np.flatnonzero(self.triangulated[track_ids] & self.registered[image_ids] & ~self.outliers)
+        # The observations are sorted by track and then by image, thus the first of each track has the lowest id.
+        _, first = np.unique(track_ids[selected], return_index=True)
+        selected = selected[first]
+
+        self.colours = np.zeros((len(selected), 4), dtype=np.int64)
+        for image_id in np.unique(image_ids[selected]):
+            current = image_ids[selected] == image_id
+            # The key points' pixels of the image are sampled once, i.e. they are shared with its pairs.
+            pixels = np.asarray(self.images[image_id].sample_points()).reshape(-1, 4)[feature_ids[selected][current]]
+            self.colours[current] = pixels[:, [2, 1, 0, 3]]  # The colours (red, green, blue) and the labels.
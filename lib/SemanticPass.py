@@ -19,16 +19,24 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
 
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 import cv2
-import imutils
 import numpy as np
 
-from lib.utils import mkdir, error_message
+from lib.EdgeIndex import EdgeIndex
+from lib.Encoders import ImageEncoder
+from lib.LabelRules import LabelRules
+from lib.Manifest import Manifest
+from lib.StripReader import StripReader
+from lib.Tiff import StripTiffWriter
+from lib.utils import mkdir, error_message, message
 
 edge_parameters = {'minimum': 200, 'maximum': 300}
-gray = None
 
 
 class SFMImage:
@@ -44,6 +52,26 @@ class SFMImage:
             out:                     Pass into the class the number of the channels of the output image (3 or 4)
             bluremethod:             Pass into the class the chosen blured method.
             edgemethod:              Pass into the class the edge detection technique.
+            label_rules:             Pass into the class the rules (LabelRules) which convert the semantic image into
+                                     the label channel. By default the red pixels (r > 253) are labelled as 255.
+            interactive:             Pass into the class if the Canny thresholds are tuned with the image viewer (True)
+                                     or estimated automatically from the image (False).
+            threshold_method:        Pass into the class the automatic Canny thresholds method ('median' or 'otsu').
+            edge_thresholds:         Pass into the class fixed Canny thresholds (min, max) i.e. the thresholds tuned on
+                                     another image. If given, the image viewer is not opened.
+            preview_height:          Pass into the class the maximum height of the image viewer's preview. The keys
+                                     + and - switch between the levels of the preview pyramid.
+            edge_index:              Pass into the class if the edge pixels (label = 255) of the 4D image are also
+                                     saved into a sidecar archive (images/imagename.edges.npz, see EdgeIndex).
+            tile_rows:               Pass into the class the rows of each strip for the tiled assembly (0 disables it).
+                                     The tiled assembly reads, labels and writes the 4D image strip by strip (see
+                                     StripReader), thus the memory depends on the strip's size when the RGB and the
+                                     semantic images are PNG or striped TIFF images. JPEG images can not be decoded
+                                     partially, thus they are decoded whole i.e. the memory of a JPEG image still
+                                     depends on the image's size. It is available for the 4D output with semantic
+                                     images (Sematic_Info).
+            encoder:                 Pass into the class the encoder (ImageEncoder) of the output image. By default
+                                     the 4D images are saved as TIFF and the 3D images as JPG, with OpenCV's defaults.
 
         Functions:
             --- Setters ---
@@ -51,6 +79,9 @@ class SFMImage:
             set_edgemethod:          Set the edgemethod.
             set_kernel:              Set the kernel's, which is used to blure the image, size.
             set_blurmethod:          Set the blured method.
+            set_label_rules:         Set the rules which construct the label channel.
+            set_edge_thresholds:     Set the Canny thresholds (min, max).
+            set_encoder:             Set the encoder of the output image.
 
             --- Getters ---
             get_path:                Get the working directory.
@@ -60,45 +91,79 @@ class SFMImage:
             get_blurmethod:          Get the blured method.
             get_bluredim:            Get the blured image.
             get_labels:              Get the labels.
+            get_label_rules:         Get the rules which construct the label channel.
+            get_edge_thresholds:     Get the used Canny thresholds (min, max).
+            get_encoder:             Get the encoder of the output image.
 
             --- Methods ---
             save_blur_image:         Saves the blurred image.
             save_labels:             Saves the label channel.
             add_channel:             Adds to each image the label channel.
             save_output_image:       Saves the output image.
+            save_edge_index:         Saves the edge pixels' sidecar archive.
+            tiled_assembly:          Labels and saves the 4D output image strip by strip.
+            default_encoder:         Returns the default encoder of the 3D or 4D output.
+            semantic_name:           Returns the semantic image's name.
+            output_name:             Returns the output image's name.
+            settings:                Returns the settings which determine the output image.
             define_labels:           Constructs the channel which will be added as the label channel.
             semiauto_edge_detection: Semi automatic Canny implementation i.e. Canny with image viewer.
+            build_pyramid:           Constructs the preview pyramid of the (blurred) grayscale image.
+            auto_edge_detection:     Automatic (headless) Canny implementation.
+            estimate_thresholds:     Estimates the Canny thresholds from the image's statistics.
             define_min:              Defines starting Canny min value.
             define_max:              Defines starting Canny max value.
             new_value:               Updates min and max values using user's input.
-            find_edges:              Executes locally the Canny algorithm and visualize the results.
+            find_edges:              Executes the Canny algorithm on the previewed pyramid level and visualize the
+                                     results.
 
             The live Canny viewer implementation was inspired by Arapelis (Arapellis, O. 2020. Semiautomated edge detection on digital images. Postgraduate Degree Thesis, Postgraduate Course in Geoinformatics, NTUA (in Greek))
     """
 
     def __init__(self, path: str = '', imname: str = '', simages: bool = False, out='4D', blurmethod='',
-                 edgemethod='Canny'):
+                 edgemethod='Canny', label_rules: LabelRules = None, interactive: bool = True,
+                 threshold_method: str = 'median', edge_thresholds: tuple = None, tile_rows: int = 0,
+                 encoder: ImageEncoder = None, preview_height: int = 600,
+                 edge_index: bool = True):
+        # --- Tiled Assembly Variables ---
+        self.tile_rows = tile_rows
+        if self.tile_rows > 0 and (out != '4D' or edgemethod != 'Sematic_Info' or not simages):
+            error_message('The tiled assembly is available only for the 4D output with semantic images', sysex=True)
+
         # --- Image Variables ---
         self.imname = imname
         self.out = out
         self.path = Path(path)
-        self.image = cv2.imread(f'{self.path}/rgb/{imname}', cv2.IMREAD_UNCHANGED)
-        self.shape = self.image.shape
-        self.blue = self.image[:, :, 0]
-        self.green = self.image[:, :, 1]
-        self.red = self.image[:, :, 2]
+        if self.tile_rows > 0:
+            # The tiled assembly reads the images strip by strip.
+            self.reader = StripReader(f'{self.path}/rgb/{imname}')
+            self.image = None
+            self.shape = self.reader.get_shape()
+        else:
+            self.image = cv2.imread(f'{self.path}/rgb/{imname}', cv2.IMREAD_UNCHANGED)
+            self.shape = self.image.shape
+            self.blue = self.image[:, :, 0]
+            self.green = self.image[:, :, 1]
+            self.red = self.image[:, :, 2]
         self.edgemethod = edgemethod
 
         # --- Set Labels Variables if semantic image exists---
+        self.label_rules = label_rules if label_rules is not None else LabelRules()
         if simages:
-            self.siname = f'{self.imname[:-4]}_l.jpg'
-            self.simage = cv2.imread(f'{self.path}/semantic_images/{self.siname}', cv2.IMREAD_UNCHANGED)
-            if len(self.simage.shape) == 3:
-                if self.simage.shape[2] == 3:
+            self.siname = SFMImage.semantic_name(self.path, self.imname)
+            if self.tile_rows > 0:
+                self.sreader = StripReader(f'{self.path}/semantic_images/{self.siname}')
+                sshape = self.sreader.get_shape()
+            else:
+                self.simage = cv2.imread(f'{self.path}/semantic_images/{self.siname}', cv2.IMREAD_UNCHANGED)
+                sshape = self.simage.shape
+            if len(sshape) == 3:
+                if sshape[2] == 3:
                     self.tchl = True
-                    self.sblue = self.simage[:, :, 0]
-                    self.sgreen = self.simage[:, :, 1]
-                    self.sred = self.simage[:, :, 2]
+                    if self.tile_rows == 0:
+                        self.sblue = self.simage[:, :, 0]
+                        self.sgreen = self.simage[:, :, 1]
+                        self.sred = self.simage[:, :, 2]
                 else:
                     error_message('Please use a 1 channel or 3 channels annotated image', sysex=True)
             else:
@@ -112,37 +177,50 @@ class SFMImage:
             self.bluredimname = f'{self.imname[:-4]}_b.jpg'
 
         # --- Set labels Variables ---
+        self.interactive = interactive
+        self.threshold_method = threshold_method
+        self.edge_thresholds = edge_thresholds
+        self.preview_height = preview_height
+        self.pyramid: list = []
+        self.level: int = 0
+        self.preview_edges: list = []
         if edgemethod == 'Canny':
-
-            # --- Canny Parameters ---
-            global edge_parameters, gray
-            SFMImage.semiauto_edge_detection(self)
-            '''
-            min_val = edge_parameters['minimum']
-            max_val = edge_parameters['maximum']
-            '''
             if self.blurmethod != '':
                 self.gray = cv2.cvtColor(self.bluredim, cv2.COLOR_BGR2GRAY)
             else:
                 self.gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
 
-            # self.labels = cv2.Canny(self.gray, min_val, max_val, 3)
+            # --- Canny Parameters ---
+            if self.interactive and self.edge_thresholds is None:
+                SFMImage.semiauto_edge_detection(self)
+            else:
+                SFMImage.auto_edge_detection(self)
 
         elif edgemethod == 'Sematic_Info':
-            self.labels = np.zeros_like(self.red, dtype=np.int)
+            self.labels: list = []
+
+        # --- Encoder Variables ---
+        self.encoder = encoder if encoder is not None else SFMImage.default_encoder(out)
+        self.edge_index = edge_index and out == '4D'
+
+        # --- Tiled Assembly Encoder ---
+        if self.tile_rows > 0 and (self.encoder.fmt != 'tiff' or self.encoder.depth != 8
+                                   or self.encoder.compression not in [None, 'none', 'deflate']):
+            error_message('The tiled assembly saves only 8 bit TIFF archives without compression or with deflate',
+                          sysex=True)
 
-        self.sfmchannels = np.zeros_like(self.image)
         self.sfmlname = f'{self.imname[:-4]}_l.jpg'
 
         # --- Output Image ---
-        if out == '4D':
-            self.outname = f'{self.imname[:-4]}.tiff'
-        else:
-            self.outname = f'{self.imname[:-4]}.JPG'
+        self.outname = SFMImage.output_name(self.imname, out, self.encoder)
 
         self.outim: list = []
 
         # --- Pull the trigger ---
+        if self.tile_rows > 0:
+            SFMImage.tiled_assembly(self)
+            return
+
         if edgemethod == 'Canny':
             # SFMImage.save_blur_image(self)
             SFMImage.save_labels(self)
@@ -167,6 +245,15 @@ class SFMImage:
     def set_blurmethod(self, blurmethod):
         self.blurmethod = blurmethod
 
+    def set_label_rules(self, label_rules):
+        self.label_rules = label_rules
+
+    def set_edge_thresholds(self, edge_thresholds):
+        self.edge_thresholds = edge_thresholds
+
+    def set_encoder(self, encoder):
+        self.encoder = encoder
+
     # --- Getters ---
     def get_path(self):
         return self.path
@@ -189,6 +276,15 @@ class SFMImage:
     def get_labels(self):
         return self.labels
 
+    def get_label_rules(self):
+        return self.label_rules
+
+    def get_edge_thresholds(self):
+        return self.edge_thresholds
+
+    def get_encoder(self):
+        return self.encoder
+
     # --- Methods ---
     def save_blur_image(self):
         """This function saves the blurred image"""
@@ -210,59 +306,394 @@ class SFMImage:
     def save_output_image(self):
         """This function saves th output image"""
         mkdir('images')
-        cv2.imwrite(f'{self.path}/images/{self.outname}', self.outim)
+        self.encoder.write(f'{self.path}/images/{self.outname}', self.outim)
+        if self.edge_index:
+            SFMImage.save_edge_index(self, EdgeIndex.from_labels(self.labels))
+
+    def save_edge_index(self, index):
+        """This function saves the edge pixels' sidecar archive"""
+        index.save(f'{self.path}/images/{EdgeIndex.sidecar_name(self.outname)}')
+
+    @staticmethod
+    def default_encoder(out='4D'):
+        """This function returns the default encoder of the 3D or 4D output"""
+        if out == '4D':
+            return ImageEncoder('tiff')
+        return ImageEncoder('jpg')
+
+    @staticmethod
+    def semantic_name(path, imname):
+        """
+            Returns the semantic image's name i.e. imagename_l with the first existing extension (.jpg, .png, .tif or
+            .tiff). If none of them exists, the .jpg name is returned.
+
+            args:
+                path (str):        The working directory.
+                imname (str):      The RGB image's name.
+
+            returns:
+                siname (str):      The semantic image's name.
+        """
+        for suffix in ['jpg', 'png', 'tif', 'tiff']:
+            siname = f'{imname[:-4]}_l.{suffix}'
+            if os.path.isfile(f'{path}/semantic_images/{siname}'):
+                return siname
+        return f'{imname[:-4]}_l.jpg'
+
+    @staticmethod
+    def output_name(imname, out='4D', encoder=None):
+        """This function returns the output image's name"""
+        if encoder is None:
+            encoder = SFMImage.default_encoder(out)
+        return f'{imname[:-4]}{encoder.get_suffix()}'
+
+    @staticmethod
+    def settings(sfmimage_parameters):
+        """
+            Returns the settings which determine the output image.
+
+            args:
+                sfmimage_parameters (dict): The SFMImage parameters (without path and imname).
+
+            returns:
+                settings (dict): The settings, or None if the Canny thresholds are tuned with the image viewer and
+                                 thus they are not known before the image is produced.
+        """
+        parameters = dict(simages=False, out='4D', blurmethod='', edgemethod='Canny', label_rules=None,
+                          interactive=True, threshold_method='median', edge_thresholds=None, encoder=None,
+                          edge_index=True, tile_rows=0)
+        parameters.update(sfmimage_parameters)
+
+        encoder = parameters['encoder'] if parameters['encoder'] is not None else \
+            SFMImage.default_encoder(parameters['out'])
+        settings = {'out': parameters['out'], 'edgemethod': parameters['edgemethod'], 'encoder': encoder.describe(),
+                    'edge_index': parameters['edge_index'] and parameters['out'] == '4D'}
+        # The tiled assembly writes its own strips (uncompressed or deflate), not the encoder's (OpenCV) archive.
+        if parameters['tile_rows'] > 0:
+            settings['tile_rows'] = int(parameters['tile_rows'])
+        if parameters['edgemethod'] == 'Canny':
+            if parameters['interactive'] and parameters['edge_thresholds'] is None:
+                return None
+            settings['blurmethod'] = parameters['blurmethod']
+            if parameters['edge_thresholds'] is not None:
+                settings['edge_thresholds'] = [int(t) for t in parameters['edge_thresholds']]
+            else:
+                settings['threshold_method'] = parameters['threshold_method']
+        elif parameters['simages']:
+            rules = parameters['label_rules'] if parameters['label_rules'] is not None else LabelRules()
+            settings['label_rules'] = rules.describe()
+        return settings
+
+    def tiled_assembly(self):
+        """This function labels and saves the 4D output image strip by strip"""
+        mkdir('images')
+        height, width = self.shape[:2]
+        compression = 'deflate' if self.encoder.compression == 'deflate' else 'none'
+        entries = []
+        with StripTiffWriter(f'{self.path}/images/{self.outname}', width, height, 4, self.tile_rows,
+                             compression) as writer:
+            for row in range(0, height, self.tile_rows):
+                image = self.reader.read(row, row + self.tile_rows)
+                simage = self.sreader.read(row, row + self.tile_rows)
+                if self.tchl:
+                    labels = self.label_rules.apply(simage)
+                else:
+                    labels = simage
+                # The TIFF archives store the channels in RGBA order.
+                writer.write_strip(cv2.merge((image[:, :, 2], image[:, :, 1], image[:, :, 0], labels)))
+                if self.edge_index:
+                    entries.append(EdgeIndex.strip_entries(labels))
+        if self.edge_index:
+            SFMImage.save_edge_index(self, EdgeIndex.from_entries((height, width), entries))
 
     def define_labels(self):
         """This function constructs the channel which will be added as the label channel"""
         if self.tchl:
-            self.labels = np.zeros_like(self.red)
-            for i in range(0, self.sred.shape[0]):
-                for j in range(0, self.sred.shape[1]):
-                    r = self.sred[i, j]
-                    # g = self.sgreen[i, j] #Uncomment if the semantic information is in green color
-                    # b = self.sblue[i, j] #Uncomment if the semantic information is in blue color
-                    if r > 253:
-                        self.labels[i, j] = 255
+            self.labels = self.label_rules.apply(self.simage)
             SFMImage.save_labels(self)  # Uncomment for debugging
         else:
             self.labels = self.simage
 
     def semiauto_edge_detection(self):
         """This function semi automatic Canny implementation i.e. Canny with image viewer"""
-        global edge_parameters, gray
-        image = imutils.resize(self.image, height=self.shape[1] // 10)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        SFMImage.build_pyramid(self)
         cv2.namedWindow('MyImage')
-        cv2.createTrackbar('Min', 'MyImage', edge_parameters['minimum'], 1200, SFMImage.define_min)
-        cv2.createTrackbar('Max', 'MyImage', edge_parameters['maximum'], 1200, SFMImage.define_max)
-        cv2.imshow('MyImage', gray)
-        SFMImage.find_edges()
+        cv2.createTrackbar('Min', 'MyImage', edge_parameters['minimum'], 1200, self.define_min)
+        cv2.createTrackbar('Max', 'MyImage', edge_parameters['maximum'], 1200, self.define_max)
+        SFMImage.find_edges(self)
         while True:
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                self.labels = cv2.resize(edges, (self.shape[1], self.shape[0]))
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('+') and self.level > 0:
+                self.level -= 1
+                SFMImage.find_edges(self)
+            elif key == ord('-') and self.level < len(self.pyramid) - 1:
+                self.level += 1
+                SFMImage.find_edges(self)
+            elif key == ord('q'):
                 cv2.destroyAllWindows()
                 break
 
+        # The tuned thresholds are applied once, to the full resolution (blurred) image.
+        self.edge_thresholds = (edge_parameters['minimum'], edge_parameters['maximum'])
+        self.pyramid = []
+        SFMImage.auto_edge_detection(self)
+
+    def build_pyramid(self):
+        """This function constructs the preview pyramid of the (blurred) grayscale image"""
+        self.pyramid = [self.gray]
+        while self.pyramid[-1].shape[0] > self.preview_height // 4 and min(self.pyramid[-1].shape[:2]) > 1:
+            self.pyramid.append(cv2.pyrDown(self.pyramid[-1]))
+        heights = [level.shape[0] for level in self.pyramid]
+        self.level = next((i for i, height in enumerate(heights) if height <= self.preview_height),
+                          len(self.pyramid) - 1)
+
+    def auto_edge_detection(self):
+        """This function automatic (headless) Canny implementation i.e. with fixed or estimated thresholds"""
+        if self.edge_thresholds is None:
+            self.edge_thresholds = SFMImage.estimate_thresholds(self.gray, self.threshold_method)
+        self.labels = cv2.Canny(self.gray, self.edge_thresholds[0], self.edge_thresholds[1], apertureSize=3)
+
     @staticmethod
-    def define_min(new_min):
+    def estimate_thresholds(gray, method='median', sigma=0.33):
+        """
+            Estimates the Canny thresholds from the image's statistics.
+
+            args:
+                gray (numpy array): The grayscale (8 bit) image.
+                method (str):       'median' i.e. (1 - sigma) * median, (1 + sigma) * median
+                                    or 'otsu' i.e. 0.5 * otsu, otsu.
+                sigma (float):      The width of the median thresholds' band.
+
+            returns:
+                thresholds (tuple): The Canny thresholds (min, max).
+        """
+        if method == 'median':
+            # The median is found from the histogram, which is faster than sorting the pixels.
+            histogram = np.bincount(gray.ravel(), minlength=256)
+            median = float(np.searchsorted(np.cumsum(histogram), gray.size / 2))
+            return int(max(0, (1 - sigma) * median)), int(min(255, (1 + sigma) * median))
+        elif method == 'otsu':
+            otsu, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return int(0.5 * otsu), int(otsu)
+        else:
+            error_message(f'Unknown threshold method {method}, the valid methods are median or otsu', sysex=True)
+
+    def define_min(self, new_min):
         """This function defines starting Canny min value"""
-        SFMImage.new_value('minimum', new_min)
+        SFMImage.new_value(self, 'minimum', new_min)
 
-    @staticmethod
-    def define_max(new_max):
+    def define_max(self, new_max):
         """This function defines starting Canny max value."""
-        SFMImage.new_value('maximum', new_max)
+        SFMImage.new_value(self, 'maximum', new_max)
 
-    @staticmethod
-    def new_value(parameter, new_value):
+    def new_value(self, parameter, new_value):
         """This function updates min and max values using user's input."""
-        global edge_parameters
         edge_parameters[parameter] = new_value
-        SFMImage.find_edges()
+        SFMImage.find_edges(self)
+
+    def find_edges(self):
+        """This function executes the Canny algorithm on the previewed pyramid level and visualize the results"""
+        preview = self.pyramid[self.level]
+        # Each pyramid level doubles the gradients of the (smooth) blurred image, thus the thresholds are scaled to
+        # preview the edges which the full resolution image will produce.
+        scale = 2 ** self.level
+        self.preview_edges = cv2.Canny(preview, edge_parameters['minimum'] * scale,
+                                       edge_parameters['maximum'] * scale, apertureSize=3)
+        cv2.imshow('MyImage', preview)
+        cv2.imshow('Edges', self.preview_edges)
+
+
+class SFMBatch:
+    """
+        Name: SFMBatch
+
+        Description: SFMBatch class constructs the 4 channel images of many images, spreading the SFMImage
+                     constructions over a pool of worker processes.
+
+        Parameters:
+            path:                    Pass into the class the working directory.
+            imnames:                 Pass into the class the images' names.
+            processes:               Pass into the class the number of the worker processes (default: all the cores).
+            manifest:                Pass into the class if the images whose inputs and settings have not changed,
+                                     according to the manifest (images.manifest.json), are skipped.
+            sfmimage_parameters:     Pass into the class the SFMImage parameters i.e. simages=True, out='4D',
+                                     edgemethod='Sematic_Info'.
+
+        Functions:
+            --- Setters ---
+            set_processes:           Set the number of the worker processes.
+
+            --- Getters ---
+            get_results:             Get each image's result i.e. {'image': name, 'seconds': time, 'error': message}.
+            get_failures:            Get the results of the images which failed.
+            get_skipped:             Get the images which were skipped as current.
+
+            --- Methods ---
+            run:                     Constructs the images, serially if one process is used or else in parallel.
+            pending:                 Finds the images which must be constructed, according to the manifest.
+            record:                  Records the constructed images into the manifest.
+            output_name:             Returns the output image's name of the given image.
+            report:                  Reports the timing of the batch and the failed images.
+            report_image:            Reports the timing of one image.
+
+            A failed image (or a crashed worker) does not stop the batch, its error is stored into its result instead.
+    """
+
+    def __init__(self, path: str = '', imnames: list = None, processes: int = None, manifest: bool = True,
+                 **sfmimage_parameters):
+        """Constructor"""
+        self.path = path
+        self.imnames = list(imnames) if imnames is not None else []
+        self.processes = processes if processes else os.cpu_count()
+        self.sfmimage_parameters = sfmimage_parameters
+
+        self.results: list = []
+        self.seconds: float = 0
+
+        # --- Manifest Variables ---
+        self.settings = SFMImage.settings(self.sfmimage_parameters)
+        if manifest and self.settings is not None:
+            self.manifest = Manifest(f'{self.path}/images.manifest.json')
+        else:
+            self.manifest = None
+        self.entries: dict = {}
+        self.skipped: list = []
+
+        # --- Pull the trigger ---
+        SFMBatch.run(self)
+        SFMBatch.report(self)
+
+    # --- Setters ---
+    def set_processes(self, processes):
+        self.processes = processes
+
+    # --- Getters ---
+    def get_results(self):
+        return self.results
+
+    def get_failures(self):
+        return [result for result in self.results if result['error']]
+
+    def get_skipped(self):
+        return self.skipped
+
+    # --- Methods ---
+    def run(self):
+        """This function constructs the images, serially if one process is used or else in parallel"""
+        if (self.processes > 1 and self.sfmimage_parameters.get('edgemethod', 'Canny') == 'Canny'
+                and self.sfmimage_parameters.get('interactive', True)
+                and self.sfmimage_parameters.get('edge_thresholds') is None):
+            error_message('The Canny image viewer can not be used in parallel, use interactive=False or give the '
+                          'edge_thresholds', sysex=True)
+
+        # The output directories are made once, before the workers start, to avoid racing mkdir calls.
+        mkdir('images')
+        mkdir('Labels')
+
+        start = time.perf_counter()
+        imnames = SFMBatch.pending(self)
+        if self.processes == 1 or len(imnames) < 2:
+            for imname in imnames:
+                self.results.append(build_sfm_image(self.path, imname, self.sfmimage_parameters))
+                SFMBatch.report_image(self.results[-1])
+        else:
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=cv2.setNumThreads,
+                                     initargs=(1,)) as executor:
+                futures = {executor.submit(build_sfm_image, self.path, imname, self.sfmimage_parameters): imname
+                           for imname in imnames}
+                for future in as_completed(futures):
+                    try:
+                        self.results.append(future.result())
+                    except BrokenProcessPool as e:
+                        # A crashed worker (i.e. out of memory) breaks the pool, its pending images fail.
+                        self.results.append({'image': futures[future], 'seconds': 0.0,
+                                             'error': f'{type(e).__name__}: {e}'})
+                    SFMBatch.report_image(self.results[-1])
+            self.results.sort(key=lambda result: self.imnames.index(result['image']))
+        SFMBatch.record(self)
+        self.seconds = time.perf_counter() - start
+
+    def pending(self):
+        """This function finds the images which must be constructed, according to the manifest"""
+        if self.manifest is None:
+            return self.imnames
+
+        imnames = []
+        for imname in self.imnames:
+            output = f'{self.path}/images/{SFMBatch.output_name(self, imname)}'
+            inputs = [f'{self.path}/rgb/{imname}']
+            if self.sfmimage_parameters.get('simages', False):
+                inputs.append(f'{self.path}/semantic_images/{SFMImage.semantic_name(self.path, imname)}')
+            try:
+                entry = self.manifest.entry(output, inputs, self.settings)
+            except OSError:
+                # A missing input, the construction will report it.
+                imnames.append(imname)
+                continue
+
+            sidecar = f'{self.path}/images/{EdgeIndex.sidecar_name(SFMBatch.output_name(self, imname))}'
+            if self.manifest.is_current(output, entry) and (not self.settings['edge_index']
+                                                            or os.path.isfile(sidecar)):
+                self.manifest.update(output, entry)
+                self.skipped.append(imname)
+            else:
+                self.entries[imname] = entry
+                imnames.append(imname)
+
+        if self.skipped:
+            message(f'{len(self.skipped)} out of {len(self.imnames)} images are current and they are skipped')
+        return imnames
+
+    def record(self):
+        """This function records the constructed images into the manifest"""
+        if self.manifest is None:
+            return
+
+        for result in self.results:
+            output = f'{self.path}/images/{SFMBatch.output_name(self, result["image"])}'
+            if result['error'] or result['image'] not in self.entries:
+                self.manifest.remove(output)
+            else:
+                self.manifest.update(output, self.entries[result['image']])
+        self.manifest.save()
+
+    def output_name(self, imname):
+        """This function returns the output image's name of the given image"""
+        return SFMImage.output_name(imname, self.sfmimage_parameters.get('out', '4D'),
+                                    self.sfmimage_parameters.get('encoder'))
+
+    def report(self):
+        """This function reports the timing of the batch and the failed images"""
+        failures = SFMBatch.get_failures(self)
+        message(f'{len(self.results) - len(failures)} out of {len(self.imnames)} images were constructed and '
+                f'{len(self.skipped)} were skipped in {self.seconds:.2f} s using '
+                f'{min(self.processes, max(len(self.results), 1))} processes')
+        for failure in failures:
+            error_message(f'Image {failure["image"]} failed: {failure["error"]}')
 
     @staticmethod
-    def find_edges():
-        """This function executes locally the Canny algorithm and visualize the results"""
-        global edge_parameters, gray, edges
-        edges = cv2.Canny(gray, edge_parameters['minimum'], edge_parameters['maximum'], 3)
-        cv2.imshow('Edges', imutils.resize(edges, edges.shape[1]))
+    def report_image(result):
+        """This function reports the timing of one image"""
+        status = 'failed' if result['error'] else 'done'
+        message(f'Image {result["image"]} {status} in {result["seconds"]:.2f} s')
+
+
+def build_sfm_image(path, imname, sfmimage_parameters):
+    """
+    This function constructs one 4 channel image and it is executed by the SFMBatch worker processes.
+    Args:
+        path (str)                 = The working directory.
+        imname (str)               = The image's name.
+        sfmimage_parameters (dict) = The SFMImage parameters.
+
+    Returns:
+        result (dict) = The image's name, the construction time and the error message (empty if it succeeded).
+
+    """
+    start = time.perf_counter()
+    error = ''
+    try:
+        SFMImage(path, imname, **sfmimage_parameters)
+    except (Exception, SystemExit) as e:
+        error = f'{type(e).__name__}: {e}'
+    return {'image': imname, 'seconds': time.perf_counter() - start, 'error': error}
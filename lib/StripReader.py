@@ -0,0 +1,318 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program reads the images strip by strip, thus the tiled assembly does not decode them whole.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***The strips are returned as cv2.imread(filename, cv2.IMREAD_UNCHANGED) would return them i.e. BGR(A) order.***
+
+"""
+
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+from lib.Tiff import SHORT, LONG, read_tiff_tags, memmap_tiff, pack_directory
+from lib.utils import error_message
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+png_channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# The colour type of the decoded scanlines, which has the same bytes per pixel, thus OpenCV returns the raw bytes.
+png_raw_types = {1: (0, 8), 2: (0, 16), 3: (2, 8), 4: (6, 8)}
+# The compressions which do not need extra tables i.e. none, LZW, deflate and PackBits.
+tiff_compressions = [1, 5, 8, 32773, 32946]
+# The tags which are copied into the archive of each decoded strip.
+tiff_tags = {256: LONG, 258: SHORT, 259: SHORT, 262: SHORT, 277: SHORT, 284: SHORT, 317: SHORT, 320: SHORT,
+             338: SHORT, 339: SHORT}
+
+
+class StripReader:
+    """
+        Name: StripReader
+
+        Description: StripReader class reads an image strip by strip, from the top to the bottom, thus only the
+                     under-process strip is decoded. The striped TIFF archives are read by their strips (the
+                     uncompressed ones are mapped into memory, the others are decoded strip by strip) and the 8 bit
+                     non-interlaced PNG images by their scanlines. The other images (i.e. JPEG, which OpenCV does not
+                     decode partially, and tiled TIFF archives) are decoded whole and then sliced.
+
+        Parameters:
+            filename:                The name of the image.
+
+        Functions:
+            --- Getters ---
+            get_shape:               Get the image's shape (height, width or height, width, channels).
+            get_mode:                Get how the image is read ('memmap', 'tiff', 'png' or 'whole').
+
+            --- Methods ---
+            read:                    Returns the rows [start, stop) of the image.
+            open_tiff:               Prepares the strip by strip reading of a TIFF archive.
+            read_tiff:               Returns the rows of a TIFF archive.
+            decode_tiff_strip:       Decodes one strip of a TIFF archive.
+            open_png:                Prepares the scanline by scanline reading of a PNG image.
+            read_png:                Returns the rows of a PNG image.
+            next_idat:               Returns the next part of a PNG image's data.
+            open_whole:              Decodes the whole image.
+            png_chunk:               Returns a PNG chunk.
+    """
+
+    def __init__(self, filename: str = ''):
+        """Constructor"""
+        self.filename = filename
+        self.mode = ''
+        self.shape: tuple = ()
+        self.pixels = None
+
+        # --- TIFF Variables ---
+        self.tags: dict = {}
+        self.strip: tuple = (-1, None)
+
+        # --- PNG Variables ---
+        self.file = None
+        self.header: tuple = ()
+        self.palette = None
+        self.decompressor = None
+        self.buffer = bytearray()
+        self.idat_left: int = 0
+        self.rows: int = 0
+        self.previous = b''
+
+        try:
+            with open(self.filename, 'rb') as f:
+                signature = f.read(8)
+        except OSError:
+            error_message(f'{self.filename} can not be read', sysex=True)
+        if signature[:4] in (b'II*\x00', b'MM\x00*') and StripReader.open_tiff(self):
+            return
+        if signature == png_signature and StripReader.open_png(self):
+            return
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        StripReader.open_whole(self)
+
+    def __del__(self):
+        if self.file is not None:
+            self.file.close()
+
+    # --- Getters ---
+    def get_shape(self):
+        return self.shape
+
+    def get_mode(self):
+        return self.mode
+
+    # --- Methods ---
+    def read(self, start, stop):
+        """
+            Returns the rows [start, stop) of the image. The PNG images are read forwards i.e. each strip must start
+            after the previous one.
+
+            args:
+                start (int):         The first row.
+                stop (int):          The row after the last one.
+
+            returns:
+                rows (numpy array):  The rows (BGR(A) order, as OpenCV reads the image).
+        """
+        stop = min(stop, self.shape[0])
+        if self.mode == 'png':
+            return StripReader.read_png(self, start, stop)
+        if self.mode == 'tiff':
+            return StripReader.read_tiff(self, start, stop)
+
+        rows = np.asarray(self.pixels[start:stop])
+        if self.mode == 'memmap':
+            rows = rows[:, :, 0] if rows.shape[2] == 1 else cv2.cvtColor(rows, cv2.COLOR_RGB2BGR)
+        return rows
+
+    def open_tiff(self):
+        """This function prepares the strip by strip reading of a TIFF archive, it returns False if it is not
+        possible"""
+        tags = read_tiff_tags(self.filename)
+        if (tags is None or any(tag not in tags for tag in (256, 257, 273, 279)) or 322 in tags
+                or tags.get(259, [1])[0] not in tiff_compressions or tags.get(284, [1])[0] != 1):
+            return False
+
+        height, width = tags[257][0], tags[256][0]
+        channels = tags.get(277, [1])[0]
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self.pixels = memmap_tiff(self.filename) if channels in [1, 3] and tags.get(262, [1])[0] in [1, 2] else None
+        if self.pixels is not None:
+            self.mode = 'memmap'
+        else:
+            self.tags = tags
+            self.mode = 'tiff'
+        return True
+
+    def read_tiff(self, start, stop):
+        """This function returns the rows [start, stop) of a TIFF archive, decoding only the strips which they cover"""
+        height = self.shape[0]
+        rows_per_strip = min(self.tags.get(278, [height])[0], height)
+        strips = []
+        for index in range(start // rows_per_strip, (stop - 1) // rows_per_strip + 1):
+            # Consecutive reads usually share a strip, thus the last decoded one is kept.
+            if self.strip[0] != index:
+                with open(self.filename, 'rb') as f:
+                    f.seek(self.tags[273][index])
+                    data = f.read(self.tags[279][index])
+                rows = min(rows_per_strip, height - index * rows_per_strip)
+                self.strip = (index, StripReader.decode_tiff_strip(self, data, rows))
+            first = index * rows_per_strip
+            strips.append(self.strip[1][max(start - first, 0):stop - first])
+        return np.concatenate(strips) if len(strips) > 1 else strips[0]
+
+    def decode_tiff_strip(self, data, rows):
+        """This function decodes one strip of a TIFF archive i.e. a TIFF archive of this strip is decoded by OpenCV"""
+        entries = [(tag, tiff_tags[tag], self.tags[tag]) for tag in sorted(tiff_tags) if tag in self.tags]
+        entries += [(257, LONG, [rows]), (273, LONG, [8]), (278, LONG, [rows]), (279, LONG, [len(data)])]
+        ifd_offset = 8 + len(data) + len(data) % 2
+        archive = (b'II*\x00' + struct.pack('<I', ifd_offset) + data + b'\x00' * (len(data) % 2)
+                   + pack_directory(sorted(entries), ifd_offset))
+        strip = cv2.imdecode(np.frombuffer(archive, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if strip is None:
+            error_message(f'{self.filename} has a strip which can not be decoded', sysex=True)
+        return strip
+
+    def open_png(self):
+        """This function prepares the scanline by scanline reading of a PNG image, it returns False if it is not
+        possible"""
+        self.file = open(self.filename, 'rb')
+        self.file.seek(8)
+        while True:
+            head = self.file.read(8)
+            if len(head) < 8:
+                return False
+            length, kind = struct.unpack('>I4s', head)
+            if kind == b'IDAT':
+                break
+            data = self.file.read(length)
+            self.file.read(4)
+            if kind == b'IHDR':
+                self.header = struct.unpack('>IIBBBBB', data)
+            elif kind == b'PLTE':
+                self.palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)[:, ::-1]
+            elif kind == b'tRNS':
+                # OpenCV adds the transparency as an alpha channel.
+                return False
+
+        width, height, depth, colour, _, _, interlace = self.header
+        if depth != 8 or interlace != 0 or colour not in png_channels or (colour == 3 and self.palette is None):
+            return False
+
+        channels = {0: 1, 2: 3, 3: 3, 4: 4, 6: 4}[colour]
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self.decompressor = zlib.decompressobj()
+        self.idat_left = length
+        self.mode = 'png'
+        return True
+
+    def read_png(self, start, stop):
+        """This function returns the rows [start, stop) of a PNG image, inflating the scanlines up to the last row"""
+        if start < self.rows:
+            error_message(f'{self.filename} is read forwards, row {start} was requested after row {self.rows}',
+                          sysex=True)
+        width, height, _, colour, _, _, _ = self.header
+        pixel_bytes = png_channels[colour]
+        line = 1 + width * pixel_bytes
+        needed = (stop - self.rows) * line
+        while len(self.buffer) < needed:
+            if self.decompressor.unconsumed_tail:
+                data = self.decompressor.unconsumed_tail
+            else:
+                data = StripReader.next_idat(self)
+            self.buffer += self.decompressor.decompress(data, needed - len(self.buffer))
+        scanlines = bytes(self.buffer[:needed])
+        del self.buffer[:needed]
+
+        # The scanlines are unfiltered by OpenCV i.e. they are decoded as a small image, which colour type has the
+        # same bytes per pixel. The previous (unfiltered) row is prepended, since the filters refer to it.
+        count = stop - self.rows + (1 if self.previous else 0)
+        raw_colour, raw_depth = png_raw_types[pixel_bytes]
+        chunks = [StripReader.png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, count, raw_depth, raw_colour,
+                                                             0, 0, 0)),
+                  StripReader.png_chunk(b'IDAT', zlib.compress((b'\x00' + self.previous if self.previous else b'')
+                                                               + scanlines, 1)),
+                  StripReader.png_chunk(b'IEND', b'')]
+        raw = cv2.imdecode(np.frombuffer(png_signature + b''.join(chunks), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if raw_depth == 16:
+            raw = raw.astype('>u2').view(np.uint8)
+        elif raw_colour == 2:
+            raw = cv2.cvtColor(raw, cv2.COLOR_BGR2RGB)
+        elif raw_colour == 6:
+            raw = cv2.cvtColor(raw, cv2.COLOR_BGRA2RGBA)
+        raw = raw.reshape(count, width * pixel_bytes)
+        if self.previous:
+            raw = raw[1:]
+        self.previous = raw[-1].tobytes()
+        self.rows = stop
+        if stop == height:
+            self.file.close()
+            self.file = None
+
+        raw = raw[start - stop:]
+        if colour == 0:
+            return raw
+        elif colour == 3:
+            return self.palette[raw]
+        raw = raw.reshape(stop - start, width, pixel_bytes)
+        if colour == 2:
+            return cv2.cvtColor(raw, cv2.COLOR_RGB2BGR)
+        elif colour == 4:
+            return cv2.merge((raw[:, :, 0], raw[:, :, 0], raw[:, :, 0], raw[:, :, 1]))
+        return cv2.cvtColor(raw, cv2.COLOR_RGBA2BGRA)
+
+    def next_idat(self):
+        """This function returns the next part of the PNG image's data (IDAT chunks)"""
+        while self.idat_left == 0:
+            self.file.read(4)
+            head = self.file.read(8)
+            if len(head) < 8:
+                error_message(f'{self.filename} is truncated', sysex=True)
+            length, kind = struct.unpack('>I4s', head)
+            if kind != b'IDAT':
+                error_message(f'{self.filename} has less than {self.shape[0]} rows', sysex=True)
+            self.idat_left = length
+        data = self.file.read(min(self.idat_left, 1 << 16))
+        if not data:
+            error_message(f'{self.filename} is truncated', sysex=True)
+        self.idat_left -= len(data)
+        return data
+
+    def open_whole(self):
+        """This function decodes the whole image i.e. the formats which are not read strip by strip"""
+        self.pixels = cv2.imread(self.filename, cv2.IMREAD_UNCHANGED)
+        if self.pixels is None:
+            error_message(f'{self.filename} can not be read', sysex=True)
+        self.shape = self.pixels.shape
+        self.mode = 'whole'
+
+    @staticmethod
+    def png_chunk(kind, data):
+        """
+            Returns a PNG chunk.
+
+            args:
+                kind (bytes):      The chunk's type.
+                data (bytes):      The chunk's data.
+
+            returns:
+                chunk (bytes):     The length, the type, the data and the CRC of the chunk.
+        """
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
@@ -0,0 +1,233 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program writes the 4 channel images as TIFF archives strip by strip and maps the uncompressed ones into memory.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+***The archives follow the baseline TIFF 6.0 specification (chunky, 8 bit per sample, little-endian).***
+
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+from lib.utils import error_message
+
+SHORT = 3
+LONG = 4
+type_formats = {SHORT: 'H', LONG: 'I'}
+compressions = {'none': 1, 'deflate': 8}
+
+
+class StripTiffWriter:
+    """
+        Name: StripTiffWriter
+
+        Description: StripTiffWriter class writes an 8 bit TIFF archive strip by strip, thus only the under-process strip
+                     is kept in memory. The image file directory is written when the archive is closed.
+
+        Parameters:
+            filename:                The name of the archive.
+            width:                   Image's width.
+            height:                  Image's height.
+            channels:                The number of the channels (1, 3 or 4). The 4th channel is stored as an extra
+                                     (unspecified) sample i.e. the label channel.
+            rows_per_strip:          The rows of each strip. Every strip, except the last one, must have these rows.
+            compression:             The compression of the strips ('none' or 'deflate').
+
+        Functions:
+            --- Getters ---
+            get_rows:                Get the number of the written rows.
+
+            --- Methods ---
+            write_strip:             Writes the next strip (rows x width x channels, RGB(A) order).
+            close:                   Writes the image file directory and closes the archive.
+    """
+
+    def __init__(self, filename: str = '', width: int = 0, height: int = 0, channels: int = 4,
+                 rows_per_strip: int = 256, compression: str = 'none'):
+        """Constructor"""
+        if compression not in compressions:
+            error_message(f'Unknown compression {compression}, the valid ones are {list(compressions)}', sysex=True)
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows_per_strip = min(rows_per_strip, height)
+        self.compression = compression
+
+        self.rows: int = 0
+        self.offsets: list = []
+        self.counts: list = []
+
+        # --- Header, the image file directory's offset is set by close ---
+        self.file = open(self.filename, 'wb')
+        self.file.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            StripTiffWriter.close(self)
+        else:
+            self.file.close()
+
+    # --- Getters ---
+    def get_rows(self):
+        return self.rows
+
+    # --- Methods ---
+    def write_strip(self, strip):
+        """
+            Writes the next strip of the image.
+
+            args:
+                strip (numpy array): The strip (rows x width x channels, uint8, RGB(A) order).
+        """
+        strip = np.ascontiguousarray(strip, dtype=np.uint8)
+        if strip.shape[0] != self.rows_per_strip and self.rows + strip.shape[0] != self.height:
+            error_message(f'Only the last strip may have less than {self.rows_per_strip} rows', sysex=True)
+
+        data = zlib.compress(strip.tobytes(), 6) if self.compression == 'deflate' else strip.tobytes()
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(data))
+        self.file.write(data)
+        self.rows += strip.shape[0]
+
+    def close(self):
+        """This function writes the image file directory and closes the archive"""
+        if self.rows != self.height:
+            self.file.close()
+            error_message(f'{self.filename} has {self.rows} out of {self.height} rows', sysex=True)
+
+        # --- Word alignment ---
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+
+        photometric = 2 if self.channels >= 3 else 1
+        entries = [(256, LONG, [self.width]),
+                   (257, LONG, [self.height]),
+                   (258, SHORT, [8] * self.channels),
+                   (259, SHORT, [compressions[self.compression]]),
+                   (262, SHORT, [photometric]),
+                   (273, LONG, self.offsets),
+                   (277, SHORT, [self.channels]),
+                   (278, LONG, [self.rows_per_strip]),
+                   (279, LONG, self.counts),
+                   (284, SHORT, [1])]
+        if self.channels > 3:
+            entries.append((338, SHORT, [0] * (self.channels - 3)))
+
+        ifd_offset = self.file.tell()
+        self.file.write(pack_directory(entries, ifd_offset))
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', ifd_offset))
+        self.file.close()
+
+
+def pack_directory(entries, ifd_offset):
+    """
+    This function packs an image file directory (little-endian), the values which do not fit into the entries follow it.
+    Args:
+        entries (list)   = The entries (tag, SHORT or LONG, values), sorted by tag.
+        ifd_offset (int) = The offset of the image file directory into the archive.
+
+    Returns:
+        directory (bytes) = The image file directory and its values.
+
+    """
+    data_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd = struct.pack('<H', len(entries))
+    data = b''
+    for tag, kind, values in entries:
+        packed = struct.pack(f'<{len(values)}{type_formats[kind]}', *values)
+        if len(packed) <= 4:
+            ifd += struct.pack('<HHI', tag, kind, len(values)) + packed.ljust(4, b'\x00')
+        else:
+            ifd += struct.pack('<HHII', tag, kind, len(values), data_offset + len(data))
+            data += packed
+    ifd += struct.pack('<I', 0)
+    return ifd + data
+
+
+def read_tiff_tags(filename):
+    """
+    This function reads the SHORT and LONG tags of a TIFF archive's first image file directory.
+    Args:
+        filename (str) = The name of the archive.
+
+    Returns:
+        tags (dict) = The values (list) of each tag, or None if the file is not a TIFF archive.
+
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(8)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+            return None
+        order = '<' if header[:2] == b'II' else '>'
+        magic, ifd_offset = struct.unpack(f'{order}HI', header[2:])
+        if magic != 42:
+            return None
+
+        f.seek(ifd_offset)
+        count = struct.unpack(f'{order}H', f.read(2))[0]
+        entries = f.read(12 * count)
+        tags = {}
+        for i in range(0, count):
+            tag, kind, number, value = struct.unpack(f'{order}HHI4s', entries[12 * i:12 * (i + 1)])
+            if kind not in type_formats:
+                continue
+            size = struct.calcsize(type_formats[kind]) * number
+            if size > 4:
+                position = f.tell()
+                f.seek(struct.unpack(f'{order}I', value)[0])
+                value = f.read(size)
+                f.seek(position)
+            tags[tag] = list(struct.unpack(f'{order}{number}{type_formats[kind]}', value[:size]))
+    return tags
+
+
+def memmap_tiff(filename):
+    """
+    This function maps an uncompressed 8 bit chunky TIFF archive, which strips are contiguous, into memory. Only the
+    accessed pixels are read from the disk.
+    Args:
+        filename (str) = The name of the archive.
+
+    Returns:
+        pixels (numpy memmap) = The read-only pixels (height x width x channels, RGB(A) order as stored), or None if
+                                the archive can not be mapped (i.e. compressed archives).
+
+    """
+    tags = read_tiff_tags(filename)
+    if tags is None or any(tag not in tags for tag in (256, 257, 273, 279)):
+        return None
+
+    width, height = tags[256][0], tags[257][0]
+    channels = tags.get(277, [1])[0]
+    offsets, counts = tags[273], tags[279]
+    if (tags.get(259, [1])[0] != 1 or tags.get(284, [1])[0] != 1
+            or any(bits != 8 for bits in tags.get(258, [1]))):
+        return None
+    if (any(offsets[i] + counts[i] != offsets[i + 1] for i in range(0, len(offsets) - 1))
+            or sum(counts) != width * height * channels):
+        return None
+
+    return np.memmap(filename, dtype=np.uint8, mode='r', offset=offsets[0], shape=(height, width, channels))
@@ -0,0 +1,724 @@
+"""
+
+This program is part of the 3DPlan algorithm.
+This program contains the benchmarks of the 3DPlan software.
+Copyright (C) 2021 Theodore Betsas
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Run a benchmark from the 3DPlan directory i.e. "python -m lib.benchmarks labels".
+
+"""
+
+import filecmp
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from lib.Cameras import CameraRegistry
+from lib.config import default_config
+from lib.Encoders import ImageEncoder
+from lib.Estimators import available_estimators, essential_matrix
+from lib.Geometry import extract_features
+from lib.LabelRules import LabelRules
+from lib.Matching import FlannIndexCache, ratio_test
+from lib.MyTriangulation import Triang
+from lib.PointCloud import cloud_array, format_cloud, read_cloud, write_cloud
+from lib.Reconstruction import Reconstruction
+from lib.utils import message, error_message, find_files, convert_points_2_cvkeypoints, write_a_file, \
+    classify_points, read_txt_coordinates_to_list
+
+
+def loop_labels(simage):
+    """
+    This function is the original (pixel by pixel) SFMImage.define_labels implementation, kept as the reference.
+    Args:
+        simage (numpy array) = The 3 channel annotated image.
+
+    Returns:
+        labels (numpy array) = The label channel.
+
+    """
+    sred = simage[:, :, 2]
+    labels = np.zeros_like(sred)
+    for i in range(0, sred.shape[0]):
+        for j in range(0, sred.shape[1]):
+            r = sred[i, j]
+            if r > 253:
+                labels[i, j] = 255
+    return labels
+
+
+def loop_filtering(matches, left_points, right_points, image, lowes_ratio):
+    """
+    This function is the original (match by match) Triang.flann filtering and colouring, kept as the reference.
+    Args:
+        matches (list)            = The 2 nearest matches (cv.DMatch) of each query descriptor.
+        left_points (numpy array) = The query key points (x, y, size, angle).
+        right_points (numpy array) = The train key points (x, y, size, angle).
+        image (numpy array)       = The 4 channel query image.
+        lowes_ratio (float)       = The Lowe's ratio.
+
+    Returns:
+        ptsL, ptsR, colours (numpy arrays) = The matched points and the colours (red, green, blue, label).
+
+    """
+    colouring_points = left_points
+    Lkp = convert_points_2_cvkeypoints(left_points)
+    Rkp = convert_points_2_cvkeypoints(right_points)
+    ptsL, ptsR, idsL = [], [], []
+    for i, (m, n) in enumerate(matches):
+        if m.distance < lowes_ratio * n.distance:
+            ptsR.append(Rkp[m.trainIdx].pt)
+            ptsL.append(Lkp[m.queryIdx].pt)
+            idsL.append(i)
+
+    colours = []
+    for i in idsL:
+        y = int(colouring_points[i][0])
+        x = int(colouring_points[i][1])
+        colours.append([image[x, y, 2], image[x, y, 1], image[x, y, 0], image[x, y, 3]])
+    return np.array(ptsL), np.array(ptsR), np.array(colours, dtype=np.int64)
+
+
+def vectorized_filtering(matches, left_points, right_points, image, lowes_ratio):
+    """This function is the array based filtering and colouring of PairMatch.flann (same arguments and returns)"""
+    good = ratio_test(matches, lowes_ratio)
+    ptsL = left_points[good[:, 0].astype(np.int64), :2]
+    ptsR = right_points[good[:, 1].astype(np.int64), :2]
+    colours = image[ptsL[:, 1].astype(np.int64), ptsL[:, 0].astype(np.int64)][:, [2, 1, 0, 3]].astype(np.int64)
+    return ptsL, ptsR, colours
+
+
+def filtering_benchmark(count: int = 60000, height: int = 4000, width: int = 6000, lowes_ratio: float = 0.8):
+    """
+    This function compares the match by match filtering and colouring with the array based one, on synthetic matches.
+    Args:
+        count (int)         = The number of the key points of each image (and of the queries).
+        height (int)        = The height of the synthetic image.
+        width (int)         = The width of the synthetic image.
+        lowes_ratio (float) = The Lowe's ratio.
+
+    Returns:
+        timings (dict) = The seconds of each implementation.
+
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    left_points = np.column_stack((rng.uniform(0, width - 1, count), rng.uniform(0, height - 1, count),
+                                   np.ones(count), np.zeros(count)))
+    right_points = np.column_stack((rng.uniform(0, width - 1, count), rng.uniform(0, height - 1, count),
+                                    np.ones(count), np.zeros(count)))
+    distances = np.sort(rng.uniform(0, 100, (count, 2)), axis=1)
+    trains = rng.integers(0, count, (count, 2))
+    matches = [[cv2.DMatch(i, int(trains[i, 0]), float(distances[i, 0])),
+                cv2.DMatch(i, int(trains[i, 1]), float(distances[i, 1]))] for i in range(0, count)]
+
+    start = time.perf_counter()
+    reference = loop_filtering(matches, left_points, right_points, image, lowes_ratio)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = vectorized_filtering(matches, left_points, right_points, image, lowes_ratio)
+    vectorized_time = time.perf_counter() - start
+
+    # The cv.KeyPoint coordinates are float32.
+    if not (np.allclose(reference[0], result[0], atol=1e-3) and np.allclose(reference[1], result[1], atol=1e-3)):
+        error_message('The vectorized points differ from the reference points', sysex=True)
+    if not np.array_equal(reference[2], result[2]):
+        error_message('The vectorized colours differ from the reference colours', sysex=True)
+
+    message(f'Filtering and colouring of {count} matches ({len(result[0])} good): loop {loop_time:.3f} s, '
+            f'vectorized {vectorized_time:.3f} s (x{loop_time / vectorized_time:.0f})')
+    return {'loop': loop_time, 'vectorized': vectorized_time}
+
+
+def loop_export(triangulated_pointsT, colours, path, name):
+    """
+    This function is the original (point by point) Triang.export_info of a front capture, kept as the reference.
+    Args:
+        triangulated_pointsT (numpy array) = The homogeneous points (x, y, z, w).
+        colours (numpy array)              = The colours (red, green, blue) and the labels of the points.
+        path (str)                         = The directory of the point clouds.
+        name (str)                         = The point cloud's name.
+
+    """
+    for i, point in enumerate(np.array(triangulated_pointsT)):
+        x = -point[0] / point[3]
+        y = point[2] / point[3] * 100
+        z = (point[1] / point[3])
+        if x > 10 or y > 10:
+            continue
+
+        wline = f'{x} {y} {z} {colours[i][0]} {colours[i][1]} {colours[i][2]} {colours[i][3]}\n'
+        write_a_file(path, name, '.txt', wline)
+        write_a_file(path, 'merged', '.txt', wline)
+        if colours[i][3] == 255:
+            write_a_file(path, 'edges', '.txt', wline)
+
+
+def export_benchmark(count: int = 200000):
+    """
+    This function compares the point by point export of a point cloud (an open/append/close per line) with the
+    buffered Triang.export_info, on synthetic points, and checks that they write the same files.
+    Args:
+        count (int) = The number of the points.
+
+    Returns:
+        timings (dict) = The seconds of each implementation.
+
+    """
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-5, 5, (count, 3)) * [1, 1, 0.05]
+    colours = np.column_stack((rng.integers(0, 256, (count, 3)), rng.choice([0, 255], count, p=[0.8, 0.2])))
+
+    # The exported point cloud of a multi-view reconstruction.
+    triang = Triang.__new__(Triang)
+    triang.capture, triang.cloud_suffix = 'front', '.txt'
+    Triang.set_reconstruction_result(triang, SimpleNamespace(get_points=lambda: points, get_colours=lambda: colours))
+
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as reference, tempfile.TemporaryDirectory() as buffered:
+        os.makedirs(f'{reference}/Lines')
+        start = time.perf_counter()
+        loop_export(triang.triangulated_pointsT, colours, f'{reference}/Lines', 'multiview')
+        loop_time = time.perf_counter() - start
+
+        os.chdir(buffered)
+        try:
+            start = time.perf_counter()
+            Triang.export_info(triang)
+            buffered_time = time.perf_counter() - start
+        finally:
+            os.chdir(directory)
+
+        for name in ['multiview.txt', 'merged.txt', 'edges.txt']:
+            if not filecmp.cmp(f'{reference}/Lines/{name}', f'{buffered}/Lines/{name}', shallow=False):
+                error_message(f'The buffered {name} differs from the reference', sysex=True)
+
+    message(f'Export of {count} points ({len(triang.points3d)} kept): point by point {loop_time:.2f} s, '
+            f'buffered {buffered_time:.2f} s (x{loop_time / buffered_time:.0f})')
+    return {'loop': loop_time, 'buffered': buffered_time}
+
+
+def clouds_benchmark(count: int = 500000):
+    """
+    This function compares the ASCII text (.txt) and the binary PLY point clouds i.e. their size and the time of their
+    writing, reading (read_txt_coordinates_to_list) and classification (classify_points).
+    Args:
+        count (int) = The number of the points.
+
+    Returns:
+        timings (dict) = The seconds of each format and stage.
+
+    """
+    rng = np.random.default_rng(0)
+    cloud = cloud_array(rng.uniform(-5, 5, (count, 3)),
+                        np.column_stack((rng.integers(0, 256, (count, 3)), rng.choice([0, 255], count, p=[0.8, 0.2]))))
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for suffix in ['.txt', '.ply']:
+            filename = f'{directory}/merged{suffix}'
+            start = time.perf_counter()
+            if suffix == '.txt':
+                with open(filename, 'w') as f:
+                    f.write(''.join(format_cloud(cloud)))
+            else:
+                write_cloud(filename, cloud)
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            # The ASCII texts have not a header, read_txt_coordinates_to_list reads all their lines.
+            points = read_txt_coordinates_to_list(directory, f'merged{suffix}')
+            read_time = time.perf_counter() - start
+            if not np.array_equal(np.asarray(points), np.column_stack((cloud['x'], cloud['y'], cloud['z']))):
+                error_message(f'The points of merged{suffix} differ from the written points', sysex=True)
+
+            start = time.perf_counter()
+            if suffix == '.txt':
+                # The classify_points of the TXT point_cloud_format, which skips the 15 lines header of the texts.
+                with open(filename, 'r') as f:
+                    lines = f.readlines()[15:]
+                detected = [line for line in lines if int(line.split(' ')[-1]) >= 230]
+                with open(f'{directory}/edges.txt', 'w') as f:
+                    f.write(''.join(detected))
+            else:
+                classify_points(directory, f'merged{suffix}', 'edges', method=2)
+            classify_time = time.perf_counter() - start
+
+            size = os.path.getsize(filename) / 1024 / 1024
+            message(f'{suffix[1:].upper()} point cloud of {count} points ({size:.1f} MB): write {write_time:.2f} s, '
+                    f'read {read_time:.2f} s, classify {classify_time:.2f} s')
+            timings[suffix] = {'write': write_time, 'read': read_time, 'classify': classify_time, 'megabytes': size}
+
+        if len(read_cloud(f'{directory}/edges.ply')) != int((cloud['label'] >= 230).sum()):
+            error_message('The classified binary point cloud has not all the labelled points', sysex=True)
+    return timings
+
+
+def labels_benchmark(height: int = 1000, width: int = 1500, repeats: int = 5):
+    """
+    This function compares the pixel by pixel label construction with the LabelRules engine on a synthetic annotation.
+    Args:
+        height (int)  = The height of the synthetic annotation.
+        width (int)   = The width of the synthetic annotation.
+        repeats (int) = How many times the LabelRules engine is executed.
+
+    Returns:
+        timings (dict) = The seconds per image of each implementation.
+
+    """
+    rng = np.random.default_rng(0)
+    simage = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    rules = LabelRules()
+
+    start = time.perf_counter()
+    reference = loop_labels(simage)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(0, repeats):
+        labels = rules.apply(simage)
+    rules_time = (time.perf_counter() - start) / repeats
+
+    if not np.array_equal(reference, labels):
+        error_message('The LabelRules labels differ from the reference labels', sysex=True)
+
+    message(f'Labels of a {width}x{height} annotation: loop {loop_time:.3f} s, LabelRules {rules_time:.5f} s '
+            f'(x{loop_time / rules_time:.0f})')
+    return {'loop': loop_time, 'rules': rules_time}
+
+
+def encoders_benchmark(directory: str = 'images', suffix: str = '.tiff', encoders: list = None):
+    """
+    This function reports, for each encoder, the bytes written and the encode/decode throughput on the given images.
+    Args:
+        directory (str) = The directory of the images i.e. the 4D images.
+        suffix (str)    = The suffix of the images.
+        encoders (list) = The compared encoders (ImageEncoder), by default TIFF and PNG variations.
+
+    Returns:
+        report (list) = For each encoder, its settings, the bytes and the encode/decode throughput (MB/s).
+
+    """
+    if encoders is None:
+        encoders = [ImageEncoder('tiff'), ImageEncoder('tiff', 'none'), ImageEncoder('tiff', 'lzw'),
+                    ImageEncoder('tiff', 'deflate'), ImageEncoder('tiff', 'lzw', depth=16),
+                    ImageEncoder('tiff', 'deflate', depth=16), ImageEncoder('png', level=1),
+                    ImageEncoder('png', level=3), ImageEncoder('png', level=6), ImageEncoder('png', level=9)]
+
+    imagesnames = find_files(directory, suffix)
+    if len(imagesnames) == 0:
+        error_message(f'There are 0 images into {directory} with {suffix} format', sysex=True)
+
+    report = []
+    for encoder in encoders:
+        raw_bytes = 0
+        written_bytes = 0
+        encode_time = 0
+        decode_time = 0
+        for imagename in imagesnames:
+            image = cv2.imread(f'{directory}/{imagename}', cv2.IMREAD_UNCHANGED)
+            raw_bytes += image.nbytes
+
+            start = time.perf_counter()
+            data = encoder.encode(image)
+            encode_time += time.perf_counter() - start
+            written_bytes += data.nbytes
+
+            start = time.perf_counter()
+            cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+            decode_time += time.perf_counter() - start
+
+        report.append({'encoder': encoder.describe(), 'bytes': written_bytes,
+                       'encode': raw_bytes / encode_time / 1e6, 'decode': raw_bytes / decode_time / 1e6})
+        message(f'{encoder}: {written_bytes / 1e6:.1f} MB ({written_bytes / raw_bytes:.0%} of raw), '
+                f'encode {report[-1]["encode"]:.0f} MB/s, decode {report[-1]["decode"]:.0f} MB/s')
+    return report
+
+
+def features_benchmark(method: str = 'Akaze', suffix: str = '.tiff', workers: list = None):
+    """
+    This function reports the feature extraction time of the 4D images (./images) for different worker counts. The
+    feature store is not used, thus every run extracts the features.
+    Args:
+        method (str)   = The feature extraction method (Akaze, Sift, Surf, ORB).
+        suffix (str)   = The suffix of the 4D images.
+        workers (list) = The compared worker counts, by default 1, 2, 4 ... up to the number of the CPUs.
+
+    Returns:
+        timings (dict) = The seconds of each worker count.
+
+    """
+    imagesnames = find_files('images', suffix)
+    if len(imagesnames) == 0:
+        error_message(f'There are 0 images into ./images with {suffix} format', sysex=True)
+    if workers is None:
+        workers = [1]
+        while workers[-1] * 2 <= os.cpu_count():
+            workers.append(workers[-1] * 2)
+        if workers[-1] != os.cpu_count():
+            workers.append(os.cpu_count())
+
+    timings = {}
+    reference = None
+    for count in workers:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=count, initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+            features = list(executor.map(extract_features, imagesnames, [method] * len(imagesnames)))
+        timings[count] = time.perf_counter() - start
+
+        points = [image['points'] for image in features]
+        if reference is None:
+            reference = points
+        elif not all(np.array_equal(a, b) for a, b in zip(reference, points)):
+            error_message(f'The features of {count} workers differ from the features of {workers[0]} worker(s)',
+                          sysex=True)
+
+        message(f'{method} features of {len(imagesnames)} images with {count} worker(s): {timings[count]:.2f} s '
+                f'(x{timings[workers[0]] / timings[count]:.2f})')
+    return timings
+
+
+def matchers_benchmark(method: str = 'Akaze', suffix: str = '.tiff', lowes_ratio: float = 0.8):
+    """
+    This function compares, on the binary descriptors of the 4D images (./images), the float kd-tree matching (the
+    descriptors converted to float32) with the Hamming distance matching (brute force and LSH) of the packed
+    descriptors. All the pairs of the images are matched.
+    Args:
+        method (str)        = The feature extraction method, with binary descriptors (Akaze, ORB).
+        suffix (str)        = The suffix of the 4D images.
+        lowes_ratio (float) = The ratio of the Lowe's test.
+
+    Returns:
+        report (dict) = For each matcher, the descriptors' size (bytes), the build and query times (seconds) and the
+                        number of the good matches.
+
+    """
+    imagesnames = find_files('images', suffix)
+    if len(imagesnames) < 2:
+        error_message(f'There are less than 2 images into ./images with {suffix} format', sysex=True)
+    descriptors = [extract_features(imagename, method)['descriptors'] for imagename in imagesnames]
+    if descriptors[0].dtype != np.uint8:
+        error_message(f'The {method} descriptors are not binary', sysex=True)
+
+    variations = {'kd-tree (float32)': (FlannIndexCache(), [d.astype(np.float32) for d in descriptors]),
+                  'Hamming brute force': (FlannIndexCache(binary_matcher='BRUTEFORCE'), descriptors),
+                  'Hamming LSH': (FlannIndexCache(binary_matcher='LSH'), descriptors)}
+    report = {}
+    for name, (matchers, variation) in variations.items():
+        good = 0
+        for j in range(1, len(variation)):
+            for i in range(0, j):
+                for match in matchers.knn_match(j, variation[j], variation[i], k=2):
+                    if len(match) == 2 and match[0].distance < lowes_ratio * match[1].distance:
+                        good += 1
+        report[name] = {'bytes': sum(d.nbytes for d in variation), 'build': matchers.get_build_time(),
+                        'query': matchers.get_query_time(), 'good': good}
+        message(f'{name}: descriptors {report[name]["bytes"] / 1e6:.1f} MB, build {report[name]["build"]:.3f} s, '
+                f'query {report[name]["query"]:.3f} s, {good} good matches')
+    return report
+
+
+def estimators_benchmark(method: str = 'Akaze', suffix: str = '.tiff', lowes_ratio: float = 0.8, threshold: float = 0.004,
+                         confidence: float = 0.999, repeats: int = 3):
+    """
+    This function compares the robust estimators of the essential matrix (runtime and inliers) on the matched pairs of
+    the 4D images (./images). The previous estimation (LMEDS on the points truncated to int32) is the reference.
+    Args:
+        method (str)        = The feature extraction method.
+        suffix (str)        = The suffix of the 4D images.
+        lowes_ratio (float) = The ratio of the Lowe's test.
+        threshold (float)   = The inliers' threshold (radians, see robust_matching_calib_threshold).
+        confidence (float)  = The confidence of the RANSAC and USAC estimators.
+        repeats (int)       = The repetitions of each estimation.
+
+    Returns:
+        report (dict) = For each estimator, the mean time (seconds) and the inliers of all the pairs.
+
+    """
+    imagesnames = find_files('images', suffix)
+    if len(imagesnames) < 2:
+        error_message(f'There are less than 2 images into ./images with {suffix} format', sysex=True)
+    cameras = CameraRegistry(None, 'rgb')
+    features = [extract_features(imagename, method) for imagename in imagesnames]
+    camera_matrices = [cameras.camera(imagename).get_camera_matrix() for imagename in imagesnames]
+
+    matchers = FlannIndexCache()
+    pairs = []
+    for j in range(1, len(imagesnames)):
+        for i in range(0, j):
+            descriptors_i, descriptors_j = features[i]['descriptors'], features[j]['descriptors']
+            if descriptors_i.dtype != np.uint8:
+                descriptors_i, descriptors_j = descriptors_i.astype(np.float32), descriptors_j.astype(np.float32)
+            good = ratio_test(matchers.knn_match(j, descriptors_j, descriptors_i, k=2), lowes_ratio)
+            good = good[np.argsort(good[:, 2], kind='stable')]
+            pairs.append((features[i]['points'][good[:, 0].astype(np.int64), :2],
+                          features[j]['points'][good[:, 1].astype(np.int64), :2], camera_matrices[i]))
+
+    variations = {'LMEDS (int32, reference)': ('LMEDS', True)}
+    variations.update({estimator: (estimator, False) for estimator in available_estimators()})
+    report = {}
+    for name, (estimator, truncated) in variations.items():
+        elapsed, inliers = 0, 0
+        for points1, points2, camera_matrix in pairs:
+            if truncated:
+                points1, points2 = np.int32(points1), np.int32(points2)
+            pixels = threshold * float(camera_matrix[0, 0])
+            for _ in range(0, repeats):
+                start = time.perf_counter()
+                _, mask = essential_matrix(points1, points2, camera_matrix, estimator, pixels, confidence)
+                elapsed += time.perf_counter() - start
+            inliers += int(mask.sum())
+        report[name] = {'time': elapsed / repeats, 'inliers': inliers}
+        message(f'{name}: {report[name]["time"] * 1000:.1f} ms, {inliers} inliers out of '
+                f'{sum(len(pair[0]) for pair in pairs)} matches ({len(pairs)} pairs)')
+    return report
+
+
+def synthetic_scene(shots: int = 6, count: int = 800, focal: float = 1000, noise: float = 0.5, duplicates: int = 20,
+                    focal_error: float = 0, seed: int = 0):
+    """
+    This function generates a synthetic scene for the Reconstruction i.e. random points, shots along a line, which look
+    at the points' center, and the images' key points (projections and noise) and the pairs' matches (all the pairs).
+    The first duplicates points of the first pair have a second key point in the first image, which is matched too,
+    thus their tracks are inconsistent.
+    Args:
+        shots (int)      = The number of the shots (images).
+        count (int)      = The number of the points.
+        focal (float)    = The focal length (pixels) of the camera, which is shared by all the shots.
+        noise (float)    = The standard deviation of the key points' noise (pixels).
+        duplicates (int) = The number of the inconsistent tracks.
+        focal_error (float) = The relative error of the images' focal length (i.e. of the EXIF).
+        seed (int)       = The seed of the random generator.
+
+    Returns:
+        scene (dict) = The points, the rotations, the translations, the camera matrix, the images and the pairs (the
+                       attributes and getters of Geometry.Image and PairMatch, which the Reconstruction uses), the
+                       point of each key point of each image and the duplicated points.
+
+    """
+    rng = np.random.default_rng(seed)
+    width, height = 1200, 800
+    camera_matrix = np.array([[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]])
+    points = np.column_stack((rng.uniform(-4, 4, count), rng.uniform(-3, 3, count), rng.uniform(8, 12, count)))
+    centers = np.column_stack((np.linspace(-3, 3, shots), rng.uniform(-0.2, 0.2, shots), np.zeros(shots)))
+
+    rotations = []
+    for center in centers:
+        axis_z = np.array([0, 0, 10]) - center
+        axis_z /= np.linalg.norm(axis_z)
+        axis_x = np.cross([0, 1, 0], axis_z)
+        axis_x /= np.linalg.norm(axis_x)
+        rotations.append(np.vstack((axis_x, np.cross(axis_z, axis_x), axis_z)))
+    rotations = np.array(rotations)
+    translations = -np.einsum('sij,sj->si', rotations, centers)
+
+    camera = SimpleNamespace(get_camera_id=lambda: 'synthetic')
+    images, point_ids = [], []
+    for rotation, translation in zip(rotations, translations):
+        camera_points = points @ rotation.T + translation
+        pixels = focal * camera_points[:, :2] / camera_points[:, 2:] + camera_matrix[:2, 2]
+        pixels += rng.normal(0, noise, pixels.shape)
+        visible = np.flatnonzero((camera_points[:, 2] > 0) & (pixels[:, 0] >= 0) & (pixels[:, 0] < width) &
+                                 (pixels[:, 1] >= 0) & (pixels[:, 1] < height))
+        ids = rng.permutation(visible)
+        point_ids.append(ids)
+        images.append(np.column_stack((pixels[ids], np.ones(len(ids)), np.zeros(len(ids)))))
+
+    # The duplicated points have a second (shifted) key point in the first image.
+    duplicated = np.intersect1d(point_ids[0], point_ids[1])[:duplicates]
+    second = images[0][np.searchsorted(point_ids[0], duplicated, sorter=np.argsort(point_ids[0]))]
+    first_count = len(point_ids[0])
+    images[0] = np.vstack((images[0], second + [0.3, 0.3, 0, 0]))
+    point_ids[0] = np.concatenate((point_ids[0], duplicated))
+
+    results = []
+    for left in range(0, shots):
+        for right in range(left + 1, shots):
+            # The key point of each point is its first key point (the duplicated ones are matched below).
+            left_index = {point: i for i, point in enumerate(point_ids[left][:first_count if left == 0 else None])}
+            right_index = {point: i for i, point in enumerate(point_ids[right])}
+            common = [point for point in left_index if point in right_index]
+            ids_left = np.array([left_index[point] for point in common], dtype=np.int64)
+            ids_right = np.array([right_index[point] for point in common], dtype=np.int64)
+            if (left, right) == (0, 1):
+                ids_left = np.concatenate((ids_left, first_count + np.arange(0, len(duplicated))))
+                ids_right = np.concatenate((ids_right, [right_index[point] for point in duplicated]))
+            results.append(SimpleNamespace(pair=[left, right], R=np.eye(3), idsL=ids_left, idsR=ids_right,
+                                           get_inliers=lambda a=ids_left, b=ids_right: (a, b)))
+
+    # The images' camera matrix is the prior (EXIF) one.
+    prior_matrix = camera_matrix * [[1 + focal_error], [1 + focal_error], [1]]
+    images = [SimpleNamespace(points=key_points, camera_matrix=prior_matrix, get_camera=lambda: camera,
+                              sample_points=lambda n=len(key_points): np.zeros((n, 4), dtype=np.uint8))
+              for key_points in images]
+    return {'points': points, 'rotations': rotations, 'translations': translations, 'camera_matrix': camera_matrix,
+            'images': images, 'results': results, 'point_ids': point_ids, 'duplicated': duplicated}
+
+
+def similarity_transform(source, target):
+    """
+    This function finds the similarity transformation (scale, rotation, translation), which maps the source points to
+    the target points in the least squares sense (Umeyama).
+    Args:
+        source (numpy array) = The source points (n x 3).
+        target (numpy array) = The target points (n x 3).
+
+    Returns:
+        transformed (numpy array) = The transformed source points.
+
+    """
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    source_centered, target_centered = source - source_mean, target - target_mean
+    u, d, vt = np.linalg.svd(target_centered.T @ source_centered / len(source))
+    sign = np.diag([1, 1, np.sign(np.linalg.det(u @ vt))])
+    rotation = u @ sign @ vt
+    scale = np.trace(np.diag(d) @ sign) / source_centered.var(axis=0).sum()
+    return scale * source_centered @ rotation.T + target_mean
+
+
+def scene_tracks_points(scene, reconstruction):
+    """This function returns the true point of each track (-1 if its observations are different points)"""
+    tracks = reconstruction.get_tracks()
+    observed = np.array([scene['point_ids'][image_id][feature_id] for image_id, feature_id in
+                         zip(tracks.get_image_ids(), tracks.get_feature_ids())], dtype=np.int64)
+    track_points = np.full(tracks.get_count(), -1)
+    track_points[tracks.get_track_ids()] = observed
+    consistent = np.bincount(tracks.get_track_ids(), weights=observed != track_points[tracks.get_track_ids()],
+                             minlength=tracks.get_count()) == 0
+    return np.where(consistent, track_points, -1)
+
+
+def reconstruction_benchmark(shots: int = 6, count: int = 800, noises: tuple = (0, 0.5)):
+    """
+    This function checks the Reconstruction (without bundle adjustment) on synthetic scenes (see synthetic_scene)
+    i.e. the inconsistent tracks are discarded, all the shots are registered and, without noise, the points are
+    recovered exactly (up to a similarity transformation). With noise, the points' error is reported.
+    Args:
+        shots (int)    = The number of the shots.
+        count (int)    = The number of the points.
+        noises (tuple) = The standard deviations of the key points' noise (pixels).
+
+    Returns:
+        errors (dict) = The RMS error of the recovered points (scene units, depth 8 - 12) of each noise.
+
+    """
+    errors = {}
+    for noise in noises:
+        scene = synthetic_scene(shots, count, noise=noise)
+        reconstruction = Reconstruction(scene['images'], scene['results'], default_config(), bundle_adjustment=False)
+
+        # The tracks: each point, which is seen by two images, is a track unless it is duplicated.
+        seen = np.bincount(np.concatenate([np.unique(ids) for ids in scene['point_ids']]), minlength=count)
+        expected = np.setdiff1d(np.flatnonzero(seen >= 2), scene['duplicated'])
+        track_points = scene_tracks_points(scene, reconstruction)
+        if np.any(track_points < 0) or not np.array_equal(np.sort(track_points), expected):
+            error_message(f'The tracks ({len(track_points)}) are not the {len(expected)} points, which are seen by '
+                          f'two images and they are not duplicated', sysex=True)
+        if sorted(reconstruction.get_registered()) != list(range(0, shots)):
+            error_message(f'Only the images {reconstruction.get_registered()} are registered', sysex=True)
+
+        points = reconstruction.get_points()
+        truth = scene['points'][track_points[reconstruction.get_point_tracks()]]
+        errors[noise] = float(np.sqrt(np.mean(np.sum((similarity_transform(points, truth) - truth) ** 2, axis=1))))
+        if len(points) < 0.95 * len(track_points) or (noise == 0 and errors[noise] > 1e-6):
+            error_message(f'{len(points)} out of {len(track_points)} points are recovered with RMS error '
+                          f'{errors[noise]:.2e} (noise {noise} pixels)', sysex=True)
+
+        message(f'Reconstruction of {shots} shots and {count} points (noise {noise} pixels): {len(track_points)} '
+                f'tracks ({len(scene["duplicated"])} inconsistent discarded), '
+                f'{len(reconstruction.get_registered())} shots registered, {len(points)} points with RMS error '
+                f'{errors[noise]:.2e} (scene depth 8 - 12)')
+    return errors
+
+
+def bundle_benchmark(shots: int = 6, count: int = 800, noise: float = 0.5, focal_error: float = 0.02,
+                     focal_sds: tuple = (None, 0.1)):
+    """
+    This function checks the bundle adjustment of the Reconstruction on a synthetic scene (see synthetic_scene), whose
+    images' (EXIF) focal length is wrong i.e. all the shots are registered, the points' error is lower than without
+    bundle adjustment and the initial pair's (unit) baseline is kept. The refined focal length is reported for each
+    standard deviation of its prior, since the prior (exif_focal_sd) weights the wrong focal length against the data.
+    Args:
+        shots (int)         = The number of the shots.
+        count (int)         = The number of the points.
+        noise (float)       = The standard deviation of the key points' noise (pixels).
+        focal_error (float) = The relative error of the images' focal length.
+        focal_sds (tuple)   = The standard deviations of the focal length's prior (None for the configuration's).
+
+    Returns:
+        focals (dict) = The refined focal length of each standard deviation.
+
+    """
+    scene = synthetic_scene(shots, count, noise=noise, focal_error=focal_error)
+    focal = scene['camera_matrix'][0, 0]
+
+    def points_error(reconstruction):
+        track_points = scene_tracks_points(scene, reconstruction)
+        points = reconstruction.get_points()
+        truth = scene['points'][track_points[reconstruction.get_point_tracks()]]
+        return float(np.sqrt(np.mean(np.sum((similarity_transform(points, truth) - truth) ** 2, axis=1))))
+
+    unadjusted = points_error(Reconstruction(scene['images'], scene['results'], default_config(),
+                                             bundle_adjustment=False))
+    focals = {}
+    for focal_sd in focal_sds:
+        config = default_config()
+        if focal_sd is not None:
+            config['exif_focal_sd'] = focal_sd
+        start = time.perf_counter()
+        reconstruction = Reconstruction(scene['images'], scene['results'], config)
+        seconds = time.perf_counter() - start
+
+        if sorted(reconstruction.get_registered()) != list(range(0, shots)):
+            error_message(f'Only the images {reconstruction.get_registered()} are registered', sysex=True)
+        rotations, translations = reconstruction.get_poses()
+        origin, second = reconstruction.get_registered()[:2]
+        centers = -np.einsum('sji,sj->si', rotations[[origin, second]], translations[[origin, second]])
+        baseline = float(np.linalg.norm(centers[0] - centers[1]))
+        if abs(baseline - 1) > 1e-3:
+            error_message(f'The initial pair\'s baseline drifted to {baseline:.4f}', sysex=True)
+        adjusted = points_error(reconstruction)
+        if adjusted >= unadjusted:
+            error_message(f'The bundle adjustment did not reduce the points\' RMS error ({unadjusted:.4f} --> '
+                          f'{adjusted:.4f})', sysex=True)
+
+        focals[focal_sd] = float(reconstruction.get_camera_matrices()[0][0, 0])
+        message(f'Bundle adjustment of {shots} shots and {count} points (noise {noise} pixels, EXIF focal '
+                f'{focal * (1 + focal_error):.0f} instead of {focal:.0f}, exif_focal_sd '
+                f'{config["exif_focal_sd"]}): RMS error {unadjusted:.4f} --> {adjusted:.4f} (scene depth 8 - 12), '
+                f'baseline {baseline:.6f}, focal {focals[focal_sd]:.1f} in {seconds:.2f} s')
+    return focals
+
+
+benchmarks = {'labels': labels_benchmark, 'encoders': encoders_benchmark, 'features': features_benchmark,
+              'matchers': matchers_benchmark, 'filtering': filtering_benchmark, 'export': export_benchmark,
+              'clouds': clouds_benchmark, 'estimators': estimators_benchmark,
+              'reconstruction': reconstruction_benchmark, 'bundle': bundle_benchmark}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            error_message(f'Unknown benchmark {name}, the available benchmarks are {list(benchmarks)}', sysex=True)
+        benchmarks[name]()
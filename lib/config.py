@@ -18,6 +18,9 @@ feature_root: 1               # If 1, apply square root mapping to features
 feature_min_frames: 4000      # If fewer frames are detected, sift_peak_threshold/surf_hessian_threshold is reduced.
 feature_process_size: 2048    # Resize the image if its size is larger than specified. Set to -1 for original size
 feature_use_adaptive_suppression: no
+feature_max_frames: 8000      # Maximum number of features kept per image by the adaptive suppression
+feature_suppression_cells: 32 # Number of the suppression grid's cells along the longest side of the image
+feature_label_weight: 1.0     # Response weight of the features on the label channel (label = 255) during the suppression
 
 # Params for SIFT
 sift_peak_threshold: 0.0001     # Smaller value -> more features default value = 0.1
@@ -47,11 +50,13 @@ hahog_normalize_to_uchar: yes
 lowes_ratio: 0.8              # Ratio test for matches
 matcher_type: FLANN           # FLANN, BRUTEFORCE, or WORDS
 symmetric_matching: yes       # Match symmetricly or one-way
+binary_matcher: LSH           # Matcher of the binary descriptors (AKAZE, ORB), LSH or BRUTEFORCE (Hamming distance)
 
 # Params for FLANN matching
 flann_branching: 8           # See OpenCV doc
 flann_iterations: 10          # See OpenCV doc
 flann_checks: 20             # Smaller -> Faster (but might lose good matches)
+flann_index_cache_size: 1024 # Memory bound (MB) of the FLANN indexes, which are kept for all the pairs of each image
 
 # Params for BoW matching
 bow_file: bow_hahog_root_uchar_10000.npz
@@ -75,9 +80,12 @@ matching_vlad_neighbors: 0            # Number of images to match selected by VL
 matching_vlad_gps_distance: 0         # Maximum GPS distance for preempting images before using selection by VLAD distance. Set to 0 to disable
 matching_vlad_gps_neighbors: 0        # Number of images (selected by GPS distance) to preempt before using selection by VLAD distance. Set to 0 to use no limit (or disable if matching_vlad_gps_distance is also 0)
 matching_vlad_other_cameras: False    # If True, VLAD image selection will use N neighbors from the same camera + N neighbors from any different camera.
+matching_thumbnail_neighbors: 0       # Number of images to match selected by thumbnail (global descriptor) similarity. Set to 0 to disable
 matching_use_filters: False           # If True, removes static matches using ad-hoc heuristics
 
 # Params for geometric estimation
+robust_estimator: RANSAC                # Robust estimator of the essential/fundamental matrix: RANSAC, LMEDS or a USAC variant of the OpenCV build (USAC_DEFAULT, USAC_MAGSAC, ...)
+robust_confidence: 0.999                # Confidence of the RANSAC/USAC estimators, they stop as soon as it is reached
 robust_matching_threshold: 0.004        # Outlier threshold for fundamental matrix estimation as portion of image width
 robust_matching_calib_threshold: 0.004  # Outlier threshold for essential matrix estimation during matching in radians
 robust_matching_min_match: 20           # Minimum number of matches to accept matches between two images
@@ -161,6 +169,7 @@ depthmap_save_debug_files: no         # Save debug files with partial reconstruc
 
 # Other params
 processes: 1                  # Number of threads to use
+point_cloud_format: PLY       # Format of the intermediate point clouds (merged, edges, LinesLabels): PLY (binary little-endian) or TXT (ASCII)
 
 # Params for submodel split and merge
 submodel_size: 80                                                    # Average number of images per submodel
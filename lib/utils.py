@@ -19,6 +19,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
 
+import hashlib
 import os
 import cv2 as cv
 import numpy as np
@@ -26,11 +27,14 @@ import sdxf
 import sys
 from pathlib import Path
 import datetime
+from lib.PointCloud import cloud_suffix, cloud_array, cloud_points, read_cloud, write_cloud
 
 
 def classify_points(path: str = '', filename: str = '', savefilename: str = '', t: int = 230, method: int = 0):
     """
-    This function classifies the point cloud into labelled and unlabelled points
+    This function classifies the point cloud into labelled and unlabelled points. The point clouds (.ply, binary or
+    ASCII, and .npy) are read by their fields, while the ASCII texts (.txt) are read line by line after a 15 lines
+    header. The labelled points are saved as savefilename + cloud_suffix (config's point_cloud_format).
     Args:
         path (str)         = Working directory.
         filename (str)     = Ppoint cloud file.
@@ -41,22 +45,39 @@ def classify_points(path: str = '', filename: str = '', savefilename: str = '',
     Returns:
 
     """
-    message('Save the detected points to edges.txt file ...')
-    detected_points = 0
-    savefile = f'{path}/{savefilename}.txt'
-    cleararchive(savefile)
+    message(f'Save the detected points to {savefilename}{cloud_suffix} file ...')
+    savefile = f'{path}/{savefilename}{cloud_suffix}'
+    if not filename.endswith('.txt'):
+        cloud = read_cloud(f'{path}/{filename}')
+        label = cloud[cloud.dtype.names[-1]] if method == 0 or method == 2 else cloud[cloud.dtype.names[-2]]
+        detected = cloud[label >= t]
+        write_cloud(savefile, detected)
+        message(f'{len(detected)} points are saved!')
+        return
+
     with open(f'{path}/{filename}', 'r') as f:
         all_lines = f.readlines()
-        for line in all_lines[15:]:
-            splitline = line.split(' ')
-            if method == 0 or method == 2:
-                label = int(splitline[-1])
-            else:
-                label = int(splitline[-2])
-            if label >= t:
-                detected_points += 1
-                write_a_file(path, savefilename, '.txt', line)
-    message(f'{detected_points} points are saved!')
+    detected_lines = []
+    for line in all_lines[15:]:
+        splitline = line.split(' ')
+        if method == 0 or method == 2:
+            label = int(splitline[-1])
+        else:
+            label = int(splitline[-2])
+        if label >= t:
+            detected_lines.append(line)
+
+    if cloud_suffix == '.txt':
+        cleararchive(savefile)
+        write_lines(path, savefilename, '.txt', detected_lines)
+    else:
+        values = np.loadtxt(detected_lines, ndmin=2) if detected_lines else np.empty((0, 7))
+        if values.shape[1] == 7:
+            write_cloud(savefile, cloud_array(values[:, :3], values[:, 3:]))
+        else:
+            write_cloud(savefile, cloud_array(values[:, :3], values[:, 3:],
+                                              [(f'property{i}', '<f8') for i in range(3, values.shape[1])]))
+    message(f'{len(detected_lines)} points are saved!')
 
 
 def convert_points_2_cvkeypoints(points):
@@ -110,6 +131,24 @@ def export2ply(points3d: list = [], colors: list = [], filename: str = ''):
         np.savetxt(f, points3d, '%f %f %f %d %d %d')
 
 
+def file_hash(filename: str = '', chunk_size: int = 1 << 20):
+    """
+    This function calculates the content hash (sha1) of a file, reading it in chunks.
+    Args:
+        filename (str)   = The name of the file.
+        chunk_size (int) = The size of each chunk (bytes).
+
+    Returns:
+        digest (str) = The hexadecimal digest of the file's content.
+
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
 def find_files(file_path: str = '', file_suffix: str = ''):
     """
     This function finds all the files that a directory contains with a specific suffix.
@@ -270,7 +309,8 @@ def points2clusters(points, labels, label):
 def read_txt_coordinates_to_list(path2folder: str = '', txtfilename: str = '', seperator: str = ' ',
                                  colour: bool = False):
     """
-    This function reads the points' coordinates and colors from a .txt archive and adds them into a list.
+    This function reads the points' coordinates and colors from a .txt archive and adds them into a list. The point
+    clouds (.ply, .npy) are read as arrays (see read_cloud).
     Args:
         path2folder (str)  = The path to the folder, contains the .txt archive.
         txtfilename (str)  = The name of the .txt archive.
@@ -278,10 +318,19 @@ def read_txt_coordinates_to_list(path2folder: str = '', txtfilename: str = '', s
         colour      (bool) = If the point cloud contains the color information or not.
 
     Returns:
-        points (list) = The points.
-        colors (list) = The colors.
+        points (list/numpy array) = The points.
+        colors (list/numpy array) = The colors.
 
     """
+    if not txtfilename.endswith('.txt'):
+        cloud = read_cloud(f'{path2folder}/{txtfilename}')
+        points = cloud_points(cloud)
+        if not colour:
+            return points
+        if 'red' in cloud.dtype.names:
+            return points, np.column_stack((cloud['red'], cloud['green'], cloud['blue'])).astype(np.int64)
+        return points, np.column_stack([cloud[name] for name in cloud.dtype.names[6:9]]).astype(np.int64)
+
     with open(f'{path2folder}/{txtfilename}') as txtfile:
         points = []
         colours = []
@@ -334,6 +383,25 @@ def write_a_file(writing_path: str = '', filename: str = '', suffix: str = '', l
     f.close()
 
 
+def write_lines(writing_path: str = '', filename: str = '', suffix: str = '', lines: list = None):
+    """
+    This function appends many lines into an archive, in a single buffered pass (see write_a_file). Nothing is
+    written (or created) if there are not any lines.
+    Args:
+        writing_path (str)  = The path in which the file will be saved.
+        filename (str)      = The name of the archive which will be saved into the writing_path.
+        suffix (str)        = The saffix of the archive.
+        lines (list)        = The lines which will be write into the produced archive (None for no lines).
+
+    Returns:
+
+    """
+    if lines is None or len(lines) == 0:
+        return
+    with open(f'{writing_path}/{filename}{suffix}', 'a', buffering=1 << 20) as f:
+        f.write(''.join(lines))
+
+
 def cleararchive(file):
     """
     This function clears an existing archive